@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Generation of the queued HTML abstracts
+
+Writing a collection or a module's ``index.cnxml`` queues its abstract
+in ``html_abstract_queue`` when the abstract has no HTML yet. The queued
+abstracts are transformed once per statement, at the end of it.
+When the ``cnxdb.html_abstract_mode`` setting is ``'async'``
+(e.g. ``ALTER DATABASE ... SET cnxdb.html_abstract_mode = 'async'``),
+they are left in the queue instead, and the functions here transform them
+outside of the publishing transaction.
+
+An abstract whose transformation fails stays in the queue, with the error,
+and is retried after the other abstracts, up to ``MAX_ATTEMPTS`` times.
+
+"""
+import psycopg2
+
+from cnxdb.queues import claim_batch_params, claim_batch_sql
+
+BATCH_SIZE = 100
+
+#: Abstracts that failed this many times are no longer claimed
+MAX_ATTEMPTS = 3
+
+CLAIM_BATCH = claim_batch_sql('html_abstract_queue', 'abstractid',
+                              order_by='attempts, queued',
+                              where='attempts < %(max_attempts)s')
+
+# The abstracts given HTML since they were queued (e.g. by a transaction
+# not running in async mode) are only dequeued.
+GENERATE = """\
+WITH queued AS (
+  DELETE FROM html_abstract_queue WHERE abstractid = %s
+  RETURNING abstractid, module_ident
+)
+UPDATE abstracts a SET html = html_abstract(a.abstract, q.module_ident)
+FROM queued q
+WHERE a.abstractid = q.abstractid AND a.html IS NULL"""
+
+FAIL = """\
+UPDATE html_abstract_queue SET attempts = attempts + 1, error = %s
+WHERE abstractid = %s"""
+
+
+def process_html_abstract_queue(cursor, batch_size=BATCH_SIZE,
+                                max_attempts=MAX_ATTEMPTS):
+    """Transforms a batch of the queued abstracts to HTML.
+    The transformation and the removal from the queue happen in the
+    cursor's transaction, which the caller commits. Each abstract is
+    transformed in a savepoint, so a failure is recorded in the queue
+    without aborting the rest of the batch.
+
+    :param cursor: database cursor
+    :param int batch_size: maximum number of abstracts to transform
+    :param int max_attempts: the abstracts that already failed this
+        many times are skipped
+    :return: the abstractids of the processed abstracts and of the
+        abstracts that failed
+    :rtype: tuple
+
+    """
+    cursor.execute(CLAIM_BATCH, claim_batch_params(
+        batch_size, max_attempts=max_attempts))
+    abstractids = [row[0] for row in cursor.fetchall()]
+    processed = []
+    failed = []
+    for abstractid in abstractids:
+        cursor.execute("SAVEPOINT gen_html_abstract")
+        try:
+            cursor.execute(GENERATE, (abstractid,))
+        except psycopg2.Error as exc:
+            cursor.execute("ROLLBACK TO SAVEPOINT gen_html_abstract")
+            cursor.execute(FAIL, (str(exc), abstractid))
+            failed.append(abstractid)
+        else:
+            cursor.execute("RELEASE SAVEPOINT gen_html_abstract")
+            processed.append(abstractid)
+    return processed, failed
+
+
+__all__ = (
+    'process_html_abstract_queue',
+)
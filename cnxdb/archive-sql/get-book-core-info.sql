@@ -16,7 +16,9 @@ WITH RECURSIVE t(node, title, path, value, is_collated) AS (
       documentid,
       is_collated
     FROM trees AS tr, modules AS m
-    WHERE ident_hash(m.uuid, m.major_version, m.minor_version) = %(ident_hash)s
+    WHERE m.uuid = ident_hash_uuid(%(ident_hash)s)
+     AND module_version_is(m.major_version, m.minor_version,
+                           ident_hash_version(%(ident_hash)s))
      AND tr.documentid = m.module_ident
      AND tr.is_collated = %(is_collated)s
 
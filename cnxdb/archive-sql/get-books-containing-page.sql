@@ -6,54 +6,41 @@
 -- ###
 
 -- arguments: document_uuid:string; document_version:string
-WITH RECURSIVE t(node, title, parent, path, value) AS (
-  SELECT nodeid, title, parent_id, ARRAY[nodeid], documentid
-  FROM trees tr, modules m
-  WHERE m.uuid = %(document_uuid)s::uuid
-  AND module_version(m.major_version, m.minor_version) = %(document_version)s
-  AND tr.documentid = m.module_ident
-  AND tr.parent_id IS NOT NULL
-UNION ALL
-  SELECT c1.nodeid, c1.title, c1.parent_id,
-         t.path || ARRAY[c1.nodeid], c1.documentid
-  FROM trees c1
-  JOIN t ON (c1.nodeid = t.parent)
-  WHERE not nodeid = any (t.path)
-),
-
-books(uuid, major_version, minor_version, title, revised, authors, authorUsernames) AS (
-  SELECT m.uuid, m.major_version, m.minor_version, COALESCE(t.title, m.name), m.revised,
-         (SELECT ARRAY(
-           SELECT row_to_json(user_row) FROM
-             (SELECT u.username,
-             u.first_name as firstname, u.last_name as surname,
-             u.full_name as fullname, u.title, u.suffix)
-
-           as user_row)),
-          m.authors
-  FROM t
-  JOIN modules m ON t.value = m.module_ident
-  JOIN users as u on u.username = ANY(m.authors)
-  WHERE t.parent IS NULL
-  ORDER BY uuid, major_version desc, minor_version desc
-),
 
-page(authors) as (
-  SELECT authors FROM modules m
-  WHERE m.uuid = %(document_uuid)s::uuid
-  AND module_version(m.major_version, m.minor_version) = %(document_version)s
+-- The latest version of each book containing the page (see page_books),
+-- among the versions with at least one author in users
+WITH books AS (
+  SELECT DISTINCT ON (m.uuid)
+         m.uuid, m.major_version, m.minor_version,
+         COALESCE(r.title, m.name) AS title, m.revised, m.authors,
+         p.authors AS page_authors
+  FROM modules p
+    JOIN page_books pb ON pb.page_ident = p.module_ident
+    JOIN modules m ON m.module_ident = pb.book_ident
+    JOIN trees r ON r.nodeid = pb.book_nodeid
+  WHERE p.uuid = %(document_uuid)s::uuid
+  AND module_version_is(p.major_version, p.minor_version, %(document_version)s)
+  AND EXISTS (SELECT 1 FROM users u WHERE u.username = ANY (m.authors))
+  ORDER BY m.uuid, m.major_version desc, m.minor_version desc
 ),
 
-top_books(title, ident_hash, short_ident_hash, authors, revised, authorUsernames) AS (
-SELECT first(title),
-       ident_hash(uuid, first(major_version), first(minor_version)),
-       short_ident_hash(uuid, first(major_version), first(minor_version)),
-       first(authors),
-       first(revised),
-       first(authorUsernames)
-  FROM books GROUP BY uuid
+-- The authors of all the books, fetched at once
+authors(username, author) AS (
+  SELECT u.username, row_to_json(user_row)
+  FROM users u,
+       LATERAL (SELECT u.username,
+                       u.first_name as firstname, u.last_name as surname,
+                       u.full_name as fullname, u.title, u.suffix) AS user_row
+  WHERE u.username IN (SELECT unnest(authors) FROM books)
 )
 
-SELECT tb.title, tb.ident_hash, tb.short_ident_hash as shortId, tb.authors, tb.revised
-  FROM top_books tb, page p
-  ORDER BY tb.authorUsernames = p.authors DESC, tb.revised DESC
+SELECT b.title,
+       ident_hash(b.uuid, b.major_version, b.minor_version),
+       short_ident_hash(b.uuid, b.major_version, b.minor_version) as shortId,
+       ARRAY(SELECT a.author
+             FROM unnest(b.authors) WITH ORDINALITY AS ba(username, position)
+               JOIN authors a ON a.username = ba.username
+             ORDER BY ba.position) as authors,
+       b.revised
+  FROM books b
+  ORDER BY b.authors = b.page_authors DESC, b.revised DESC
@@ -6,12 +6,18 @@
 -- ###
 
 -- arguments[positional]: ident_hash:string; context_ident_hash:string
+WITH args (item_hash, context_hash) AS (VALUES (%s::text, %s::text))
 SELECT f.file
-FROM collated_file_associations AS cfa
+FROM args,
+     collated_file_associations AS cfa
   NATURAL JOIN files AS f,
                modules AS context,
                modules AS item
 WHERE cfa.context = context.module_ident AND
       cfa.item = item.module_ident AND
-      ident_hash(item.uuid, item.major_version, item.minor_version) = %s AND
-      ident_hash(context.uuid, context.major_version, context.minor_version) = %s
+      item.uuid = ident_hash_uuid(args.item_hash) AND
+      module_version_is(item.major_version, item.minor_version,
+                        ident_hash_version(args.item_hash)) AND
+      context.uuid = ident_hash_uuid(args.context_hash) AND
+      module_version_is(context.major_version, context.minor_version,
+                        ident_hash_version(args.context_hash))
@@ -9,6 +9,6 @@
 select is_collated 
 FROM trees AS t
   JOIN modules AS m ON t.documentid = m.module_ident
-WHERE uuid = %(uuid)s AND module_version(m.major_version,m.minor_version) = %(version)s
+WHERE uuid = %(uuid)s AND module_version_is(m.major_version, m.minor_version, %(version)s)
 ORDER BY is_collated DESC
 LIMIT 1;
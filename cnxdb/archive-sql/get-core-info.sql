@@ -11,4 +11,6 @@ SELECT module_ident, portal_type AS type, name AS title, uuid,
        module_version(major_version, minor_version) AS version,
        ident_hash(uuid, major_version, minor_version) AS ident_hash
 FROM modules
-WHERE ident_hash(uuid, major_version, minor_version) = %(ident_hash)s;
+WHERE uuid = ident_hash_uuid(%(ident_hash)s)
+      AND module_version_is(major_version, minor_version,
+                            ident_hash_version(%(ident_hash)s));
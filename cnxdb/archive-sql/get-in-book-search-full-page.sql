@@ -12,8 +12,8 @@ FROM
   trees tr, 
   modules m
 WHERE 
-  m.uuid::text = %(uuid)s AND
-  module_version(m.major_version, m.minor_version) = %(version)s AND
+  m.uuid = to_uuid(%(uuid)s) AND
+  module_version_is(m.major_version, m.minor_version, %(version)s) AND
   tr.documentid = m.module_ident AND
   tr.parent_id IS NULL
 UNION ALL
@@ -12,8 +12,8 @@ FROM
   trees tr, 
   modules m
 WHERE 
-  m.uuid::text = %(uuid)s AND
-  module_version(m.major_version, m.minor_version) = %(version)s AND
+  m.uuid = to_uuid(%(uuid)s) AND
+  module_version_is(m.major_version, m.minor_version, %(version)s) AND
   tr.documentid = m.module_ident AND
   tr.parent_id IS NULL AND
   is_collated = True
@@ -47,7 +47,7 @@ WHERE
  cft.context = book.module_ident AND
  cfa.context = book.module_ident AND
  book.uuid = (%(uuid)s) AND
- module_version(book.major_version, book.minor_version) = %(version)s
+ module_version_is(book.major_version, book.minor_version, %(version)s)
 ORDER BY
  rank,
  path
@@ -117,7 +117,7 @@ FROM modules m
 WHERE
   m.licenseid = l.licenseid AND
   m.uuid = %(id)s AND
-  module_version(m.major_version, m.minor_version) = %(version)s
+  module_version_is(m.major_version, m.minor_version, %(version)s)
 GROUP BY
   m.moduleid, m.portal_type, current_version, m.name, m.created, m.revised,
   a.html, m.stateid, m.doctype, l.code, l.name, l.version, l.url,
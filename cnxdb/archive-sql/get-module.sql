@@ -42,7 +42,7 @@ LEFT JOIN modules p on m.parent = p.module_ident
 LEFT JOIN moduletags mt on m.module_ident = mt.module_ident NATURAL LEFT JOIN tags
 WHERE
 m.uuid = %(id)s AND
- module_version(m.major_version, m.minor_version) = %(version)s AND
+ module_version_is(m.major_version, m.minor_version, %(version)s) AND
 mf.filename = %(filename)s
 GROUP BY
 m.uuid, m.portal_type, current_version, m.name, m.created, m.revised, abstract, m.stateid, m.doctype,
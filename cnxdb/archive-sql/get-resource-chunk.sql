@@ -0,0 +1,15 @@
+-- ###
+-- Copyright (c) 2019, Rice University
+-- This software is subject to the provisions of the GNU Affero General
+-- Public License version 3 (AGPLv3).
+-- See LICENCE.txt for details.
+-- ###
+
+-- Reads length bytes of a file, starting at the zero based offset.
+-- Only the TOAST chunks in that range are read when the file is stored
+-- uncompressed, as are most large media (e.g. images, PDFs), which do not
+-- compress. The compressed (e.g. text) files are decompressed first.
+-- arguments: fileid:integer; offset:integer; length:integer
+SELECT substring(f.file FROM %(offset)s + 1 FOR %(length)s)
+FROM files AS f
+WHERE f.fileid = %(fileid)s;
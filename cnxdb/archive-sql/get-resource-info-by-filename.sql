@@ -0,0 +1,16 @@
+-- ###
+-- Copyright (c) 2019, Rice University
+-- This software is subject to the provisions of the GNU Affero General
+-- Public License version 3 (AGPLv3).
+-- See LICENCE.txt for details.
+-- ###
+
+-- Resolves a module's file to its fileid without reading the file content.
+-- arguments: id:string; version:string; filename:string
+SELECT f.fileid, f.media_type, f.size, f.sha1
+FROM modules AS m
+  JOIN module_files AS mf ON mf.module_ident = m.module_ident
+  JOIN files AS f ON f.fileid = mf.fileid
+WHERE m.uuid = to_uuid(%(id)s) AND
+      module_version_is(m.major_version, m.minor_version, %(version)s) AND
+      mf.filename = %(filename)s;
@@ -0,0 +1,12 @@
+-- ###
+-- Copyright (c) 2019, Rice University
+-- This software is subject to the provisions of the GNU Affero General
+-- Public License version 3 (AGPLv3).
+-- See LICENCE.txt for details.
+-- ###
+
+-- Resolves a file hash to its fileid without reading the file content.
+-- arguments: hash:string
+SELECT f.fileid, f.media_type, f.size, f.sha1
+FROM files AS f
+WHERE f.sha1 = %(hash)s OR f.md5 = %(hash)s;
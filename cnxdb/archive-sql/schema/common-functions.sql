@@ -14,11 +14,7 @@ SELECT iso8601(current_timestamp), current_timestamp;
 CREATE OR REPLACE FUNCTION idx(anyarray, anyelement)
   RETURNS INT AS 
 $$
-  SELECT i FROM (
-     SELECT generate_series(array_lower($1,1),array_upper($1,1))
-  ) g(i)
-  WHERE $1[i] = $2
-  LIMIT 1;
+  SELECT array_position($1, $2);
 $$ LANGUAGE SQL IMMUTABLE;
 
 -- Returns the Python `sys.path`
@@ -6,3 +6,6 @@ CREATE EXTENSION tsearch2;
 
 -- pg_trgm is used for modules name (title) indexing and search.
 CREATE EXTENSION pg_trgm;
+
+-- pgcrypto provides the digest and random uuid generation functions.
+CREATE EXTENSION pgcrypto;
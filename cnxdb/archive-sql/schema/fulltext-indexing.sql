@@ -37,6 +37,50 @@ CREATE OR REPLACE FUNCTION xml_to_baretext(xml) RETURNS text AS $$
 </xsl:stylesheet>
 $$ LANGUAGE xslt;
 
+-- An lxml based equivalent of xml_to_baretext. It works on the raw file
+-- content, which saves the parse done by the cast to xml, and strips the
+-- nodes in C rather than through an XSLT transform.
+CREATE OR REPLACE FUNCTION xml_to_baretext_lxml(content bytea)
+  RETURNS text
+  LANGUAGE plpythonu
+  STRICT
+AS $$
+  from lxml import etree
+
+  if 'parser' not in SD:
+      SD['parser'] = etree.XMLParser(resolve_entities=False, huge_tree=True)
+  root = etree.fromstring(content, SD['parser'])
+  etree.strip_elements(root,
+                       '{http://cnx.rice.edu/mdml}*',
+                       '{http://cnx.rice.edu/mdml/0.4}*',
+                       '{http://www.w3.org/1999/xhtml}cnx-pi',
+                       with_tail=False)
+  return etree.tostring(root, method='text', encoding='unicode')
+$$;
+
+-- Extracts the text used for fulltext indexing from a file.
+-- The extractor is selected by the ``cnxdb.baretext_extractor`` setting,
+-- either 'xslt' (the default) or 'lxml'. For example,
+-- ``ALTER DATABASE ... SET cnxdb.baretext_extractor = 'lxml'``.
+CREATE OR REPLACE FUNCTION fulltext_baretext(content bytea)
+  RETURNS text
+  LANGUAGE plpgsql
+AS $$
+  DECLARE
+    extractor text;
+  BEGIN
+    BEGIN
+      extractor := current_setting('cnxdb.baretext_extractor');
+    EXCEPTION WHEN undefined_object THEN
+      extractor := 'xslt';
+    END;
+    IF extractor = 'lxml' THEN
+      RETURN xml_to_baretext_lxml(content);
+    END IF;
+    RETURN xml_to_baretext(convert_from(content, 'UTF8')::xml)::text;
+  END;
+$$;
+
 CREATE OR REPLACE FUNCTION count_lexemes(myident integer, mysearch text)
  RETURNS bigint
  LANGUAGE sql
@@ -70,7 +114,7 @@ CREATE OR REPLACE FUNCTION index_fulltext_trigger()
 
   BEGIN
     has_existing_record := (SELECT module_ident FROM modulefti WHERE module_ident = NEW.module_ident);
-    _baretext := (SELECT xml_to_baretext(convert_from(f.file, 'UTF8')::xml)::text
+    _baretext := (SELECT fulltext_baretext(f.file)
                     FROM files AS f WHERE f.fileid = NEW.fileid);
     _keyword := (SELECT LIST(k.word) FROM keywords k INNER JOIN modulekeywords m
                    ON k.keywordid = m.keywordid
@@ -144,7 +188,7 @@ CREATE OR REPLACE FUNCTION index_collated_fulltext_trigger()
     _idx_vectors tsvector;
   BEGIN
     has_existing_record := (SELECT item FROM collated_fti WHERE item = NEW.item and context = NEW.context);
-    _baretext := (SELECT xml_to_baretext(convert_from(f.file, 'UTF8')::xml)::text FROM files AS f WHERE f.fileid = NEW.fileid);
+    _baretext := (SELECT fulltext_baretext(f.file) FROM files AS f WHERE f.fileid = NEW.fileid);
     _idx_vectors := to_tsvector(_baretext);
 
     IF has_existing_record IS NULL THEN
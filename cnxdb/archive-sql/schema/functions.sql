@@ -1,25 +1,72 @@
-CREATE OR REPLACE FUNCTION uuid_generate_v4 () RETURNS uuid LANGUAGE plpythonu AS $$ import uuid; return uuid.uuid4() $$ ;
-CREATE OR REPLACE FUNCTION uuid5 (namespace uuid, name text) RETURNS uuid LANGUAGE plpythonu AS $$ import uuid; return uuid.uuid5(uuid.UUID(namespace), name) $$ ;
+CREATE OR REPLACE FUNCTION uuid_generate_v4 () RETURNS uuid LANGUAGE sql VOLATILE AS $$ SELECT gen_random_uuid() $$ ;
+
+-- RFC 4122 name based (SHA-1) uuid, equivalent to python's uuid.uuid5
+CREATE OR REPLACE FUNCTION uuid5 (namespace uuid, name text)
+  RETURNS uuid
+  LANGUAGE sql
+  IMMUTABLE
+  STRICT
+AS $$
+  SELECT encode(
+           set_byte(
+             set_byte(h, 6, (get_byte(h, 6) & 15) | 80),
+             8, (get_byte(h, 8) & 63) | 128),
+           'hex')::uuid
+  FROM (SELECT substring(digest(uuid_send(namespace) ||
+                                convert_to(name, 'UTF8'), 'sha1')
+                         FROM 1 FOR 16) AS h) AS d
+$$ ;
 CREATE OR REPLACE FUNCTION "comma_cat" (text,text) RETURNS text AS 'select case WHEN $2 is NULL or $2 = '''' THEN $1 WHEN $1 is NULL or $1 = '''' THEN $2 ELSE $1 || '','' || $2 END' LANGUAGE 'sql';
 
 CREATE OR REPLACE FUNCTION "semicomma_cat" (text,text) RETURNS text AS 'select case WHEN $2 is NULL or $2 = '''' THEN $1 WHEN $1 is NULL or $1 = '''' THEN $2 ELSE $1 || '';--;'' || $2 END' LANGUAGE 'sql';
 
 CREATE OR REPLACE FUNCTION sha1(file text)
  RETURNS text
- LANGUAGE plpythonu
+ LANGUAGE sql
  IMMUTABLE STRICT
 AS $function$
-import hashlib
-return hashlib.new('sha1', file).hexdigest()
+SELECT encode(digest(file, 'sha1'), 'hex')
 $function$;
 
 CREATE OR REPLACE FUNCTION sha1(f bytea)
  RETURNS text
- LANGUAGE plpythonu
+ LANGUAGE sql
  IMMUTABLE STRICT
 AS $function$
-import hashlib
-return hashlib.new('sha1',f).hexdigest()
+SELECT encode(digest(f, 'sha1'), 'hex')
+$function$;
+
+-- Content addressed insert-or-get of a file. Returns the fileid of the file
+-- with the same content (sha1) when there is one, otherwise inserts it.
+-- The media_type may be NULL, the content may not.
+CREATE OR REPLACE FUNCTION get_or_insert_file(content bytea, media_type text)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  _sha1 text := sha1(content);
+  _fileid integer;
+BEGIN
+  IF content IS NULL THEN
+    RAISE EXCEPTION USING
+      ERRCODE = 'null_value_not_allowed',
+      MESSAGE = 'get_or_insert_file: the file content must not be NULL';
+  END IF;
+  LOOP
+    SELECT fileid INTO _fileid FROM files WHERE sha1 = _sha1;
+    IF FOUND THEN
+      RETURN _fileid;
+    END IF;
+    BEGIN
+      INSERT INTO files (file, media_type)
+        VALUES (content, media_type)
+        RETURNING fileid INTO _fileid;
+      RETURN _fileid;
+    EXCEPTION WHEN unique_violation THEN
+      -- inserted concurrently, loop to select it
+    END;
+  END LOOP;
+END;
 $function$;
 
 CREATE OR REPLACE FUNCTION title_order(text) RETURNS text AS $$
@@ -45,38 +92,29 @@ CREATE OR REPLACE FUNCTION req(text) RETURNS text AS $$
 select regexp_replace($1,E'([.()?[\\]\\{}*+|])',E'\\\\\\1','g')
 $$ language sql immutable;
 
+-- PostgreSQL >= 9.5 provides a builtin array_position(anyarray, anyelement).
+-- pg_catalog is searched first, so unqualified calls resolve to the builtin
+-- where it exists and to this single pass fallback otherwise.
 CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYELEMENT)
 RETURNS INTEGER
 IMMUTABLE STRICT
-LANGUAGE PLPGSQL
+LANGUAGE SQL
 AS $$
-BEGIN
-  for i in array_lower($1,1) .. array_upper($1,1)
-  LOOP
-    IF ($1[i] = $2)
-    THEN
-      RETURN i;
-    END IF;
-  END LOOP;
-  RETURN NULL;
-END;
+  SELECT a.i::integer + array_lower($1, 1) - 1
+  FROM unnest($1) WITH ORDINALITY AS a(e, i)
+  WHERE a.e = $2
+  LIMIT 1
 $$;
 
 CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYARRAY)
 RETURNS INTEGER
 IMMUTABLE STRICT
-LANGUAGE PLPGSQL
+LANGUAGE SQL
 AS $$
-BEGIN
-  for i in array_lower($1,1) .. array_upper($1,1)
-  LOOP
-    IF ($1[i:i] = $2)
-    THEN
-      RETURN i;
-    END IF;
-  END LOOP;
-  RETURN NULL;
-END;
+  SELECT a.i::integer + array_lower($1, 1) - 1
+  FROM unnest($1) WITH ORDINALITY AS a(e, i)
+  WHERE ARRAY[a.e] = $2
+  LIMIT 1
 $$;
 
 
@@ -109,6 +147,17 @@ AS $$
   return html_abstract
 $$ LANGUAGE plpythonu;
 
+-- Same as html_abstract(module_ident), for an abstract already at hand
+CREATE OR REPLACE FUNCTION html_abstract(abstract text, module_ident int)
+  RETURNS text
+AS $$
+  from cnxtransforms import transform_abstract_to_html
+  html_abstract, warning_messages = transform_abstract_to_html(abstract, module_ident, plpy)
+  if warning_messages:
+    plpy.warning(warning_messages)
+  return html_abstract
+$$ LANGUAGE plpythonu;
+
 -- Deprecated (3-Feb-2015) Use html_content(module_ident int)
 --            This was deprecated to align the call params with
 --            synonymous function cnxml_content, which requires
@@ -164,9 +213,8 @@ $$ LANGUAGE plpythonu;
 CREATE OR REPLACE FUNCTION strip_html(html_text TEXT)
   RETURNS text
 AS $$
-  import re
-  return re.sub('<[^>]*?>', '', html_text, re.MULTILINE)
-$$ LANGUAGE plpythonu IMMUTABLE;
+  SELECT regexp_replace(html_text, '<[^>]*>', '', 'g')
+$$ LANGUAGE sql IMMUTABLE;
 
 CREATE OR REPLACE FUNCTION module_version(major int, minor int)
   RETURNS text
@@ -184,7 +232,8 @@ AS $function$
 SELECT bool_or(is_collated)
     FROM modules JOIN trees
         ON module_ident = documentid
-    WHERE uuid = col_uuid AND module_version(major_version, minor_version) = col_ver
+    WHERE uuid = col_uuid
+          AND module_version_is(major_version, minor_version, col_ver)
 $function$ LANGUAGE SQL;
 
 CREATE OR REPLACE FUNCTION ident_hash(uuid uuid, major integer, minor integer)
@@ -199,6 +248,65 @@ CREATE OR REPLACE FUNCTION short_ident_hash(uuid uuid, major integer, minor inte
  IMMUTABLE
 AS $function$ select public.short_id(uuid) || '@' || concat_ws('.', major, minor) $function$;
 
+-- The following parse an ident_hash or version once, so that lookups can
+-- compare the native uuid, major_version and minor_version columns
+-- (see the modules_uuid_version_idx index) rather than text expressions.
+-- For example, ``m.uuid = ident_hash_uuid(%(ident_hash)s) AND
+-- module_version_is(m.major_version, m.minor_version,
+-- ident_hash_version(%(ident_hash)s))``.
+
+CREATE OR REPLACE FUNCTION to_uuid(value text)
+ RETURNS uuid
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~* '^[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}$'
+                   OR $1 ~* '^\{[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}\}$'
+              THEN $1::uuid END
+$function$;
+
+CREATE OR REPLACE FUNCTION ident_hash_uuid(ident_hash text)
+ RETURNS uuid
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$ select public.to_uuid(split_part($1, '@', 1)) $function$;
+
+CREATE OR REPLACE FUNCTION ident_hash_version(ident_hash text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$ select split_part($1, '@', 2) $function$;
+
+CREATE OR REPLACE FUNCTION version_major(version text)
+ RETURNS integer
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~ '^(0|[1-9]\d*)(\.(0|[1-9]\d*))?$'
+              THEN split_part($1, '.', 1)::integer END
+$function$;
+
+CREATE OR REPLACE FUNCTION version_minor(version text)
+ RETURNS integer
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~ '^(0|[1-9]\d*)\.(0|[1-9]\d*)$'
+              THEN split_part($1, '.', 2)::integer END
+$function$;
+
+-- Equivalent to ``module_version(major, minor) = version``. It is inlined
+-- by the planner, so the comparisons can use an index.
+CREATE OR REPLACE FUNCTION module_version_is(major integer, minor integer, version text)
+ RETURNS boolean
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select major = public.version_major(version)
+         AND (minor = public.version_minor(version)
+              OR (minor IS NULL AND version !~ '\.'))
+$function$;
+
 CREATE OR REPLACE FUNCTION year(ts timestamptz)
   RETURNS DOUBLE PRECISION IMMUTABLE
   AS $$
@@ -237,24 +345,50 @@ CREATE AGGREGATE LAST (
 
 -- Find the first book containing a given uuid (candidate canonical for page)
 CREATE OR REPLACE FUNCTION default_canonical_book(id uuid)
-RETURNS uuid LANGUAGE SQL STRICT IMMUTABLE AS $$
-WITH RECURSIVE t(node, title, parent, path, value) AS (
-      SELECT nodeid, coalesce(title,name), parent_id, ARRAY[nodeid], documentid
-      FROM trees tr, modules m
-      WHERE m.uuid = $1
-      AND tr.documentid = m.module_ident
-      AND tr.parent_id IS NOT NULL
-    UNION ALL
-      SELECT c1.nodeid, c1.title, c1.parent_id,
-             t.path || ARRAY[c1.nodeid], c1.documentid
-              FROM trees c1
-              JOIN t ON (c1.nodeid = t.parent)
-              WHERE not nodeid = any (t.path)
-        )
-
-        SELECT uuid
-        from t join modules on t.value = module_ident
-        where t.parent is NULL
-        ORDER BY revised, major_version, minor_version
-        LIMIT 1
+RETURNS uuid LANGUAGE SQL STRICT STABLE AS $$
+  SELECT m.uuid
+  FROM page_books AS pb JOIN modules AS m ON m.module_ident = pb.book_ident
+  WHERE pb.page_uuid = $1
+  ORDER BY m.revised, m.major_version, m.minor_version
+  LIMIT 1
+$$;
+
+-- The default canonical book of every document in a book, e.g. to recompute
+-- modules.canonical in bulk
+CREATE OR REPLACE FUNCTION default_canonical_books()
+RETURNS TABLE (page_uuid uuid, book_uuid uuid) LANGUAGE SQL STABLE AS $$
+  SELECT DISTINCT ON (pb.page_uuid) pb.page_uuid, m.uuid
+  FROM page_books AS pb JOIN modules AS m ON m.module_ident = pb.book_ident
+  ORDER BY pb.page_uuid, m.revised, m.major_version, m.minor_version
+$$;
+
+-- Rebakes (i.e. moves to the post-publication state) the latest version of
+-- the books using the given print style, at most ``throttle`` books per call
+-- (all of them when NULL), in one statement. Only the books after the
+-- ``after_ident`` module_ident are considered, so that the books baked
+-- (and returned to another state) in the meantime are not moved again.
+-- Returns the number of books moved, the number of books left and the
+-- module_ident to pass as ``after_ident`` to the next call, so the caller
+-- can commit between batches (see the cnx-db rebake-print-style command).
+CREATE OR REPLACE FUNCTION rebake_print_style(
+  print_style text, throttle integer DEFAULT NULL,
+  after_ident integer DEFAULT 0)
+RETURNS TABLE (rebaking integer, remaining integer, last_ident integer)
+LANGUAGE SQL AS $$
+  WITH books AS (
+    SELECT m.module_ident
+    FROM latest_modules AS lm JOIN modules AS m
+      ON m.module_ident = lm.module_ident
+    WHERE lm.print_style = $1 AND lm.portal_type = 'Collection'
+          AND m.stateid NOT IN (5, 6) AND m.module_ident > $3
+  ),
+  batch AS (
+    UPDATE modules SET stateid = 5
+    WHERE module_ident IN (
+      SELECT module_ident FROM books ORDER BY module_ident LIMIT $2)
+    RETURNING module_ident
+  )
+  SELECT (SELECT count(*) FROM batch)::integer,
+         ((SELECT count(*) FROM books) - (SELECT count(*) FROM batch))::integer,
+         coalesce((SELECT max(module_ident) FROM batch), $3)
 $$;
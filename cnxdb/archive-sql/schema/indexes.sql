@@ -2,10 +2,10 @@ CREATE INDEX modules_moduleid_idx on modules (moduleid);
 CREATE INDEX modules_upmodid_idx ON modules  (upper(moduleid));
 CREATE INDEX modules_upname_idx ON modules  (upper(name));
 CREATE INDEX modules_portal_type_idx on modules (portal_type);
-CREATE INDEX modules_uuid_idx on modules (uuid);
-CREATE INDEX modules_uuid_txt_version_idx on
-    modules (CAST(uuid as text), module_version(major_version, minor_version));
+CREATE INDEX modules_uuid_version_idx on
+    modules (uuid, major_version DESC NULLS LAST, minor_version DESC NULLS LAST);
 CREATE INDEX modules_short_id_idx on modules (short_id(uuid));
+CREATE INDEX modules_parent_idx on modules (parent);
 CREATE INDEX modules_ident_hash on modules(ident_hash(uuid, major_version, minor_version));
 CREATE INDEX modules_short_ident_hash on modules(short_ident_hash(uuid, major_version, minor_version));
 
@@ -14,11 +14,12 @@ CREATE INDEX latest_modules_upname_idx ON latest_modules  (upper(name));
 CREATE INDEX latest_modules_moduleid_idx on latest_modules (moduleid);
 CREATE INDEX latest_modules_module_ident_idx on latest_modules (module_ident);
 CREATE INDEX latest_modules_portal_type_idx on latest_modules (portal_type);
+-- The search results exclude these portal types (see archive-sql/search)
+CREATE INDEX latest_modules_searchable_idx on latest_modules (module_ident)
+    WHERE portal_type NOT IN ('CompositeModule', 'SubCollection');
 CREATE INDEX latest_modules_gin_authors_idx on latest_modules using gin(authors);
 CREATE INDEX latest_modules_publication_year_idx on latest_modules (year(revised));
 CREATE UNIQUE INDEX lastest_modules_uuid_idx on latest_modules (uuid);
-CREATE INDEX latest_modules_uuid_text_version_idx on
-    latest_modules (cast(uuid as text), module_version(major_version, minor_version));
 CREATE UNIQUE INDEX lastest_modules_short_id_idx on latest_modules (short_id(uuid));
 
 CREATE INDEX fti_idx ON modulefti USING gin (module_idx);
@@ -53,3 +54,18 @@ CREATE INDEX collated_fti_context_fkey ON collated_fti (context);
 CREATE INDEX collated_fti_item_fkey ON collated_fti (item);
 CREATE INDEX document_hits_documentid_fkey ON document_hits (documentid);
 CREATE INDEX moduletags_module_ident_fkey ON moduletags (module_ident);
+
+-- These indexes are in support of the author, maintainer, editor,
+-- translator and licensor search parts (see archive-sql/search).
+CREATE INDEX users_first_name_trgm_gin ON users USING gin(first_name gin_trgm_ops);
+CREATE INDEX users_last_name_trgm_gin ON users USING gin(last_name gin_trgm_ops);
+CREATE INDEX users_full_name_trgm_gin ON users USING gin(full_name gin_trgm_ops);
+CREATE INDEX users_username_trgm_gin ON users USING gin(username gin_trgm_ops);
+CREATE INDEX latest_modules_gin_maintainers_idx ON latest_modules USING gin(maintainers);
+CREATE INDEX moduleoptionalroles_gin_personids_idx ON moduleoptionalroles USING gin(personids);
+
+CREATE INDEX document_hits_hitid_idx ON document_hits (hitid);
+CREATE INDEX document_hit_aggregates_uuid_idx ON document_hit_aggregates (uuid);
+CREATE INDEX document_hit_aggregates_average_idx ON document_hit_aggregates (average);
+CREATE INDEX document_hits_start_timestamp_idx ON document_hits (start_timestamp);
+CREATE INDEX document_hit_daily_rollups_day_idx ON document_hit_daily_rollups (day);
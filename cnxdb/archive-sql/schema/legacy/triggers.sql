@@ -19,6 +19,10 @@ CREATE TRIGGER update_users_from_legacy
   BEFORE UPDATE ON persons FOR EACH ROW
   EXECUTE PROCEDURE update_users_from_legacy();
 
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON persons FOR EACH STATEMENT
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
 
 
 
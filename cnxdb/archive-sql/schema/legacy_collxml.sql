@@ -124,6 +124,41 @@ SELECT  xmlelement(name "md:metadata", xmlattributes('http://cnx.rice.edu/mdml'
 $$
 LANGUAGE SQL;
 
+-- legacy_mdml_inner, cached in legacy_mdml_fragments
+
+CREATE OR REPLACE FUNCTION legacy_mdml_inner_cached (
+    mod_ident int,
+    recurse bool default False,
+    repo text default 'https://legacy.cnx.org/content')
+RETURNS XML
+STRICT
+AS
+$$
+DECLARE
+  _fragment xml;
+BEGIN
+  SELECT fragment INTO _fragment FROM legacy_mdml_fragments AS f
+  WHERE f.module_ident = mod_ident AND f.recurse = legacy_mdml_inner_cached.recurse
+        AND f.repo = legacy_mdml_inner_cached.repo;
+  IF FOUND THEN
+    RETURN _fragment;
+  END IF;
+
+  _fragment := legacy_mdml_inner(mod_ident, recurse, repo);
+  -- Read-only transactions (e.g. on a hot standby) only read the cache.
+  IF current_setting('transaction_read_only') = 'off' THEN
+    BEGIN
+      INSERT INTO legacy_mdml_fragments (module_ident, recurse, repo, fragment)
+        VALUES (mod_ident, recurse, repo, _fragment);
+    EXCEPTION WHEN unique_violation OR foreign_key_violation THEN
+      -- cached concurrently or not a module, nothing to do
+    END;
+  END IF;
+  RETURN _fragment;
+END;
+$$
+LANGUAGE plpgsql;
+
 -- Now for COLLXML, parsed from trees and modules tables - the reverse of shred, basically
 -- Each of the sub-tree functions takes a tree nodeid as primary parameter
 -- this creates a leaf 'module' element
@@ -149,16 +184,72 @@ SELECT xmlelement(name "col:module",
     WHERE t.nodeid = legacy_module.nodeid
 $$;
 
--- to recurse, we need the content tag function and the subcol tag function to refer to each other, so a
--- stub function with the correct type signature, here, to be replaced w/ functional code below
+-- The content tag is generated from the flattened subtree (one recursive
+-- pass over the nodes, joined to their modules), rather than by calling
+-- legacy_module and legacy_subcol per node. Each node contributes its
+-- opening (or only) markup and each subcollection its closing markup,
+-- which are concatenated in document order.
 
 CREATE OR REPLACE FUNCTION legacy_content(nodeid int,
     repo text default 'https://legacy.cnx.org/content')
 RETURNS xml
+IMMUTABLE STRICT
 LANGUAGE SQL
 AS
 $$
-SELECT NULL::xml -- STUB redefined below due to mutual recursion w/ legacy_subcol
+WITH RECURSIVE nodes AS (
+    SELECT t.nodeid, t.parent_id, t.title, t.latest,
+           m.portal_type, m.moduleid, m.version, m.name,
+           ARRAY[t.childorder, t.nodeid] AS path
+    FROM trees t JOIN modules m ON t.documentid = m.module_ident
+    WHERE t.parent_id = legacy_content.nodeid
+      AND m.portal_type in ('Module', 'CompositeModule',
+                            'SubCollection', 'CompositeSubCollection')
+  UNION ALL
+    SELECT t.nodeid, t.parent_id, t.title, t.latest,
+           m.portal_type, m.moduleid, m.version, m.name,
+           n.path || ARRAY[t.childorder, t.nodeid]
+    FROM nodes n
+      JOIN trees t ON t.parent_id = n.nodeid
+      JOIN modules m ON t.documentid = m.module_ident
+    WHERE n.portal_type in ('SubCollection', 'CompositeSubCollection')
+      AND m.portal_type in ('Module', 'CompositeModule',
+                            'SubCollection', 'CompositeSubCollection')
+),
+parents AS (
+    SELECT DISTINCT parent_id AS nodeid FROM nodes
+),
+markup (path, piece) AS (
+    SELECT n.path,
+           CASE WHEN n.portal_type in ('Module', 'CompositeModule')
+               THEN xmlelement(name "col:module",
+                   xmlattributes(n.moduleid as "document",
+                                 ( CASE WHEN n.latest THEN 'latest'
+                                   ELSE n.version END ) as "version",
+                                 legacy_content.repo as "repository",
+                                 n.version as "cnxorg:version-at-this-collection-version"),
+                   xmlelement(name "md:title", COALESCE (n.title, n.name))
+                   )::text
+               ELSE '<col:subcollection>' ||
+                   xmlelement(name "md:title", COALESCE (n.title, n.name))::text ||
+                   CASE WHEN p.nodeid IS NULL THEN '<col:content/>'
+                       ELSE '<col:content>' END
+           END
+    FROM nodes n LEFT JOIN parents p ON p.nodeid = n.nodeid
+  UNION ALL
+    -- NULLs sort after any childorder and nodeid,
+    -- so this follows all of the subcollection's descendants.
+    SELECT n.path || ARRAY[NULL::int, NULL::int],
+           CASE WHEN p.nodeid IS NULL THEN '' ELSE '</col:content>' END ||
+               '</col:subcollection>'
+    FROM nodes n LEFT JOIN parents p ON p.nodeid = n.nodeid
+    WHERE n.portal_type in ('SubCollection', 'CompositeSubCollection')
+)
+SELECT (CASE WHEN count(*) = 0 THEN '<col:content/>'
+            ELSE '<col:content>' || string_agg(piece, '' ORDER BY path) ||
+                 '</col:content>'
+        END)::xml
+FROM markup
 $$;
 
 
@@ -179,32 +270,6 @@ SELECT
     WHERE t.nodeid = legacy_subcol.nodeid
 $$;
 
--- redefine for above, since needs to recurse back to subcol
--- recursion terminates on all-module subcols
-
-CREATE OR REPLACE FUNCTION legacy_content(nodeid int,
-    repo text default 'https://legacy.cnx.org/content')
-RETURNS xml
-IMMUTABLE STRICT
-LANGUAGE SQL
-AS
-$$
-SELECT
-    xmlelement(name "col:content",
-    (SELECT xmlagg(
-            CASE WHEN c.portal_type in ('Module','CompositeModule')
-                THEN legacy_module(c.nodeid, legacy_content.repo)
-                WHEN c.portal_type in ('SubCollection','CompositeSubCollection')
-                THEN legacy_subcol(c.nodeid, legacy_content.repo)
-            END)
-            FROM (SELECT nodeid, portal_type FROM trees t JOIN modules m
-                ON t.documentid = m.module_ident
-                WHERE parent_id = legacy_content.nodeid
-                ORDER BY childorder) AS c
-            )
-        )
-$$;
-
 -- Wrap it all together - takes a module_ident as primary parameter. Recurse passed down to mdml function
 -- to control recursion into derived-from metadata
 
@@ -213,7 +278,7 @@ CREATE OR REPLACE FUNCTION legacy_collxml (ident int,
       repo text default 'https://legacy.cnx.org/content')
 RETURNS xml
 LANGUAGE SQL
-IMMUTABLE STRICT
+STRICT
 AS
 $$
 SELECT xmlelement(name "col:collection",
@@ -226,9 +291,9 @@ SELECT xmlelement(name "col:collection",
     xmlelement(name "metadata",
         xmlattributes( 'http://cnx.rice.edu/mdml' as "xmlns:md",
                        '0.5' as "mdml-version"),
-        legacy_mdml_inner(legacy_collxml.ident,
-                          legacy_collxml.recurse,
-                          legacy_collxml.repo)
+        legacy_mdml_inner_cached(legacy_collxml.ident,
+                                 legacy_collxml.recurse,
+                                 legacy_collxml.repo)
     ),
     xmlelement(name "col:parameters",
         xmlelement(name "col:param",
@@ -252,16 +317,9 @@ AS $function$
     existing_collxml_id := (SELECT fileid FROM module_files
         WHERE module_ident = coll_id AND filename = 'collection.xml');
 
-    SELECT fileid FROM files WHERE sha1 = 
-      sha1(pretty_print(legacy_collxml(coll_id, True))::text::bytea)
-        INTO _collxml_id;
-
-    IF _collxml_id IS NULL THEN
-      INSERT INTO files (file, media_type) SELECT
-        pretty_print(legacy_collxml(coll_id, True))::text::bytea,
-        'text/xml'
-        RETURNING fileid INTO _collxml_id;
-    END IF;
+    _collxml_id := get_or_insert_file(
+      pretty_print(legacy_collxml(coll_id, True))::text::bytea,
+      'text/xml');
 
 
     IF existing_collxml_id IS NULL THEN
@@ -277,4 +335,38 @@ AS $function$
     RETURN _collxml_id;
   END;
 
+$function$;
+
+-- Generates the collection.xml of a collection, unless it already has one.
+-- Returns the fileid of the collection.xml.
+
+CREATE OR REPLACE FUNCTION gen_collxml(coll_id integer)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+  DECLARE
+    _collxml_id integer;
+
+  BEGIN
+    _collxml_id := (SELECT fileid FROM module_files
+        WHERE module_ident = coll_id AND filename = 'collection.xml');
+    IF _collxml_id IS NOT NULL THEN
+      RETURN _collxml_id;
+    END IF;
+
+    _collxml_id := get_or_insert_file(
+      pretty_print(legacy_collxml(coll_id, True))::text::bytea,
+      'text/xml');
+    BEGIN
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES (coll_id, _collxml_id, 'collection.xml');
+    EXCEPTION WHEN unique_violation THEN
+      -- generated concurrently
+      _collxml_id := (SELECT fileid FROM module_files
+          WHERE module_ident = coll_id AND filename = 'collection.xml');
+    END;
+
+    RETURN _collxml_id;
+  END;
+
 $function$
@@ -6,7 +6,7 @@ WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collat
            is_collated
     FROM trees tr, modules m
     WHERE m.uuid = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.parent_id IS NULL AND
       tr.is_collated = False
@@ -27,7 +27,7 @@ WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collat
            is_collated
     FROM trees tr, modules m
     WHERE m.uuid = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.parent_id IS NULL AND
       tr.is_collated = False
@@ -87,14 +87,14 @@ SELECT
     m.print_style
 
 FROM t join modules m on m.module_ident = t.parent WHERE t.documentid IS NULL
-    and not exists (select 1 from modules where uuid = uuid5(m.uuid::uuid, t.title) and module_version(major_version, minor_version) = $2);
+    and not exists (select 1 from modules where uuid = uuid5(m.uuid::uuid, t.title) and module_version_is(major_version, minor_version, $2));
 
 WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
     SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
            is_collated
     FROM trees tr, modules m
     WHERE m.uuid = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.parent_id IS NULL AND
       tr.is_collated = False
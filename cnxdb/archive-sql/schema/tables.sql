@@ -61,7 +61,8 @@ CREATE TABLE files (
     md5 text,
     sha1 text UNIQUE,
     file bytea,
-    media_type text
+    media_type text,
+    size bigint
 );
 
 CREATE TABLE "modules" (
@@ -210,6 +211,37 @@ CREATE TABLE document_hits (
   start_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
   end_timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
   hits INTEGER DEFAULT 0,
+  -- Used as the watermark for folding new rows into document_hit_aggregates.
+  hitid BIGSERIAL NOT NULL,
+  FOREIGN KEY (documentid) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+-- Running totals of document_hits per document, see update_hit_aggregates().
+CREATE TABLE document_hit_aggregates (
+  documentid INTEGER NOT NULL PRIMARY KEY,
+  uuid UUID NOT NULL,
+  hits BIGINT NOT NULL DEFAULT 0,
+  -- The number of non-null document_hits.hits values folded in.
+  records BIGINT NOT NULL DEFAULT 0,
+  average FLOAT DEFAULT NULL,
+  FOREIGN KEY (documentid) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+CREATE TABLE document_hit_aggregates_watermark (
+  last_hitid BIGINT NOT NULL DEFAULT 0,
+  -- The latest end_timestamp folded in, see get_recency_date().
+  last_end_timestamp TIMESTAMP WITH TIME ZONE
+);
+
+-- Hits rolled up by the (UTC) day of their start_timestamp.
+-- The daily rollups are pruned along with document_hits,
+-- see prune_document_hits().
+CREATE TABLE document_hit_daily_rollups (
+  documentid INTEGER NOT NULL,
+  day DATE NOT NULL,
+  hits BIGINT NOT NULL DEFAULT 0,
+  records BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (documentid, day),
   FOREIGN KEY (documentid) REFERENCES modules (module_ident) ON DELETE CASCADE
 );
 
@@ -309,3 +341,44 @@ CREATE TABLE default_print_style_recipes (
       -- a string to further identify what version recipe (commit hash?)
   FOREIGN KEY (fileid) REFERENCES files (fileid)
 );
+
+-- Rendered legacy_mdml_inner fragments, filled lazily by
+-- legacy_mdml_inner_cached and invalidated by the
+-- invalidate_legacy_mdml triggers when the metadata changes.
+CREATE TABLE legacy_mdml_fragments (
+  module_ident INTEGER,
+  recurse BOOLEAN,
+  repo TEXT,
+  fragment XML,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE,
+  PRIMARY KEY (module_ident, recurse, repo)
+);
+
+-- Collections waiting for their collection.xml to be generated,
+-- when gen_minor_collxml runs in the 'async' cnxdb.collxml_mode
+-- (see the cnx-db gen-collxml command).
+CREATE TABLE collxml_queue (
+  module_ident INTEGER PRIMARY KEY,
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- failed generations, the last error is kept
+  attempts INTEGER NOT NULL DEFAULT 0,
+  error TEXT,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+-- Abstracts waiting for their HTML, with one of the modules using them,
+-- queued by the html_abstract triggers. They are transformed at the end of
+-- the statement, unless the cnxdb.html_abstract_mode setting is 'async'
+-- (see the cnx-db gen-html-abstracts command).
+CREATE TABLE html_abstract_queue (
+  abstractid INTEGER PRIMARY KEY,
+  module_ident INTEGER NOT NULL,
+  -- the transaction that queued the abstract
+  queued_by BIGINT NOT NULL DEFAULT txid_current(),
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- failed transformations, the last error is kept
+  attempts INTEGER NOT NULL DEFAULT 0,
+  error TEXT,
+  FOREIGN KEY (abstractid) REFERENCES abstracts (abstractid) ON DELETE CASCADE,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
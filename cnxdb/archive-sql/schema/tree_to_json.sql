@@ -19,8 +19,8 @@ WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated, slug) AS (
            is_collated,
            slug
     FROM trees tr, modules m
-    WHERE m.uuid::text = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+    WHERE m.uuid = to_uuid($1) AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.parent_id IS NULL AND
       tr.is_collated = $3
@@ -61,8 +61,8 @@ SELECT string_agg(toc,'
 WITH RECURSIVE t(node, title, path,value, depth, corder) AS (
     SELECT nodeid, title, ARRAY[nodeid], documentid, 1, ARRAY[childorder]
     FROM trees tr, modules m
-    WHERE m.uuid::text = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+    WHERE m.uuid = to_uuid($1) AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.parent_id IS NULL AND
       tr.is_collated = FALSE
@@ -29,3 +29,110 @@ CREATE TABLE trees (
 -- the unique index insures only two top-level trees per document metadata - raw and collated
 CREATE UNIQUE INDEX trees_unique_doc_idx on trees(documentid, is_collated) where parent_id is null;
 CREATE INDEX trees_doc_idx on trees(documentid);
+-- supports the recursive tree queries, which join children on
+-- (parent_id, is_collated), and the parent_id ON DELETE CASCADE
+CREATE INDEX trees_parent_id_idx on trees(parent_id, is_collated) where parent_id is not null;
+
+-- Membership of documents in books (e.g. used to find the default canonical
+-- book of a page, or the books containing a page): one row per non-root node
+-- of the trees, with the module_ident and uuid of the node's document, and
+-- the root node and module_ident of its root's document (the book).
+-- Maintained by the update_page_books trigger.
+CREATE TABLE page_books (
+    nodeid integer PRIMARY KEY,
+    page_ident integer NOT NULL,
+    page_uuid uuid NOT NULL,
+    book_nodeid integer NOT NULL,
+    book_ident integer NOT NULL,
+    FOREIGN KEY (nodeid) REFERENCES trees (nodeid) ON DELETE CASCADE
+);
+
+CREATE INDEX page_books_page_ident_idx on page_books(page_ident);
+CREATE INDEX page_books_page_uuid_idx on page_books(page_uuid);
+CREATE INDEX page_books_book_ident_idx on page_books(book_ident);
+
+-- Recomputes the page_books rows of the given nodes and their descendants
+CREATE OR REPLACE FUNCTION refresh_page_books(nodeids integer[])
+RETURNS void AS $$
+DECLARE
+  subtree integer[];
+BEGIN
+  subtree := ARRAY(
+    WITH RECURSIVE sub(nodeid, path) AS (
+        SELECT nodeid, ARRAY[nodeid] FROM trees WHERE nodeid = ANY (nodeids)
+      UNION ALL
+        SELECT c.nodeid, sub.path || c.nodeid
+        FROM trees c JOIN sub ON c.parent_id = sub.nodeid
+        WHERE NOT c.nodeid = ANY (sub.path)
+    )
+    SELECT nodeid FROM sub);
+
+  DELETE FROM page_books WHERE nodeid = ANY (subtree);
+
+  INSERT INTO page_books (nodeid, page_ident, page_uuid, book_nodeid,
+                          book_ident)
+    WITH RECURSIVE up(nodeid, ancestor, parent, path) AS (
+        SELECT nodeid, nodeid, parent_id, ARRAY[nodeid] FROM trees
+        WHERE nodeid = ANY (subtree) AND parent_id IS NOT NULL
+      UNION ALL
+        SELECT up.nodeid, p.nodeid, p.parent_id, up.path || p.nodeid
+        FROM trees p JOIN up ON p.nodeid = up.parent
+        WHERE NOT p.nodeid = ANY (up.path)
+    )
+    SELECT up.nodeid, n.documentid, m.uuid, r.nodeid, r.documentid
+    FROM up
+      JOIN trees n ON n.nodeid = up.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+      JOIN trees r ON r.nodeid = up.ancestor
+    WHERE up.parent IS NULL AND r.documentid IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes all of page_books, walking down from every root at once
+CREATE OR REPLACE FUNCTION rebuild_page_books()
+RETURNS void AS $$
+BEGIN
+  DELETE FROM page_books;
+
+  INSERT INTO page_books (nodeid, page_ident, page_uuid, book_nodeid,
+                          book_ident)
+    WITH RECURSIVE down(nodeid, book_nodeid, book_ident, path) AS (
+        SELECT nodeid, nodeid, documentid, ARRAY[nodeid] FROM trees
+        WHERE parent_id IS NULL AND documentid IS NOT NULL
+      UNION ALL
+        SELECT c.nodeid, down.book_nodeid, down.book_ident,
+               down.path || c.nodeid
+        FROM trees c JOIN down ON c.parent_id = down.nodeid
+        WHERE NOT c.nodeid = ANY (down.path)
+    )
+    SELECT down.nodeid, n.documentid, m.uuid, down.book_nodeid,
+           down.book_ident
+    FROM down
+      JOIN trees n ON n.nodeid = down.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+    WHERE n.parent_id IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_page_books()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_TABLE_NAME = 'modules' THEN
+    -- The nodes inserted before their document
+    -- (e.g. when republishing a legacy module)
+    PERFORM refresh_page_books(ARRAY(
+      SELECT nodeid FROM trees WHERE documentid = NEW.module_ident));
+  ELSE
+    PERFORM refresh_page_books(ARRAY[NEW.nodeid]);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_page_books
+  AFTER INSERT OR UPDATE OF parent_id, documentid ON trees FOR EACH ROW
+  EXECUTE PROCEDURE update_page_books();
+
+CREATE TRIGGER update_page_books
+  AFTER INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE update_page_books();
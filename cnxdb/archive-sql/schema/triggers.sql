@@ -1,68 +1,105 @@
 -- ANY UPDATES TO THIS FILE SHOULD ALSO CONTAIN UPDATES TO
 -- THE DOCUMENATION AT docs/triggers.rst
 
-CREATE OR REPLACE FUNCTION update_latest() RETURNS trigger AS '
+CREATE OR REPLACE FUNCTION update_latest() RETURNS trigger AS $$
 BEGIN
 -- lastest content is the highest version that has successfully baked - states 1 and 8 (current and fallback)
 -- represent some sort of success (fallback used an old recipe due to errors)
-  IF (TG_OP = ''INSERT'' OR TG_OP = ''UPDATE'') AND
-          ARRAY [NEW.major_version, NEW.minor_version] >= (SELECT ARRAY [major_version, minor_version]
-            FROM latest_modules WHERE uuid = NEW.uuid UNION ALL SELECT ARRAY[0, NULL] LIMIT 1) AND
-          NEW.stateid in (1, 8) THEN -- current and fallback
-      LOCK TABLE latest_modules IN SHARE ROW EXCLUSIVE MODE;
-      DELETE FROM latest_modules WHERE moduleid = NEW.moduleid OR uuid = NEW.uuid;
-      INSERT into latest_modules (
-                uuid, module_ident, portal_type, moduleid, version, name,
-  		created, revised, abstractid, stateid, doctype, licenseid,
-  		submitter,submitlog, parent, language,
-		authors, maintainers, licensors, parentauthors, google_analytics,
-                major_version, minor_version, print_style, baked, recipe, canonical)
-  	VALUES (
-         NEW.uuid, NEW.module_ident, NEW.portal_type, NEW.moduleid, NEW.version, NEW.name,
-  	 NEW.created, NEW.revised, NEW.abstractid, NEW.stateid, NEW.doctype, NEW.licenseid,
-  	 NEW.submitter, NEW.submitlog, NEW.parent, NEW.language,
-	 NEW.authors, NEW.maintainers, NEW.licensors, NEW.parentauthors, NEW.google_analytics,
-         NEW.major_version, NEW.minor_version, NEW.print_style, NEW.baked, NEW.recipe, NEW.canonical);
-  END IF;
-
-  IF TG_OP = ''UPDATE'' AND NEW.stateid in (1, 8) THEN -- current or fallback
+  IF NEW.stateid in (1, 8) THEN -- current and fallback
+    -- Only publishers of the same uuid need to wait on each other,
+    -- so lock the uuid rather than the whole latest_modules table.
+    PERFORM pg_advisory_xact_lock(hashtext('latest_modules'), hashtext(NEW.uuid::text));
+    IF ARRAY [NEW.major_version, NEW.minor_version] >= (SELECT ARRAY [major_version, minor_version]
+          FROM latest_modules WHERE uuid = NEW.uuid UNION ALL SELECT ARRAY[0, NULL] LIMIT 1) THEN
+      DELETE FROM latest_modules WHERE moduleid = NEW.moduleid AND uuid != NEW.uuid;
+      UPDATE latest_modules SET
+          uuid=NEW.uuid,
+          module_ident=NEW.module_ident,
+          moduleid=NEW.moduleid,
+          portal_type=NEW.portal_type,
+          version=NEW.version,
+          name=NEW.name,
+          created=NEW.created,
+          revised=NEW.revised,
+          abstractid=NEW.abstractid,
+          stateid=NEW.stateid,
+          doctype=NEW.doctype,
+          licenseid=NEW.licenseid,
+          submitter=NEW.submitter,
+          submitlog=NEW.submitlog,
+          parent=NEW.parent,
+          language=NEW.language,
+          authors=NEW.authors,
+          maintainers=NEW.maintainers,
+          licensors=NEW.licensors,
+          parentauthors=NEW.parentauthors,
+          google_analytics=NEW.google_analytics,
+          buylink=NEW.buylink,
+          major_version=NEW.major_version,
+          minor_version=NEW.minor_version,
+          print_style=NEW.print_style,
+          baked=NEW.baked,
+          recipe=NEW.recipe,
+          canonical=NEW.canonical
+        WHERE uuid = NEW.uuid;
+      IF NOT FOUND THEN
+        INSERT into latest_modules (
+                  uuid, module_ident, portal_type, moduleid, version, name,
+                  created, revised, abstractid, stateid, doctype, licenseid,
+                  submitter,submitlog, parent, language,
+                  authors, maintainers, licensors, parentauthors, google_analytics, buylink,
+                  major_version, minor_version, print_style, baked, recipe, canonical)
+          VALUES (
+           NEW.uuid, NEW.module_ident, NEW.portal_type, NEW.moduleid, NEW.version, NEW.name,
+           NEW.created, NEW.revised, NEW.abstractid, NEW.stateid, NEW.doctype, NEW.licenseid,
+           NEW.submitter, NEW.submitlog, NEW.parent, NEW.language,
+           NEW.authors, NEW.maintainers, NEW.licensors, NEW.parentauthors, NEW.google_analytics, NEW.buylink,
+           NEW.major_version, NEW.minor_version, NEW.print_style, NEW.baked, NEW.recipe, NEW.canonical);
+      END IF;
+    ELSIF TG_OP = 'UPDATE' THEN
       UPDATE latest_modules SET
-        uuid=NEW.uuid,
-        moduleid=NEW.moduleid,
-        portal_type=NEW.portal_type,
-        version=NEW.version,
-        name=NEW.name,
-        created=NEW.created,
-        revised=NEW.revised,
-        abstractid=NEW.abstractid,
-        stateid=NEW.stateid,
-        doctype=NEW.doctype,
-        licenseid=NEW.licenseid,
-	submitter=NEW.submitter,
-	submitlog=NEW.submitlog,
-        parent=NEW.parent,
-	language=NEW.language,
-	authors=NEW.authors,
-	maintainers=NEW.maintainers,
-	licensors=NEW.licensors,
-	parentauthors=NEW.parentauthors,
-	google_analytics=NEW.google_analytics,
-        major_version=NEW.major_version,
-        minor_version=NEW.minor_version,
-        print_style=NEW.print_style,
-        baked=NEW.baked,
-        recipe=NEW.recipe,
-        canonical=NEW.canonical
-        WHERE module_ident=NEW.module_ident;
+          uuid=NEW.uuid,
+          module_ident=NEW.module_ident,
+          moduleid=NEW.moduleid,
+          portal_type=NEW.portal_type,
+          version=NEW.version,
+          name=NEW.name,
+          created=NEW.created,
+          revised=NEW.revised,
+          abstractid=NEW.abstractid,
+          stateid=NEW.stateid,
+          doctype=NEW.doctype,
+          licenseid=NEW.licenseid,
+          submitter=NEW.submitter,
+          submitlog=NEW.submitlog,
+          parent=NEW.parent,
+          language=NEW.language,
+          authors=NEW.authors,
+          maintainers=NEW.maintainers,
+          licensors=NEW.licensors,
+          parentauthors=NEW.parentauthors,
+          google_analytics=NEW.google_analytics,
+          buylink=NEW.buylink,
+          major_version=NEW.major_version,
+          minor_version=NEW.minor_version,
+          print_style=NEW.print_style,
+          baked=NEW.baked,
+          recipe=NEW.recipe,
+          canonical=NEW.canonical
+        WHERE module_ident = NEW.module_ident;
+    END IF;
   END IF;
 
 RETURN NEW;
 END;
 
-' LANGUAGE 'plpgsql';
+$$ LANGUAGE 'plpgsql';
 
+-- update_latest only acts on current and fallback states, the WHEN clause
+-- skips the function call for the other states (e.g. rebakes).
 CREATE TRIGGER update_latest_version
   BEFORE INSERT OR UPDATE ON modules FOR EACH ROW
+  WHEN (NEW.stateid in (1, 8))
   EXECUTE PROCEDURE update_latest();
 
 
@@ -96,11 +133,48 @@ CREATE TRIGGER delete_from_latest_version
   EXECUTE PROCEDURE delete_from_latest();
 
 
+-- Notifies the post_publication channel of each module, unless the
+-- ``cnxdb.post_publication_mode`` setting is 'queue', in which case the
+-- module is queued in baking_queue and the post_publication_queue channel
+-- is notified. Identical notifications are delivered once per transaction,
+-- so the listeners get a single signal for a whole batch (e.g. a rebake)
+-- and claim the jobs (see cnxdb.baking).
 CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+DECLARE
+  mode text;
 BEGIN
       -- skip if this is an update that has already sent a notify that has not yet been picked up - avoid double notify
       IF TG_OP = 'INSERT' OR ( TG_OP = 'UPDATE' AND OLD.stateid != 5 ) THEN
-            PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+            BEGIN
+              mode := current_setting('cnxdb.post_publication_mode');
+            EXCEPTION WHEN undefined_object THEN
+              mode := 'notify';
+            END;
+
+            IF mode = 'queue' THEN
+              -- A module already queued is not queued twice. A claimed
+              -- job (hidden until its visible_at) may be baking an older
+              -- state, so it is flagged to be baked again once completed.
+              -- A waiting job is given back its attempts.
+              UPDATE baking_queue
+                SET requeued = requeued OR visible_at > CURRENT_TIMESTAMP,
+                    attempts = CASE WHEN visible_at > CURRENT_TIMESTAMP
+                                    THEN attempts ELSE 0 END
+                WHERE module_ident = NEW.module_ident;
+              IF NOT FOUND THEN
+                BEGIN
+                  INSERT INTO baking_queue (module_ident, priority)
+                    VALUES (NEW.module_ident,
+                            CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE 0 END);
+                EXCEPTION WHEN unique_violation THEN
+                  -- queued by a concurrent transaction
+                  NULL;
+                END;
+              END IF;
+              PERFORM pg_notify('post_publication_queue', '');
+            ELSE
+              PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+            END IF;
               END IF;
               RETURN NEW;
         END;
@@ -113,98 +187,333 @@ CREATE TRIGGER post_publication_trigger
 
 
 
-CREATE OR REPLACE FUNCTION republish_module ()
-  RETURNS trigger
+-- Inserts the next minor version of a collection (or subcollection),
+-- with the keywords, tags and files (except collection.xml) of the given
+-- version, and returns its module_ident
+CREATE OR REPLACE FUNCTION republish_collection (
+  collection_ident integer, new_submitter text, new_submitlog text)
+  RETURNS integer
 AS $$
-  from cnxarchive.database import republish_module_trigger
-  return republish_module_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
+DECLARE
+  next_minor_version integer;
+  new_ident integer;
+BEGIN
+  -- The max minor version in the database, in case the given
+  -- collection_ident is not the latest version
+  SELECT max(m.minor_version) + 1 INTO next_minor_version
+  FROM modules m JOIN modules c
+    ON m.uuid = c.uuid AND m.major_version = c.major_version
+  WHERE c.module_ident = collection_ident;
+
+  INSERT INTO modules (portal_type, moduleid, uuid, version, name, created,
+      revised, abstractid, licenseid, doctype, submitter, submitlog,
+      stateid, parent, language, authors, maintainers, licensors,
+      parentauthors, google_analytics, buylink, print_style,
+      major_version, minor_version)
+    SELECT m.portal_type, m.moduleid, m.uuid, m.version, m.name, m.created,
+      CURRENT_TIMESTAMP, m.abstractid, m.licenseid, m.doctype,
+      new_submitter, new_submitlog,
+      m.stateid, m.parent, m.language, m.authors, m.maintainers, m.licensors,
+      m.parentauthors, m.google_analytics, m.buylink, m.print_style,
+      m.major_version, next_minor_version
+    FROM modules m
+    WHERE m.module_ident = collection_ident
+    RETURNING module_ident INTO new_ident;
+
+  INSERT INTO modulekeywords (module_ident, keywordid)
+    SELECT new_ident, keywordid FROM modulekeywords
+    WHERE module_ident = collection_ident;
+
+  INSERT INTO moduletags (module_ident, tagid)
+    SELECT new_ident, tagid FROM moduletags
+    WHERE module_ident = collection_ident;
+
+  INSERT INTO module_files (module_ident, fileid, filename)
+    SELECT new_ident, fileid, filename FROM module_files
+    WHERE module_ident = collection_ident AND filename != 'collection.xml';
+
+  RETURN new_ident;
+END;
+$$ LANGUAGE plpgsql;
 
-CREATE OR REPLACE FUNCTION assign_moduleid_default ()
-  RETURNS TRIGGER
+-- Copies the (raw) tree of a collection, replacing the documents
+-- in old_idents with the ones at the same position in new_idents
+CREATE OR REPLACE FUNCTION rebuild_collection_tree (
+  collection_ident integer, old_idents integer[], new_idents integer[])
+  RETURNS void
 AS $$
-  from cnxarchive.database import assign_moduleid_default_trigger
-  return assign_moduleid_default_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
-
-CREATE OR REPLACE FUNCTION assign_version_default ()
+BEGIN
+  INSERT INTO trees (nodeid, parent_id, documentid, title, childorder, latest)
+    WITH RECURSIVE t(node, parent, document, title, childorder, latest,
+                     path) AS (
+        SELECT nodeid, parent_id, documentid, title, childorder, latest,
+               ARRAY[nodeid]
+        FROM trees
+        WHERE documentid = collection_ident AND parent_id IS NULL
+              AND is_collated = 'False'
+      UNION ALL
+        SELECT c.nodeid, c.parent_id, c.documentid, c.title, c.childorder,
+               c.latest, t.path || c.nodeid
+        FROM trees c JOIN t ON c.parent_id = t.node
+        WHERE NOT c.nodeid = ANY (t.path)
+    ),
+    -- the new nodeids are assigned before inserting the nodes,
+    -- so the children can point to their new parents
+    nodes AS (
+      SELECT t.*, nextval('nodeid_seq')::integer AS new_node FROM t
+    )
+    SELECT n.new_node, p.new_node,
+           coalesce(new_idents[array_position(old_idents, n.document)],
+                    n.document),
+           n.title, n.childorder, n.latest
+    FROM nodes n LEFT JOIN nodes p ON p.node = n.parent;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fills in the defaults of a publication, in this order:
+-- 1. the uuid (with its document_controls entry) of legacy publications
+-- 2. the ACL and users of the roles of legacy publications
+-- 3. the legacy moduleid of cnx-publishing publications
+-- 4. the versions of legacy publications, republishing the collections
+--    (and subcollections) containing a republished module
+-- 5. the collection minor version and the legacy version of cnx-publishing
+--    publications
+CREATE OR REPLACE FUNCTION module_publication_defaults ()
   RETURNS TRIGGER
 AS $$
-  from cnxarchive.database import assign_version_default_trigger
-  return assign_version_default_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
+DECLARE
+  -- Legacy always supplies the version.
+  is_legacy_publication boolean := NEW.version IS NOT NULL;
+  legacy_major integer;
+  legacy_minor integer;
+  current_ident integer;
+  current_uuid uuid;
+  old_idents integer[];
+  new_idents integer[];
+  republished_ident integer;
+BEGIN
+  -- 1. The uuid default is not on the modules.uuid column, because the value
+  -- needs to be associated with a document_controls entry to prevent uuid
+  -- collisions with pending publications.
+  IF NEW.uuid IS NULL THEN
+    INSERT INTO document_controls (uuid, licenseid)
+      VALUES (DEFAULT, NEW.licenseid)
+      RETURNING uuid INTO NEW.uuid;
+  END IF;
 
-CREATE OR REPLACE FUNCTION assign_uuid_default ()
-  RETURNS TRIGGER
-AS $$
-  from cnxarchive.database import assign_document_controls_default_trigger
-  return assign_document_controls_default_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
+  -- 2. Give the authors and maintainers publish permission,
+  -- and shadow all the roles from persons into users.
+  IF is_legacy_publication THEN
+    INSERT INTO document_acl (uuid, user_id, permission)
+      SELECT DISTINCT NEW.uuid, r.user_id, 'publish'::permission_type
+      FROM unnest(coalesce(NEW.authors, '{}'::text[]) ||
+                  coalesce(NEW.maintainers, '{}'::text[])) AS r(user_id)
+      WHERE NOT EXISTS (
+        SELECT 1 FROM document_acl a
+        WHERE a.uuid = NEW.uuid AND a.user_id = r.user_id
+              AND a.permission = 'publish');
+
+    INSERT INTO users (username, first_name, last_name, full_name, title)
+      SELECT p.personid, p.firstname, p.surname, p.fullname, p.honorific
+      FROM persons p
+      WHERE p.personid = ANY (coalesce(NEW.authors, '{}'::text[]) ||
+                              coalesce(NEW.maintainers, '{}'::text[]) ||
+                              coalesce(NEW.licensors, '{}'::text[]))
+            AND NOT EXISTS (
+              SELECT 1 FROM users u WHERE u.username = p.personid);
+  END IF;
 
-CREATE OR REPLACE FUNCTION upsert_document_acl ()
-  RETURNS TRIGGER
-AS $$
-  from cnxarchive.database import upsert_document_acl_trigger
-  return upsert_document_acl_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
+  -- 3. Legacy supplied moduleids are kept as is.
+  IF NEW.moduleid IS NULL THEN
+    IF NEW.portal_type IN ('Collection', 'SubCollection') THEN
+      NEW.moduleid := 'col' || nextval('collectionid_seq')::text;
+    ELSE
+      NEW.moduleid := 'm' || nextval('moduleid_seq')::text;
+    END IF;
+  END IF;
 
-CREATE OR REPLACE FUNCTION upsert_user_shadow ()
-  RETURNS TRIGGER
-AS $$
-  from cnxarchive.database import upsert_users_from_legacy_publication_trigger
-  return upsert_users_from_legacy_publication_trigger(plpy, TD)
-$$ LANGUAGE plpythonu;
+  -- 4. e.g. there is a collection c1 v2.1, which contains a chapter sc1 v2.1,
+  -- which contains a module m1 v3. When m1 v4 is published, c1 v2.2 and
+  -- sc1 v2.2 are published with a copy of the c1 v2.1 tree, where m1 v4,
+  -- sc1 v2.2 and c1 v2.2 replace m1 v3, sc1 v2.1 and c1 v2.1.
+  -- Another chapter sc2 stays at v2.1.
+  IF is_legacy_publication THEN
+    IF NEW.portal_type IN ('Collection', 'Module') THEN
+      legacy_major := split_part(NEW.version, '.', 1)::integer;
+      legacy_minor := split_part(NEW.version, '.', 2)::integer;
+    END IF;
+    IF NEW.portal_type = 'Collection' THEN
+      NEW.major_version := legacy_minor;
+      IF NEW.minor_version IS NULL THEN
+        NEW.minor_version := 1;
+      END IF;
+    ELSIF NEW.portal_type = 'Module' THEN
+      -- N.B. a very few older modules had major=2 and minor zero-based.
+      NEW.major_version := legacy_minor + (legacy_major - 1);
+      NEW.minor_version := NULL;
+    END IF;
 
-CREATE OR REPLACE FUNCTION module_html_abstract ()
+    SELECT module_ident, uuid INTO current_ident, current_uuid
+    FROM modules WHERE moduleid = NEW.moduleid
+    ORDER BY revised DESC LIMIT 1;
+
+    IF current_ident IS NOT NULL THEN
+      -- Keep the uuid constant per moduleid
+      NEW.uuid := current_uuid;
+    END IF;
+
+    IF current_ident IS NOT NULL AND NEW.portal_type = 'Module' THEN
+      old_idents := ARRAY[current_ident];
+      new_idents := ARRAY[NEW.module_ident];
+
+      -- The subcollections containing the module, in any collection
+      FOR republished_ident IN
+        WITH RECURSIVE t(node, parent, path, document) AS (
+            SELECT nodeid, parent_id, ARRAY[nodeid], documentid
+            FROM trees
+            WHERE documentid = current_ident AND is_collated = 'False'
+          UNION ALL
+            SELECT c.nodeid, c.parent_id, t.path || c.nodeid, c.documentid
+            FROM trees c JOIN t ON c.nodeid = t.parent
+            WHERE NOT c.nodeid = ANY (t.path)
+        )
+        SELECT DISTINCT m.module_ident
+        FROM t JOIN modules m ON t.document = m.module_ident
+        WHERE m.portal_type = 'SubCollection'
+        ORDER BY m.module_ident
+      LOOP
+        old_idents := old_idents || republished_ident;
+        new_idents := new_idents || republish_collection(
+          republished_ident, NEW.submitter, NEW.submitlog);
+      END LOOP;
+
+      -- The latest versions of the collections containing the module
+      FOR republished_ident IN
+        WITH RECURSIVE t(node, parent, path, document) AS (
+            SELECT nodeid, parent_id, ARRAY[nodeid], documentid
+            FROM trees
+            WHERE documentid = current_ident AND is_collated = 'False'
+          UNION ALL
+            SELECT c.nodeid, c.parent_id, t.path || c.nodeid, c.documentid
+            FROM trees c JOIN t ON c.nodeid = t.parent
+            WHERE NOT c.nodeid = ANY (t.path)
+        )
+        SELECT DISTINCT m.module_ident
+        FROM t JOIN modules m ON t.document = m.module_ident
+        WHERE m.portal_type = 'Collection'
+              AND NOT EXISTS (
+                SELECT 1 FROM modules l
+                WHERE l.uuid = m.uuid AND l.portal_type = 'Collection'
+                      AND l.revised > m.revised)
+        ORDER BY m.module_ident
+      LOOP
+        old_idents := old_idents || republished_ident;
+        new_idents := new_idents || republish_collection(
+          republished_ident, NEW.submitter, NEW.submitlog);
+        PERFORM rebuild_collection_tree(republished_ident,
+                                        old_idents, new_idents);
+      END LOOP;
+    END IF;
+  END IF;
+
+  -- 5. The minor version of collections is NULL by default,
+  -- which is the correct default for modules.
+  IF NEW.minor_version IS NULL
+     AND NEW.portal_type IN ('Collection', 'SubCollection') THEN
+    NEW.minor_version := 1;
+  END IF;
+  IF NEW.version IS NULL THEN
+    NEW.version := '1.' || NEW.major_version;
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Queues the abstract of the module (or of the module_files' module)
+-- when it has no HTML yet. Modules sharing an abstract queue it once.
+CREATE OR REPLACE FUNCTION queue_html_abstract ()
   RETURNS TRIGGER
 AS $$
 DECLARE
-  has_html text;
+  abstract_id integer;
 BEGIN
-  SELECT html INTO has_html FROM abstracts a JOIN modules m ON a.abstractid = m.abstractid WHERE module_ident = NEW.module_ident;
-  IF has_html IS NULL
-    THEN
-      UPDATE abstracts SET html = html_abstract(NEW.module_ident)
-        WHERE abstractid = NEW.abstractid;
+  IF TG_TABLE_NAME = 'modules' THEN
+    abstract_id := NEW.abstractid;
+  ELSE
+    SELECT abstractid INTO abstract_id
+    FROM modules WHERE module_ident = NEW.module_ident;
   END IF;
-RETURN NEW;
+
+  BEGIN
+    INSERT INTO html_abstract_queue (abstractid, module_ident)
+      SELECT abstractid, NEW.module_ident FROM abstracts
+      WHERE abstractid = abstract_id AND html IS NULL
+            AND NOT EXISTS (SELECT 1 FROM html_abstract_queue
+                            WHERE abstractid = abstract_id);
+  EXCEPTION WHEN unique_violation THEN
+    -- queued by a concurrent transaction
+    NULL;
+  END;
+  RETURN NULL;
 END;
 $$ LANGUAGE PLPGSQL;
 
+-- Transforms the abstracts queued by the statement's transaction
+-- to HTML, once per abstract, unless the ``cnxdb.html_abstract_mode``
+-- setting is 'async', in which case they are left in html_abstract_queue
+-- to be transformed outside of the transaction.
+CREATE OR REPLACE FUNCTION process_html_abstracts ()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  mode text;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM html_abstract_queue) THEN
+    RETURN NULL;
+  END IF;
 
-CREATE TRIGGER act_10_module_uuid_default
-  BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE assign_uuid_default();
-
-CREATE TRIGGER act_20_module_acl_upsert
-  BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE upsert_document_acl();
-
-CREATE TRIGGER act_80_legacy_module_user_upsert
-  BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE upsert_user_shadow();
+  BEGIN
+    mode := current_setting('cnxdb.html_abstract_mode');
+  EXCEPTION WHEN undefined_object THEN
+    mode := 'sync';
+  END;
 
-CREATE TRIGGER module_moduleid_default
-  BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE assign_moduleid_default();
+  IF mode != 'async' THEN
+    WITH queued AS (
+      DELETE FROM html_abstract_queue WHERE queued_by = txid_current()
+      RETURNING abstractid, module_ident
+    )
+    UPDATE abstracts a SET html = html_abstract(a.abstract, q.module_ident)
+    FROM queued q
+    WHERE a.abstractid = q.abstractid AND a.html IS NULL;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE PLPGSQL;
 
-CREATE TRIGGER module_published
-  BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE republish_module();
 
-CREATE TRIGGER module_version_default
+CREATE TRIGGER act_10_module_publication_defaults
   BEFORE INSERT ON modules FOR EACH ROW
-  EXECUTE PROCEDURE assign_version_default();
+  EXECUTE PROCEDURE module_publication_defaults();
 
 CREATE TRIGGER collection_html_abstract_trigger
   AFTER INSERT OR UPDATE ON modules FOR EACH ROW
   WHEN (new.portal_type = 'Collection'::text)
-  EXECUTE PROCEDURE module_html_abstract();
+  EXECUTE PROCEDURE queue_html_abstract();
 
 CREATE TRIGGER module_html_abstract_trigger
   AFTER INSERT OR UPDATE ON module_files FOR EACH ROW
   WHEN (new.filename = 'index.cnxml'::text)
-  EXECUTE PROCEDURE module_html_abstract();
+  EXECUTE PROCEDURE queue_html_abstract();
+
+CREATE TRIGGER process_html_abstracts
+  AFTER INSERT OR UPDATE ON modules FOR EACH STATEMENT
+  EXECUTE PROCEDURE process_html_abstracts();
+
+CREATE TRIGGER process_html_abstracts
+  AFTER INSERT OR UPDATE ON module_files FOR EACH STATEMENT
+  EXECUTE PROCEDURE process_html_abstracts();
 
 
 
@@ -221,6 +530,97 @@ CREATE TRIGGER optional_roles_user_insert
 
 
 
+-- Drops the cached legacy_mdml_inner fragments (see legacy_mdml_fragments)
+-- of the modules whose metadata changed, along with the fragments of the
+-- modules derived from them: their derived-from element has the parent's
+-- url and, in the recursive fragments, the metadata of all the ancestors.
+CREATE OR REPLACE FUNCTION invalidate_legacy_mdml()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  idents integer[];
+BEGIN
+  IF TG_LEVEL = 'STATEMENT' THEN
+    -- licenses and persons, which can affect any module
+    DELETE FROM legacy_mdml_fragments;
+    RETURN NULL;
+  ELSIF TG_TABLE_NAME = 'abstracts' THEN
+    idents := ARRAY(SELECT module_ident FROM modules
+                    WHERE abstractid = NEW.abstractid);
+  ELSIF TG_TABLE_NAME = 'keywords' THEN
+    idents := ARRAY(SELECT module_ident FROM modulekeywords
+                    WHERE keywordid = NEW.keywordid);
+  ELSIF TG_TABLE_NAME = 'tags' THEN
+    idents := ARRAY(SELECT module_ident FROM moduletags
+                    WHERE tagid = NEW.tagid);
+  ELSIF TG_TABLE_NAME = 'roles' THEN
+    idents := ARRAY(SELECT module_ident FROM moduleoptionalroles
+                    WHERE roleid = NEW.roleid);
+  ELSIF TG_OP = 'DELETE' THEN
+    idents := ARRAY[OLD.module_ident];
+  ELSIF TG_OP = 'UPDATE' THEN
+    idents := ARRAY[OLD.module_ident, NEW.module_ident];
+  ELSE
+    idents := ARRAY[NEW.module_ident];
+  END IF;
+
+  DELETE FROM legacy_mdml_fragments
+  WHERE module_ident = ANY (idents)
+     OR module_ident IN (SELECT m.module_ident FROM modules AS m
+                         WHERE m.parent = ANY (idents))
+     OR (recurse AND module_ident IN (
+           WITH RECURSIVE derived (module_ident) AS (
+               SELECT m.module_ident FROM modules AS m
+               WHERE m.parent = ANY (idents)
+             UNION
+               SELECT m.module_ident
+               FROM modules AS m JOIN derived AS d
+                 ON m.parent = d.module_ident)
+           SELECT module_ident FROM derived));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF moduleid, version, name, created, revised, abstractid,
+                  licenseid, parent, language, authors, maintainers, licensors
+  ON modules FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON moduleoptionalroles FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON moduletags FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON modulekeywords FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF abstract ON abstracts FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF word ON keywords FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF tag, scheme ON tags FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF roleparam ON roles FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE ON licenses FOR EACH STATEMENT
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+
+
 
 CREATE FUNCTION update_md5() RETURNS "trigger"
     AS $$
@@ -239,17 +639,31 @@ CREATE TRIGGER update_file_md5
 CREATE OR REPLACE FUNCTION update_sha1()
     RETURNS TRIGGER
 AS $$
-    import hashlib
-
-    TD['new']['sha1'] = hashlib.new('sha1', TD['new']['file']).hexdigest()
-    return 'MODIFY'
-$$ LANGUAGE plpythonu;
+BEGIN
+  NEW.sha1 = sha1(NEW.file);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
 
 CREATE TRIGGER update_files_sha1
     BEFORE INSERT OR UPDATE OF file ON files
     FOR EACH ROW
     EXECUTE PROCEDURE update_sha1();
 
+CREATE OR REPLACE FUNCTION update_file_size()
+    RETURNS TRIGGER
+AS $$
+BEGIN
+  NEW.size = octet_length(NEW.file);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_files_size
+    BEFORE INSERT OR UPDATE OF file ON files
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_file_size();
+
 CREATE OR REPLACE FUNCTION add_module_file ()
   RETURNS trigger
 AS $$
@@ -370,18 +784,33 @@ CREATE TRIGGER set_default_canonical_trigger
   WHEN (new.canonical is NULL)
   EXECUTE PROCEDURE set_default_canonical();
 
+-- The collection.xml is generated here, unless the ``cnxdb.collxml_mode``
+-- setting is 'async', in which case the collection is queued in
+-- collxml_queue to be generated outside of the publishing transaction.
 CREATE OR REPLACE FUNCTION gen_minor_collxml()
   RETURNS TRIGGER AS $$
   DECLARE
     has_existing_collxml integer;
     _collxml_id integer;
+    mode text;
 
   BEGIN
     has_existing_collxml := (SELECT fileid FROM module_files
         WHERE module_ident = NEW.module_ident
         AND filename = 'collection.xml');
 
-    IF has_existing_collxml IS NULL THEN
+    BEGIN
+      mode := current_setting('cnxdb.collxml_mode');
+    EXCEPTION WHEN undefined_object THEN
+      mode := 'sync';
+    END;
+
+    IF has_existing_collxml IS NULL AND mode = 'async' THEN
+      INSERT INTO collxml_queue (module_ident)
+        SELECT NEW.module_ident
+        WHERE NOT EXISTS (SELECT 1 FROM collxml_queue
+                          WHERE module_ident = NEW.module_ident);
+    ELSIF has_existing_collxml IS NULL THEN
       INSERT INTO files (file, media_type) SELECT
           pretty_print(legacy_collxml(NEW.module_ident, True))::text::bytea,
           'text/xml'
@@ -7,7 +7,7 @@ WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated) AS (
            is_collated
     FROM trees tr, modules m
     WHERE m.uuid = $1 AND
-          module_version( m.major_version, m.minor_version) = $2 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
       tr.documentid = m.module_ident AND
       tr.is_collated = $3 AND
       tr.parent_id is NULL
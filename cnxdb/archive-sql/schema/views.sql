@@ -14,46 +14,21 @@ CREATE OR REPLACE VIEW all_modules as
 	FROM latest_modules;
 
 CREATE OR REPLACE VIEW current_modules AS
-WITH latest_idents (module_ident) AS (
-          SELECT module_ident FROM modules m2 join modulestates ms
-                on m2.stateid = ms.stateid
-                WHERE m2.major_version = (
-                    SELECT max(major_version) FROM modules m3
-                        WHERE m2.uuid = m3.uuid
-                )
-                AND
-                (m2.minor_version IS NULL OR
-                 m2.minor_version = (
-                    SELECT max(minor_version) FROM modules m4
-                        WHERE m2.uuid = m4.uuid AND
-                        m2.major_version = m4.major_version
-                    )
-                )
-                AND ms.statename in ('current', 'fallback')
-        )
-SELECT m.* FROM latest_idents li JOIN modules m
-ON m.module_ident = li.module_ident;
+SELECT m.* FROM (
+          -- The highest version of each uuid, in one pass over the
+          -- modules_uuid_version_idx index.
+          SELECT DISTINCT ON (uuid) uuid, major_version, minor_version
+          FROM modules
+          ORDER BY uuid, major_version DESC NULLS LAST,
+                   minor_version DESC NULLS LAST
+        ) AS lv
+     JOIN modules m ON m.uuid = lv.uuid
+          AND m.major_version = lv.major_version
+          AND (m.minor_version IS NULL OR m.minor_version = lv.minor_version)
+     JOIN modulestates ms ON m.stateid = ms.stateid
+WHERE ms.statename in ('current', 'fallback');
 
 CREATE OR REPLACE VIEW all_current_modules AS
-WITH latest_idents(module_ident) AS (
-         SELECT m2.module_ident
-           FROM modules m2
-             JOIN modulestates ms ON m2.stateid = ms.stateid
-           WHERE m2.major_version = (
-              SELECT max(m3.major_version) AS max
-                   FROM modules m3
-                  WHERE m2.uuid = m3.uuid
-            )
-            AND
-            (m2.minor_version IS NULL OR
-             m2.minor_version = (
-                SELECT max(m4.minor_version) AS max
-                   FROM modules m4
-                  WHERE m2.uuid = m4.uuid AND
-                        m2.major_version = m4.major_version
-                )
-            )
-        )
  SELECT m.module_ident,
     m.moduleid,
     m.version,
@@ -81,6 +56,14 @@ WITH latest_idents(module_ident) AS (
     m.print_style,
     m.baked,
     m.recipe
-   FROM latest_idents li
-     JOIN modules m ON m.module_ident = li.module_ident
+   FROM (
+          SELECT DISTINCT ON (uuid) uuid, major_version, minor_version
+          FROM modules
+          ORDER BY uuid, major_version DESC NULLS LAST,
+                   minor_version DESC NULLS LAST
+        ) AS lv
+     JOIN modules m ON m.uuid = lv.uuid
+          AND m.major_version = lv.major_version
+          AND (m.minor_version IS NULL OR m.minor_version = lv.minor_version)
+     JOIN modulestates ms ON m.stateid = ms.stateid
 ;
@@ -4,20 +4,23 @@
 -- Public License version 3 (AGPLv3).
 -- See LICENCE.txt for details.
 -- ###
+-- Match the users first, so the trigram indexes on the name columns
+-- can be used, then find the modules through the gin index on the
+-- array column (``= ANY (array)`` can not use the index, ``@>`` can).
 SELECT
   module_ident,
   %({0})s::text||'-::-author' as key
 FROM
-  latest_modules AS m,
-  users AS u
-WHERE
-  u.username = ANY (m.authors)
-  AND
-  (u.first_name ~* req(%({0})s::text)
-   OR
-   u.last_name ~* req(%({0})s::text)
-   OR
-   u.full_name ~* regexp_replace(req(%({0})s::text), ' ', '.+', 'g')
-   OR
-   u.username ~* req(%({0})s::text)
-   )
+  (SELECT username
+   FROM users
+   WHERE
+      (first_name ~* req(%({0})s::text)
+       OR
+       last_name ~* req(%({0})s::text)
+       OR
+       full_name ~* regexp_replace(req(%({0})s::text), ' ', '.+', 'g')
+       OR
+       username ~* req(%({0})s::text)
+       )
+   ) AS u
+  JOIN latest_modules AS m ON m.authors @> ARRAY[u.username]
@@ -4,24 +4,27 @@
 -- Public License version 3 (AGPLv3).
 -- See LICENCE.txt for details.
 -- ###
+-- Match the users first, so the trigram indexes on the name columns
+-- can be used, then find the roles through the gin index on
+-- ``moduleoptionalroles.personids``.
 SELECT
   module_ident,
   %({0})s::text||'-::-translator' as key
 FROM
-  latest_modules AS m
-  NATURAL JOIN moduleoptionalroles AS mor
-  NATURAL JOIN roles AS r,
-  users AS u
+  (SELECT username
+   FROM users
+   WHERE
+      (first_name ~* req(%({0})s::text)
+       OR
+       last_name ~* req(%({0})s::text)
+       OR
+       full_name ~* req(%({0})s::text)
+       OR
+       username ~* req(%({0})s::text)
+       )
+   ) AS u
+  JOIN moduleoptionalroles AS mor ON mor.personids @> ARRAY[u.username]
+  NATURAL JOIN roles AS r
+  NATURAL JOIN latest_modules AS m
 WHERE
-  u.username = ANY (mor.personids)
-  AND
   lower(r.rolename) = 'translator'
-  AND
-  (u.first_name ~* req(%({0})s::text)
-   OR
-   u.last_name ~* req(%({0})s::text)
-   OR
-   u.full_name ~* req(%({0})s::text)
-   OR
-   u.username ~* req(%({0})s::text)
-   )
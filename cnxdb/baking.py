@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Consumption of the baking queue
+
+When the ``cnxdb.post_publication_mode`` setting is ``'queue'``
+(e.g. ``ALTER DATABASE ... SET cnxdb.post_publication_mode = 'queue'``),
+the ``post_publication`` trigger queues the modules entering the
+post-publication state (``stateid = 5``) in ``baking_queue``, instead of
+notifying the ``post_publication`` channel once per module.
+The ``post_publication_queue`` channel is notified once per transaction
+instead, and any number of bakers listening to it claim the jobs using
+the functions here, without scanning ``modules``.
+
+A baker claims a batch and commits, which hides the claimed jobs from
+the other bakers for ``visibility_timeout`` seconds. It then completes
+each job once baked, or releases it to be retried. The jobs of a baker
+that dies become visible again once their visibility timeout passes.
+
+"""
+import time
+
+from cnxdb.queues import claim_batch_params, claim_batch_sql
+
+
+#: Channel notified when jobs are queued
+CHANNEL = 'post_publication_queue'
+
+BATCH_SIZE = 1
+
+#: Seconds a claimed job is hidden from the other bakers
+VISIBILITY_TIMEOUT = 600
+
+#: Jobs claimed this many times are no longer claimed
+MAX_ATTEMPTS = 3
+
+# The visible_at condition is checked again by the UPDATE, in case
+# another baker claimed the job and committed in the meantime.
+CLAIM_BATCH = """\
+UPDATE baking_queue AS q
+SET attempts = q.attempts + 1,
+    requeued = FALSE,
+    visible_at = CURRENT_TIMESTAMP + %(timeout)s * interval '1 second'
+FROM ({}) AS claimed,
+     modules AS m
+WHERE q.module_ident = claimed.module_ident
+      AND q.visible_at <= CURRENT_TIMESTAMP
+      AND m.module_ident = q.module_ident
+RETURNING q.module_ident,
+          ident_hash(m.uuid, m.major_version, m.minor_version),
+          q.attempts""".format(
+    claim_batch_sql('baking_queue', 'module_ident',
+                    order_by='priority DESC, queued',
+                    where=('visible_at <= CURRENT_TIMESTAMP '
+                           'AND attempts < %(max_attempts)s')))
+
+# A job flagged by a bake requested while it was claimed is queued again.
+COMPLETE = """\
+DELETE FROM baking_queue WHERE module_ident = %(ident)s AND NOT requeued;
+UPDATE baking_queue
+SET requeued = FALSE, attempts = 0,
+    queued = CURRENT_TIMESTAMP, visible_at = CURRENT_TIMESTAMP
+WHERE module_ident = %(ident)s"""
+
+# The released job bakes the module again anyway.
+RELEASE = """\
+UPDATE baking_queue
+SET requeued = FALSE,
+    visible_at = CURRENT_TIMESTAMP + %s * interval '1 second'
+WHERE module_ident = %s"""
+
+REBAKE_PRINT_STYLE = "SELECT * FROM rebake_print_style(%s, %s, %s)"
+
+#: Number of books moved to the post-publication state per transaction
+REBAKE_THROTTLE = 10
+
+
+def claim_baking_jobs(cursor, batch_size=BATCH_SIZE,
+                      visibility_timeout=VISIBILITY_TIMEOUT,
+                      max_attempts=MAX_ATTEMPTS):
+    """Claims a batch of the queued baking jobs, with the highest
+    priority and oldest first. The claim takes effect when the cursor's
+    transaction is committed, which should be right away.
+
+    :param cursor: database cursor
+    :param int batch_size: maximum number of jobs to claim
+    :param int visibility_timeout: seconds the claimed jobs are hidden
+        from the other bakers
+    :param int max_attempts: the jobs already claimed this many times
+        are skipped
+    :return: the ``(module_ident, ident_hash, attempts)`` of the claimed
+        jobs
+    :rtype: list
+
+    """
+    cursor.execute(CLAIM_BATCH, claim_batch_params(
+        batch_size, timeout=visibility_timeout, max_attempts=max_attempts))
+    return cursor.fetchall()
+
+
+def complete_baking_job(cursor, module_ident):
+    """Removes a baked job from the queue. When a bake of the module was
+    requested while the job was claimed, the job is queued again instead.
+
+    :param cursor: database cursor
+    :param int module_ident: the job's module_ident
+
+    """
+    cursor.execute(COMPLETE, {'ident': module_ident})
+
+
+def release_baking_job(cursor, module_ident, delay=0):
+    """Makes a claimed job visible to the bakers again, after ``delay``
+    seconds (e.g. to retry a failed bake later).
+
+    :param cursor: database cursor
+    :param int module_ident: the job's module_ident
+    :param int delay: seconds before the job is visible
+
+    """
+    cursor.execute(RELEASE, (delay, module_ident))
+
+
+def rebake_print_style(connection, print_style, throttle=REBAKE_THROTTLE,
+                       interval=0):
+    """Rebakes the latest version of the books using the given print style
+    (e.g. after a new recipe became its default), ``throttle`` books
+    at a time. Each batch is committed, so the bakers can start on it,
+    before waiting ``interval`` seconds and moving to the next one.
+    The books are moved in module_ident order, each at most once, even
+    when it returns to another state (e.g. a new publication) meanwhile.
+
+    :param connection: DB-API connection
+    :param str print_style: the print style
+    :param int throttle: number of books per batch
+    :param float interval: seconds to wait between batches
+    :return: iterator of the ``(rebaking, remaining)`` number of books
+        after each batch
+    :rtype: iterator
+
+    """
+    last_ident = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(REBAKE_PRINT_STYLE,
+                           (print_style, throttle, last_ident))
+            rebaking, remaining, last_ident = cursor.fetchone()
+        connection.commit()
+        yield rebaking, remaining
+        if not rebaking or not remaining:
+            break
+        if interval:
+            time.sleep(interval)
+
+
+__all__ = (
+    'CHANNEL',
+    'claim_baking_jobs',
+    'complete_baking_job',
+    'rebake_print_style',
+    'release_baking_job',
+)
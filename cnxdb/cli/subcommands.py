@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """cnx-db subcommands"""
 from __future__ import print_function
+import argparse
 import sys
 
 from ..scripting import prepare
@@ -41,3 +42,161 @@ def venv_cmd(args_namespace):
     from ..init import init_venv
     init_venv(env['engines']['super'])
     return 0
+
+
+def _ingest_hits_args(parser):
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin,
+                        help=("CSV file of ident (module_ident or "
+                              "ident_hash), start, end and hits "
+                              "(default: stdin)"))
+    parser.add_argument('--header', action='store_true',
+                        help="skip the first (header) row")
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help="number of rows to load at a time")
+    parser.add_argument('--update-ranks', action='store_true',
+                        help="update the hit ranks after loading")
+
+
+@register_subcommand('ingest-hits', _ingest_hits_args)
+def ingest_hits_cmd(args_namespace):
+    """bulk load document hits"""
+    try:
+        env = prepare()
+    except RuntimeError as exc:
+        if 'DB_URL' in exc.args[0]:
+            print(exc.args[0], file=sys.stderr)
+            return 4
+        else:  # pragma: no cover
+            raise
+    from ..hits import ingest_hits, read_hits_csv
+    records = read_hits_csv(args_namespace.file, args_namespace.header)
+    conn = env['engines']['common'].raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            loaded, unresolved = ingest_hits(
+                cursor, records,
+                batch_size=args_namespace.batch_size,
+                update_ranks=args_namespace.update_ranks)
+    except ValueError as exc:
+        # The batches already copied are rolled back with the rest.
+        conn.rollback()
+        print("Malformed hits, nothing was loaded: {}".format(exc),
+              file=sys.stderr)
+        return 5
+    else:
+        conn.commit()
+    finally:
+        conn.close()
+    for ident_hash in unresolved:
+        print("Unknown ident_hash: {}".format(ident_hash), file=sys.stderr)
+    print("Loaded {} hits".format(loaded))
+    return 0
+
+
+def _gen_collxml_args(parser):
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of collections to generate in parallel")
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help="number of collections to generate "
+                             "per transaction")
+
+
+@register_subcommand('gen-collxml', _gen_collxml_args)
+def gen_collxml_cmd(args_namespace):
+    """generate the queued collection.xml files"""
+    try:
+        env = prepare()
+    except RuntimeError as exc:
+        if 'DB_URL' in exc.args[0]:
+            print(exc.args[0], file=sys.stderr)
+            return 4
+        else:  # pragma: no cover
+            raise
+    from ..collxml import run_collxml_workers
+    engine = env['engines']['common']
+    idents, failed = run_collxml_workers(
+        engine.raw_connection,
+        workers=args_namespace.workers,
+        batch_size=args_namespace.batch_size)
+    print("Generated {} collection.xml files".format(len(idents)))
+    for ident in sorted(set(failed)):
+        print("Failed to generate the collection.xml of {} "
+              "(see collxml_queue.error)".format(ident), file=sys.stderr)
+    return 0
+
+
+def _rebake_print_style_args(parser):
+    parser.add_argument('print_style',
+                        help="print style of the books to rebake")
+    parser.add_argument('--throttle', type=int, default=10,
+                        help="number of books to rebake per transaction")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="seconds to wait between transactions")
+
+
+@register_subcommand('rebake-print-style', _rebake_print_style_args)
+def rebake_print_style_cmd(args_namespace):
+    """rebake the latest books using a print style"""
+    try:
+        env = prepare()
+    except RuntimeError as exc:
+        if 'DB_URL' in exc.args[0]:
+            print(exc.args[0], file=sys.stderr)
+            return 4
+        else:  # pragma: no cover
+            raise
+    from ..baking import rebake_print_style
+    conn = env['engines']['common'].raw_connection()
+    total = 0
+    try:
+        for rebaking, remaining in rebake_print_style(
+                conn, args_namespace.print_style,
+                throttle=args_namespace.throttle,
+                interval=args_namespace.interval):
+            total += rebaking
+            print("Rebaking {} books, {} remaining".format(total, remaining))
+    finally:
+        conn.close()
+    return 0
+
+
+def _gen_html_abstracts_args(parser):
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="number of abstracts to transform "
+                             "per transaction")
+
+
+@register_subcommand('gen-html-abstracts', _gen_html_abstracts_args)
+def gen_html_abstracts_cmd(args_namespace):
+    """transform the queued abstracts to html"""
+    try:
+        env = prepare()
+    except RuntimeError as exc:
+        if 'DB_URL' in exc.args[0]:
+            print(exc.args[0], file=sys.stderr)
+            return 4
+        else:  # pragma: no cover
+            raise
+    from ..abstracts import process_html_abstract_queue
+    conn = env['engines']['common'].raw_connection()
+    total = 0
+    failures = set()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                processed, failed = process_html_abstract_queue(
+                    cursor, batch_size=args_namespace.batch_size)
+            conn.commit()
+            if not processed and not failed:
+                break
+            total += len(processed)
+            failures.update(failed)
+    finally:
+        conn.close()
+    print("Transformed {} abstracts".format(total))
+    for abstractid in sorted(failures):
+        print("Failed to transform the abstract {} "
+              "(see html_abstract_queue.error)".format(abstractid),
+              file=sys.stderr)
+    return 0
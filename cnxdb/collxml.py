@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Generation of the queued ``collection.xml`` files
+
+When the ``cnxdb.collxml_mode`` setting is ``'async'``
+(e.g. ``ALTER DATABASE ... SET cnxdb.collxml_mode = 'async'``),
+publishing a minor version of a collection only queues it in
+``collxml_queue``. The functions here generate the queued files
+outside of the publishing transaction.
+
+A collection whose generation fails stays in the queue, with the error,
+and is retried after the other collections, up to ``MAX_ATTEMPTS`` times.
+
+"""
+import threading
+
+import psycopg2
+
+from cnxdb.queues import claim_batch_params, claim_batch_sql
+
+BATCH_SIZE = 10
+
+#: Collections that failed this many times are no longer claimed
+MAX_ATTEMPTS = 3
+
+CLAIM_BATCH = claim_batch_sql('collxml_queue', 'module_ident',
+                              order_by='attempts, queued',
+                              where='attempts < %(max_attempts)s')
+
+GENERATE = "SELECT gen_collxml(%s)"
+
+FAIL = """\
+UPDATE collxml_queue SET attempts = attempts + 1, error = %s
+WHERE module_ident = %s"""
+
+DEQUEUE = "DELETE FROM collxml_queue WHERE module_ident = ANY (%s)"
+
+
+def process_collxml_queue(cursor, batch_size=BATCH_SIZE,
+                          max_attempts=MAX_ATTEMPTS):
+    """Generates the ``collection.xml`` of a batch of queued collections.
+    The generation and the removal from the queue happen in the cursor's
+    transaction, which the caller commits. Each collection is generated
+    in a savepoint, so a failure is recorded in the queue without
+    aborting the rest of the batch.
+
+    :param cursor: database cursor
+    :param int batch_size: maximum number of collections to generate
+    :param int max_attempts: the collections that already failed this
+        many times are skipped
+    :return: the module_idents of the generated collections and of the
+        collections that failed
+    :rtype: tuple
+
+    """
+    cursor.execute(CLAIM_BATCH, claim_batch_params(
+        batch_size, max_attempts=max_attempts))
+    idents = [row[0] for row in cursor.fetchall()]
+    generated = []
+    failed = []
+    for ident in idents:
+        cursor.execute("SAVEPOINT gen_collxml")
+        try:
+            cursor.execute(GENERATE, (ident,))
+        except psycopg2.Error as exc:
+            cursor.execute("ROLLBACK TO SAVEPOINT gen_collxml")
+            cursor.execute(FAIL, (str(exc), ident))
+            failed.append(ident)
+        else:
+            cursor.execute("RELEASE SAVEPOINT gen_collxml")
+            generated.append(ident)
+    if generated:
+        cursor.execute(DEQUEUE, (generated,))
+    return generated, failed
+
+
+def _work(connect, batch_size, results, failures, errors):
+    conn = connect()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                generated, failed = process_collxml_queue(cursor,
+                                                          batch_size)
+            conn.commit()
+            if not generated and not failed:
+                break
+            results.extend(generated)
+            failures.extend(failed)
+    except Exception as exc:
+        conn.rollback()
+        errors.append(exc)
+    finally:
+        conn.close()
+
+
+def run_collxml_workers(connect, workers=1, batch_size=BATCH_SIZE):
+    """Generates all of the queued ``collection.xml`` files using
+    ``workers`` threads, each with its own connection and committing
+    after every batch. The generation runs in the database, so the
+    threads work in parallel.
+
+    :param connect: callable returning a new DB-API connection
+    :param int workers: number of workers
+    :param int batch_size: number of collections per transaction
+    :return: the module_idents of the generated collections and of the
+        failed attempts (see ``collxml_queue.error``)
+    :rtype: tuple
+    :raises: the first error raised by a worker
+
+    """
+    results = []
+    failures = []
+    errors = []
+    threads = [threading.Thread(target=_work,
+                                args=(connect, batch_size, results,
+                                      failures, errors))
+               for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results, failures
+
+
+__all__ = (
+    'process_collxml_queue',
+    'run_collxml_workers',
+)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Bulk loading of document hits (view counts)"""
+import csv
+import io
+import numbers
+
+
+BATCH_SIZE = 10000
+
+RESOLVE_IDENT_HASHES = """\
+SELECT ident_hash(uuid, major_version, minor_version), module_ident
+FROM modules
+WHERE ident_hash(uuid, major_version, minor_version) = ANY (%s)"""
+
+COPY_HITS = """\
+COPY document_hits (documentid, start_timestamp, end_timestamp, hits)
+FROM STDIN"""
+
+
+def _format_timestamp(value):
+    isoformat = getattr(value, 'isoformat', None)
+    return isoformat() if isoformat is not None else str(value)
+
+
+def _batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _resolve_ident_hashes(cursor, batch, cache):
+    """Looks up the module_idents of the ident_hashes in ``batch`` that
+    are not yet in ``cache``. Unknown ident_hashes are cached as ``None``.
+
+    """
+    ident_hashes = set(
+        ident for ident, start, end, hits in batch
+        if not isinstance(ident, numbers.Integral) and ident not in cache)
+    if not ident_hashes:
+        return
+    cursor.execute(RESOLVE_IDENT_HASHES, (list(ident_hashes),))
+    found = dict(cursor.fetchall())
+    for ident_hash in ident_hashes:
+        cache[ident_hash] = found.get(ident_hash)
+
+
+def ingest_hits(cursor, records, batch_size=BATCH_SIZE, update_ranks=False):
+    """Bulk load document hits (e.g. from CDN logs) into ``document_hits``.
+    The records are loaded using ``COPY`` in batches of ``batch_size``.
+    Any ident_hashes are resolved to module_idents once per batch.
+
+    :param cursor: database cursor
+    :param records: iterable of ``(ident, start, end, hits)`` tuples,
+        where ``ident`` is either a module_ident (int) or an ident_hash
+        and ``start`` and ``end`` are datetimes or timestamp strings
+    :param int batch_size: number of records to load at a time
+    :param bool update_ranks: update the hit aggregates and ranks
+        (see ``update_hit_ranks()``) after loading
+    :return: the number of rows loaded and the sorted list of
+        ident_hashes that could not be resolved, which are skipped
+    :rtype: tuple
+
+    """
+    cache = {}
+    loaded = 0
+    for batch in _batches(records, batch_size):
+        _resolve_ident_hashes(cursor, batch, cache)
+        lines = []
+        for ident, start, end, hits in batch:
+            if not isinstance(ident, numbers.Integral):
+                ident = cache[ident]
+                if ident is None:
+                    continue
+            lines.append(u'\t'.join([
+                str(ident),
+                _format_timestamp(start),
+                _format_timestamp(end),
+                hits is None and u'\\N' or str(hits),
+            ]))
+        if not lines:
+            continue
+        buffer = io.BytesIO(u'\n'.join(lines).encode('utf-8') + b'\n')
+        cursor.copy_expert(COPY_HITS, buffer)
+        loaded += len(lines)
+    if update_ranks:
+        cursor.execute("SELECT update_hit_ranks()")
+    unresolved = sorted(k for k, v in cache.items() if v is None)
+    return loaded, unresolved
+
+
+def read_hits_csv(fileobj, has_header=False):
+    """Reads hit records from a CSV file with the columns
+    ident (module_ident or ident_hash), start, end and hits.
+    Empty rows are skipped.
+
+    :param fileobj: file-like object containing the CSV data
+    :param bool has_header: skip the first row
+    :return: generator of ``(ident, start, end, hits)`` tuples
+    :raises ValueError: on a malformed row, with its line number
+
+    """
+    reader = csv.reader(fileobj)
+    if has_header:
+        next(reader, None)
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        try:
+            ident, start, end, hits = row
+            hits = int(hits) if hits else None
+        except ValueError:
+            raise ValueError(
+                "line {}: expected ident, start, end and hits, "
+                "got {!r}".format(reader.line_num, row))
+        if ident.isdigit():
+            ident = int(ident)
+        yield (ident, start, end, hits)
+
+
+__all__ = (
+    'ingest_hits',
+    'read_hits_csv',
+)
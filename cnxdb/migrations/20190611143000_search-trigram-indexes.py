@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE INDEX users_first_name_trgm_gin ON users USING gin(first_name gin_trgm_ops);
+CREATE INDEX users_last_name_trgm_gin ON users USING gin(last_name gin_trgm_ops);
+CREATE INDEX users_full_name_trgm_gin ON users USING gin(full_name gin_trgm_ops);
+CREATE INDEX users_username_trgm_gin ON users USING gin(username gin_trgm_ops);
+CREATE INDEX latest_modules_gin_maintainers_idx ON latest_modules USING gin(maintainers);
+CREATE INDEX moduleoptionalroles_gin_personids_idx ON moduleoptionalroles USING gin(personids);
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP INDEX IF EXISTS users_first_name_trgm_gin;
+DROP INDEX IF EXISTS users_last_name_trgm_gin;
+DROP INDEX IF EXISTS users_full_name_trgm_gin;
+DROP INDEX IF EXISTS users_username_trgm_gin;
+DROP INDEX IF EXISTS latest_modules_gin_maintainers_idx;
+DROP INDEX IF EXISTS moduleoptionalroles_gin_personids_idx;
+""")
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+ALTER TABLE document_hits ADD COLUMN hitid BIGSERIAL NOT NULL;
+
+CREATE TABLE document_hit_aggregates (
+  documentid INTEGER NOT NULL PRIMARY KEY,
+  uuid UUID NOT NULL,
+  hits BIGINT NOT NULL DEFAULT 0,
+  -- The number of non-null document_hits.hits values folded in.
+  records BIGINT NOT NULL DEFAULT 0,
+  average FLOAT DEFAULT NULL,
+  FOREIGN KEY (documentid) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+CREATE TABLE document_hit_aggregates_watermark (
+  last_hitid BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX document_hits_hitid_idx ON document_hits (hitid);
+CREATE INDEX document_hit_aggregates_uuid_idx ON document_hit_aggregates (uuid);
+CREATE INDEX document_hit_aggregates_average_idx ON document_hit_aggregates (average);
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_hit_aggregates () RETURNS BIGINT
+AS $$
+  -- Fold the document_hits rows added since the watermark into the
+  -- document_hit_aggregates running totals.
+  -- Returns the number of document_hits rows folded in.
+  DECLARE
+    watermark BIGINT;
+    new_watermark BIGINT;
+    folded BIGINT;
+  BEGIN
+    -- The share lock waits for in-flight inserts to commit, so no row
+    -- below the new watermark can show up after it has been moved.
+    LOCK TABLE document_hits IN SHARE MODE;
+    LOCK TABLE document_hit_aggregates IN SHARE ROW EXCLUSIVE MODE;
+    watermark := COALESCE(max(last_hitid), 0)
+      FROM document_hit_aggregates_watermark;
+    SELECT max(hitid), count(*) INTO new_watermark, folded
+      FROM document_hits WHERE hitid > watermark;
+    IF folded = 0 THEN
+      RETURN 0;
+    END IF;
+
+    WITH
+      new_hits AS
+      (SELECT documentid,
+              COALESCE(sum(hits), 0) AS hits,
+              count(hits) AS records
+       FROM document_hits
+       WHERE hitid > watermark AND hitid <= new_watermark
+       GROUP BY documentid),
+      updated AS
+      (UPDATE document_hit_aggregates AS dha
+       SET hits = dha.hits + nh.hits,
+           records = dha.records + nh.records,
+           average = (dha.hits + nh.hits)::FLOAT
+                     / NULLIF(dha.records + nh.records, 0)
+       FROM new_hits AS nh
+       WHERE dha.documentid = nh.documentid
+       RETURNING dha.documentid)
+    INSERT INTO document_hit_aggregates
+      (documentid, uuid, hits, records, average)
+    SELECT nh.documentid, m.uuid, nh.hits, nh.records,
+           nh.hits::FLOAT / NULLIF(nh.records, 0)
+    FROM new_hits AS nh JOIN modules AS m ON (m.module_ident = nh.documentid)
+    WHERE nh.documentid NOT IN (SELECT documentid FROM updated);
+
+    UPDATE document_hit_aggregates_watermark SET last_hitid = new_watermark;
+    IF NOT FOUND THEN
+      INSERT INTO document_hit_aggregates_watermark (last_hitid)
+        VALUES (new_watermark);
+    END IF;
+    RETURN folded;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_average (ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      average := avg(hits) FROM document_hits
+        WHERE documentid = ident AND start_timestamp >= get_recency_date();
+    ELSE
+      average := dha.average FROM document_hit_aggregates AS dha
+        WHERE documentid = ident;
+    END IF;
+    RETURN average;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_rank(ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    document_rank FLOAT;
+    document_average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      WITH ranked_documents AS
+        (SELECT documentid, avg(hits) AS hits,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+         FROM document_hits
+         WHERE start_timestamp >= get_recency_date()
+         GROUP BY documentid ORDER BY hits DESC)
+      SELECT rank
+      FROM ranked_documents AS rkd
+      WHERE documentid = ident
+      INTO document_rank;
+    ELSE
+      SELECT dha.average INTO document_average
+        FROM document_hit_aggregates AS dha WHERE documentid = ident;
+      IF NOT FOUND THEN
+        RETURN NULL;
+      END IF;
+      -- Same as rank() OVER (ORDER BY average), where nulls sort last.
+      IF document_average IS NULL THEN
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average IS NOT NULL;
+      ELSE
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average < document_average;
+      END IF;
+    END IF;
+    RETURN document_rank;
+  END;
+$$
+LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_hit_ranks () RETURNS VOID
+AS $$
+  BEGIN
+    PERFORM update_hit_aggregates();
+
+    DELETE FROM recent_hit_ranks;
+    DELETE FROM overall_hit_ranks;
+
+    -- Inserts into the recent_hit_ranks table
+    INSERT INTO recent_hit_ranks
+    SELECT m.uuid AS document,
+           sum(hits) AS hits,
+           avg(hits) AS average,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+    FROM document_hits AS dh
+         JOIN modules AS m ON (m.module_ident = dh.documentid)
+    WHERE dh.start_timestamp >= get_recency_date()
+    GROUP BY m.uuid;
+
+    -- Inserts into the overall_hit_ranks table from the running totals.
+    INSERT INTO overall_hit_ranks
+    SELECT uuid AS document,
+           sum(hits) AS hits,
+           sum(hits)::FLOAT / NULLIF(sum(records), 0) AS average,
+           rank() OVER (ORDER BY sum(hits)::FLOAT / NULLIF(sum(records), 0))
+             AS rank
+    FROM document_hit_aggregates
+    GROUP BY uuid;
+
+  END;
+$$
+LANGUAGE plpgsql;
+""")
+    # Fold the existing hits into the running totals.
+    cursor.execute("SELECT update_hit_aggregates()")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP FUNCTION IF EXISTS update_hit_aggregates();
+DROP TABLE IF EXISTS document_hit_aggregates_watermark;
+DROP TABLE IF EXISTS document_hit_aggregates;
+ALTER TABLE document_hits DROP COLUMN IF EXISTS hitid;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION hit_average (ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      average := avg(hits) FROM document_hits
+        WHERE documentid = ident AND start_timestamp >= get_recency_date();
+    ELSE
+      average := avg(hits) FROM document_hits WHERE documentid = ident;
+    END IF;
+    RETURN average;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_rank(ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    document_rank FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      WITH ranked_documents AS
+        (SELECT documentid, avg(hits) AS hits,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+         FROM document_hits
+         WHERE start_timestamp >= get_recency_date()
+         GROUP BY documentid ORDER BY hits DESC)
+      SELECT rank
+      FROM ranked_documents AS rkd
+      WHERE documentid = ident
+      INTO document_rank;
+    ELSE
+      WITH ranked_documents AS
+        (SELECT documentid, avg(hits) AS hits,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+         FROM document_hits
+         GROUP BY documentid ORDER BY hits DESC)
+      SELECT rank
+      FROM ranked_documents AS rkd
+      WHERE documentid = ident
+      INTO document_rank;
+    END IF;
+    RETURN document_rank;
+  END;
+$$
+LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_hit_ranks () RETURNS VOID
+AS $$
+  BEGIN
+    DELETE FROM recent_hit_ranks;
+    DELETE FROM overall_hit_ranks;
+    -- Inserted new records are grouped by uuid.
+
+    -- Inserts into the recent_hit_ranks table
+    WITH
+      ident_mapping AS
+      (SELECT uuid, array_agg(module_ident) AS idents
+       FROM modules GROUP BY uuid),
+      stats AS
+      (SELECT im.uuid AS document,
+              sum(hits) AS hits,
+              avg(hits) AS average,
+              rank() OVER (ORDER BY avg(hits)) as rank
+       FROM ident_mapping AS im,
+            document_hits AS dh
+       WHERE dh.documentid = any(im.idents)
+             AND start_timestamp >= get_recency_date()
+       GROUP BY im.uuid)
+    INSERT INTO recent_hit_ranks select * from stats;
+
+    -- Inserts into the overall_hit_ranks table.
+    WITH
+      ident_mapping AS
+      (SELECT uuid, array_agg(module_ident) AS idents
+       FROM modules GROUP BY uuid),
+      stats AS
+      (SELECT im.uuid AS document,
+              sum(hits) AS hits,
+              avg(hits) AS average,
+              rank() OVER (ORDER BY avg(hits)) AS rank
+       FROM ident_mapping AS im,
+            document_hits AS dh
+       WHERE dh.documentid = any(im.idents)
+       GROUP BY im.uuid)
+    INSERT INTO overall_hit_ranks select * from stats;
+
+  END;
+$$
+LANGUAGE plpgsql;
+""")
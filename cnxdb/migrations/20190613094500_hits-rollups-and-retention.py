@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+ALTER TABLE document_hit_aggregates_watermark
+  ADD COLUMN last_end_timestamp TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE document_hit_daily_rollups (
+  documentid INTEGER NOT NULL,
+  day DATE NOT NULL,
+  hits BIGINT NOT NULL DEFAULT 0,
+  records BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (documentid, day),
+  FOREIGN KEY (documentid) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+CREATE INDEX document_hits_start_timestamp_idx ON document_hits (start_timestamp);
+CREATE INDEX document_hit_daily_rollups_day_idx ON document_hit_daily_rollups (day);
+""")
+    # Roll up the hits that have already been folded into the aggregates,
+    # the rest are rolled up by the next update_hit_aggregates().
+    cursor.execute("""\
+INSERT INTO document_hit_daily_rollups (documentid, day, hits, records)
+SELECT documentid,
+       date_trunc('day', start_timestamp AT TIME ZONE 'UTC')::DATE,
+       COALESCE(sum(hits), 0), count(hits)
+FROM document_hits
+WHERE hitid <= (SELECT COALESCE(max(last_hitid), 0)
+                FROM document_hit_aggregates_watermark)
+GROUP BY 1, 2;
+
+UPDATE document_hit_aggregates_watermark
+SET last_end_timestamp = (SELECT max(end_timestamp) FROM document_hits
+                          WHERE hitid <= last_hitid);
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION get_recency_date () RETURNS TIMESTAMP
+AS $$
+  -- The cached end timestamp of the folded hits stands in for a
+  -- MAX(end_timestamp) scan; only the rows above the watermark are read.
+  DECLARE
+    now_timestamp TIMESTAMP WITH TIME ZONE;
+    past_timestamp TIMESTAMP WITH TIME ZONE;
+  BEGIN
+    now_timestamp := GREATEST(
+      (SELECT max(last_end_timestamp)
+       FROM document_hit_aggregates_watermark),
+      (SELECT max(end_timestamp) FROM document_hits
+       WHERE hitid > (SELECT COALESCE(max(last_hitid), 0)
+                      FROM document_hit_aggregates_watermark)));
+    now_timestamp := COALESCE(now_timestamp, NOW());
+    past_timestamp := now_timestamp - interval '1 week';
+    RETURN past_timestamp;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION get_recent_rollups_day () RETURNS DATE
+AS $$
+  -- The first day of the recent hits in document_hit_daily_rollups.
+  -- Unlike get_recency_date, only the folded hits are considered, so the
+  -- window matches the rollups even when newer hits are not folded yet.
+  SELECT ((COALESCE(max(last_end_timestamp), NOW()) - interval '1 week')
+          AT TIME ZONE 'UTC')::DATE
+  FROM document_hit_aggregates_watermark;
+$$
+LANGUAGE sql STABLE;
+
+
+CREATE OR REPLACE FUNCTION update_hit_aggregates () RETURNS BIGINT
+AS $$
+  -- Fold the document_hits rows added since the watermark into the
+  -- document_hit_aggregates running totals and the daily rollups.
+  -- Returns the number of document_hits rows folded in.
+  DECLARE
+    watermark BIGINT;
+    new_watermark BIGINT;
+    new_end_timestamp TIMESTAMP WITH TIME ZONE;
+    folded BIGINT;
+  BEGIN
+    -- The share lock waits for in-flight inserts to commit, so no row
+    -- below the new watermark can show up after it has been moved.
+    LOCK TABLE document_hits IN SHARE MODE;
+    LOCK TABLE document_hit_aggregates IN SHARE ROW EXCLUSIVE MODE;
+    watermark := COALESCE(max(last_hitid), 0)
+      FROM document_hit_aggregates_watermark;
+    SELECT max(hitid), max(end_timestamp), count(*)
+      INTO new_watermark, new_end_timestamp, folded
+      FROM document_hits WHERE hitid > watermark;
+    IF folded = 0 THEN
+      RETURN 0;
+    END IF;
+
+    WITH
+      new_hits AS
+      (SELECT documentid,
+              COALESCE(sum(hits), 0) AS hits,
+              count(hits) AS records
+       FROM document_hits
+       WHERE hitid > watermark AND hitid <= new_watermark
+       GROUP BY documentid),
+      updated AS
+      (UPDATE document_hit_aggregates AS dha
+       SET hits = dha.hits + nh.hits,
+           records = dha.records + nh.records,
+           average = (dha.hits + nh.hits)::FLOAT
+                     / NULLIF(dha.records + nh.records, 0)
+       FROM new_hits AS nh
+       WHERE dha.documentid = nh.documentid
+       RETURNING dha.documentid)
+    INSERT INTO document_hit_aggregates
+      (documentid, uuid, hits, records, average)
+    SELECT nh.documentid, m.uuid, nh.hits, nh.records,
+           nh.hits::FLOAT / NULLIF(nh.records, 0)
+    FROM new_hits AS nh JOIN modules AS m ON (m.module_ident = nh.documentid)
+    WHERE nh.documentid NOT IN (SELECT documentid FROM updated);
+
+    WITH
+      new_hits AS
+      (SELECT documentid,
+              date_trunc('day', start_timestamp AT TIME ZONE 'UTC')::DATE
+                AS day,
+              COALESCE(sum(hits), 0) AS hits,
+              count(hits) AS records
+       FROM document_hits
+       WHERE hitid > watermark AND hitid <= new_watermark
+       GROUP BY 1, 2),
+      updated AS
+      (UPDATE document_hit_daily_rollups AS r
+       SET hits = r.hits + nh.hits,
+           records = r.records + nh.records
+       FROM new_hits AS nh
+       WHERE r.documentid = nh.documentid AND r.day = nh.day
+       RETURNING r.documentid, r.day)
+    INSERT INTO document_hit_daily_rollups (documentid, day, hits, records)
+    SELECT nh.documentid, nh.day, nh.hits, nh.records
+    FROM new_hits AS nh
+    WHERE NOT EXISTS (SELECT 1 FROM updated AS u
+                      WHERE u.documentid = nh.documentid
+                            AND u.day = nh.day);
+
+    UPDATE document_hit_aggregates_watermark
+      SET last_hitid = new_watermark,
+          last_end_timestamp = GREATEST(last_end_timestamp, new_end_timestamp);
+    IF NOT FOUND THEN
+      INSERT INTO document_hit_aggregates_watermark
+        (last_hitid, last_end_timestamp)
+        VALUES (new_watermark, new_end_timestamp);
+    END IF;
+    RETURN folded;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION prune_document_hits (older_than INTERVAL)
+RETURNS BIGINT
+AS $$
+  -- Retention job for document_hits. The hits are first folded into the
+  -- aggregates and rollups, then the raw rows and daily rollups older than
+  -- the given interval are deleted. The running totals are kept.
+  -- Returns the number of document_hits rows deleted.
+  DECLARE
+    cutoff TIMESTAMP WITH TIME ZONE;
+    pruned BIGINT;
+  BEGIN
+    PERFORM update_hit_aggregates();
+    cutoff := date_trunc('day', NOW() - older_than);
+    DELETE FROM document_hits
+      WHERE start_timestamp < cutoff
+            AND hitid <= (SELECT max(last_hitid)
+                          FROM document_hit_aggregates_watermark);
+    GET DIAGNOSTICS pruned = ROW_COUNT;
+    DELETE FROM document_hit_daily_rollups
+      WHERE day < (cutoff AT TIME ZONE 'UTC')::DATE;
+    RETURN pruned;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_average (ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      -- Recent hits are counted by the day from the daily rollups.
+      average := sum(hits)::FLOAT / NULLIF(sum(records), 0)
+        FROM document_hit_daily_rollups
+        WHERE documentid = ident
+              AND day >= get_recent_rollups_day();
+    ELSE
+      average := dha.average FROM document_hit_aggregates AS dha
+        WHERE documentid = ident;
+    END IF;
+    RETURN average;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_rank(ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    document_rank FLOAT;
+    document_average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      WITH ranked_documents AS
+        (SELECT documentid,
+           rank() OVER (ORDER BY sum(hits)::FLOAT / NULLIF(sum(records), 0))
+             AS rank
+         FROM document_hit_daily_rollups
+         WHERE day >= get_recent_rollups_day()
+         GROUP BY documentid)
+      SELECT rank
+      FROM ranked_documents AS rkd
+      WHERE documentid = ident
+      INTO document_rank;
+    ELSE
+      SELECT dha.average INTO document_average
+        FROM document_hit_aggregates AS dha WHERE documentid = ident;
+      IF NOT FOUND THEN
+        RETURN NULL;
+      END IF;
+      -- Same as rank() OVER (ORDER BY average), where nulls sort last.
+      IF document_average IS NULL THEN
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average IS NOT NULL;
+      ELSE
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average < document_average;
+      END IF;
+    END IF;
+    RETURN document_rank;
+  END;
+$$
+LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_hit_ranks () RETURNS VOID
+AS $$
+  BEGIN
+    PERFORM update_hit_aggregates();
+
+    DELETE FROM recent_hit_ranks;
+    DELETE FROM overall_hit_ranks;
+
+    -- Inserts into the recent_hit_ranks table from the daily rollups.
+    INSERT INTO recent_hit_ranks
+    SELECT m.uuid AS document,
+           sum(hits) AS hits,
+           sum(hits)::FLOAT / NULLIF(sum(records), 0) AS average,
+           rank() OVER (ORDER BY sum(hits)::FLOAT / NULLIF(sum(records), 0))
+             AS rank
+    FROM document_hit_daily_rollups AS r
+         JOIN modules AS m ON (m.module_ident = r.documentid)
+    WHERE r.day >= get_recent_rollups_day()
+    GROUP BY m.uuid;
+
+    -- Inserts into the overall_hit_ranks table from the running totals.
+    INSERT INTO overall_hit_ranks
+    SELECT uuid AS document,
+           sum(hits) AS hits,
+           sum(hits)::FLOAT / NULLIF(sum(records), 0) AS average,
+           rank() OVER (ORDER BY sum(hits)::FLOAT / NULLIF(sum(records), 0))
+             AS rank
+    FROM document_hit_aggregates
+    GROUP BY uuid;
+
+  END;
+$$
+LANGUAGE plpgsql;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP FUNCTION IF EXISTS prune_document_hits(INTERVAL);
+DROP FUNCTION IF EXISTS get_recent_rollups_day();
+DROP TABLE IF EXISTS document_hit_daily_rollups;
+DROP INDEX IF EXISTS document_hits_start_timestamp_idx;
+ALTER TABLE document_hit_aggregates_watermark
+  DROP COLUMN IF EXISTS last_end_timestamp;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION get_recency_date () RETURNS TIMESTAMP
+AS $$
+  DECLARE
+    now_timestamp TIMESTAMP WITH TIME ZONE;
+    past_timestamp TIMESTAMP WITH TIME ZONE;
+  BEGIN
+    now_timestamp := COALESCE(MAX(end_timestamp), NOW()) FROM document_hits;
+    past_timestamp := now_timestamp - interval '1 week';
+    RETURN past_timestamp;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION update_hit_aggregates () RETURNS BIGINT
+AS $$
+  -- Fold the document_hits rows added since the watermark into the
+  -- document_hit_aggregates running totals.
+  -- Returns the number of document_hits rows folded in.
+  DECLARE
+    watermark BIGINT;
+    new_watermark BIGINT;
+    folded BIGINT;
+  BEGIN
+    -- The share lock waits for in-flight inserts to commit, so no row
+    -- below the new watermark can show up after it has been moved.
+    LOCK TABLE document_hits IN SHARE MODE;
+    LOCK TABLE document_hit_aggregates IN SHARE ROW EXCLUSIVE MODE;
+    watermark := COALESCE(max(last_hitid), 0)
+      FROM document_hit_aggregates_watermark;
+    SELECT max(hitid), count(*) INTO new_watermark, folded
+      FROM document_hits WHERE hitid > watermark;
+    IF folded = 0 THEN
+      RETURN 0;
+    END IF;
+
+    WITH
+      new_hits AS
+      (SELECT documentid,
+              COALESCE(sum(hits), 0) AS hits,
+              count(hits) AS records
+       FROM document_hits
+       WHERE hitid > watermark AND hitid <= new_watermark
+       GROUP BY documentid),
+      updated AS
+      (UPDATE document_hit_aggregates AS dha
+       SET hits = dha.hits + nh.hits,
+           records = dha.records + nh.records,
+           average = (dha.hits + nh.hits)::FLOAT
+                     / NULLIF(dha.records + nh.records, 0)
+       FROM new_hits AS nh
+       WHERE dha.documentid = nh.documentid
+       RETURNING dha.documentid)
+    INSERT INTO document_hit_aggregates
+      (documentid, uuid, hits, records, average)
+    SELECT nh.documentid, m.uuid, nh.hits, nh.records,
+           nh.hits::FLOAT / NULLIF(nh.records, 0)
+    FROM new_hits AS nh JOIN modules AS m ON (m.module_ident = nh.documentid)
+    WHERE nh.documentid NOT IN (SELECT documentid FROM updated);
+
+    UPDATE document_hit_aggregates_watermark SET last_hitid = new_watermark;
+    IF NOT FOUND THEN
+      INSERT INTO document_hit_aggregates_watermark (last_hitid)
+        VALUES (new_watermark);
+    END IF;
+    RETURN folded;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_average (ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      average := avg(hits) FROM document_hits
+        WHERE documentid = ident AND start_timestamp >= get_recency_date();
+    ELSE
+      average := dha.average FROM document_hit_aggregates AS dha
+        WHERE documentid = ident;
+    END IF;
+    RETURN average;
+  END;
+$$
+LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION hit_rank(ident INTEGER, recent BOOLEAN)
+RETURNS FLOAT
+AS $$
+  DECLARE
+    document_rank FLOAT;
+    document_average FLOAT;
+  BEGIN
+    recent := coalesce(recent, 'f')::BOOLEAN;
+    IF recent THEN
+      WITH ranked_documents AS
+        (SELECT documentid, avg(hits) AS hits,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+         FROM document_hits
+         WHERE start_timestamp >= get_recency_date()
+         GROUP BY documentid ORDER BY hits DESC)
+      SELECT rank
+      FROM ranked_documents AS rkd
+      WHERE documentid = ident
+      INTO document_rank;
+    ELSE
+      SELECT dha.average INTO document_average
+        FROM document_hit_aggregates AS dha WHERE documentid = ident;
+      IF NOT FOUND THEN
+        RETURN NULL;
+      END IF;
+      -- Same as rank() OVER (ORDER BY average), where nulls sort last.
+      IF document_average IS NULL THEN
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average IS NOT NULL;
+      ELSE
+        document_rank := 1 + count(*) FROM document_hit_aggregates AS dha
+          WHERE dha.average < document_average;
+      END IF;
+    END IF;
+    RETURN document_rank;
+  END;
+$$
+LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_hit_ranks () RETURNS VOID
+AS $$
+  BEGIN
+    PERFORM update_hit_aggregates();
+
+    DELETE FROM recent_hit_ranks;
+    DELETE FROM overall_hit_ranks;
+
+    -- Inserts into the recent_hit_ranks table
+    INSERT INTO recent_hit_ranks
+    SELECT m.uuid AS document,
+           sum(hits) AS hits,
+           avg(hits) AS average,
+           rank() OVER (ORDER BY avg(hits)) AS rank
+    FROM document_hits AS dh
+         JOIN modules AS m ON (m.module_ident = dh.documentid)
+    WHERE dh.start_timestamp >= get_recency_date()
+    GROUP BY m.uuid;
+
+    -- Inserts into the overall_hit_ranks table from the running totals.
+    INSERT INTO overall_hit_ranks
+    SELECT uuid AS document,
+           sum(hits) AS hits,
+           sum(hits)::FLOAT / NULLIF(sum(records), 0) AS average,
+           rank() OVER (ORDER BY sum(hits)::FLOAT / NULLIF(sum(records), 0))
+             AS rank
+    FROM document_hit_aggregates
+    GROUP BY uuid;
+
+  END;
+$$
+LANGUAGE plpgsql;
+""")
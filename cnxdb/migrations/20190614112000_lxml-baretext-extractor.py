@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from dbmigrator import super_user
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+-- An lxml based equivalent of xml_to_baretext. It works on the raw file
+-- content, which saves the parse done by the cast to xml, and strips the
+-- nodes in C rather than through an XSLT transform.
+CREATE OR REPLACE FUNCTION xml_to_baretext_lxml(content bytea)
+  RETURNS text
+  LANGUAGE plpythonu
+  STRICT
+AS $$
+  from lxml import etree
+
+  if 'parser' not in SD:
+      SD['parser'] = etree.XMLParser(resolve_entities=False, huge_tree=True)
+  root = etree.fromstring(content, SD['parser'])
+  etree.strip_elements(root,
+                       '{http://cnx.rice.edu/mdml}*',
+                       '{http://cnx.rice.edu/mdml/0.4}*',
+                       '{http://www.w3.org/1999/xhtml}cnx-pi',
+                       with_tail=False)
+  return etree.tostring(root, method='text', encoding='unicode')
+$$;
+
+-- Extracts the text used for fulltext indexing from a file.
+-- The extractor is selected by the ``cnxdb.baretext_extractor`` setting,
+-- either 'xslt' (the default) or 'lxml'. For example,
+-- ``ALTER DATABASE ... SET cnxdb.baretext_extractor = 'lxml'``.
+CREATE OR REPLACE FUNCTION fulltext_baretext(content bytea)
+  RETURNS text
+  LANGUAGE plpgsql
+AS $$
+  DECLARE
+    extractor text;
+  BEGIN
+    BEGIN
+      extractor := current_setting('cnxdb.baretext_extractor');
+    EXCEPTION WHEN undefined_object THEN
+      extractor := 'xslt';
+    END;
+    IF extractor = 'lxml' THEN
+      RETURN xml_to_baretext_lxml(content);
+    END IF;
+    RETURN xml_to_baretext(convert_from(content, 'UTF8')::xml)::text;
+  END;
+$$;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION index_fulltext_trigger()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_record integer;
+    _baretext text;
+    _keyword text;
+    _title text;
+    _abstract text;
+    _idx_text_vectors tsvector;
+    _idx_title_vectors tsvector;
+    _idx_keyword_vectors tsvector;
+    _idx_abstract_vectors tsvector;
+
+  BEGIN
+    has_existing_record := (SELECT module_ident FROM modulefti WHERE module_ident = NEW.module_ident);
+    _baretext := (SELECT fulltext_baretext(f.file)
+                    FROM files AS f WHERE f.fileid = NEW.fileid);
+    _keyword := (SELECT LIST(k.word) FROM keywords k INNER JOIN modulekeywords m
+                   ON k.keywordid = m.keywordid
+                    WHERE m.module_ident = NEW.module_ident);
+    _title := (SELECT modules.name FROM modules WHERE module_ident = NEW.module_ident);
+    _abstract := (SELECT ab.abstract FROM abstracts ab INNER JOIN modules m
+                   ON ab.abstractid = m.abstractid
+                    WHERE m.module_ident = NEW.module_ident);
+    _idx_title_vectors := setweight(to_tsvector(COALESCE(_title, '')), 'A');
+    _idx_keyword_vectors := setweight(to_tsvector(COALESCE(_keyword, '')), 'B');
+    _idx_abstract_vectors := setweight(to_tsvector(COALESCE(_abstract, '')), 'B');
+    _idx_text_vectors := setweight(to_tsvector(COALESCE(_baretext, '')), 'C');
+
+
+    IF has_existing_record IS NULL THEN
+      INSERT INTO modulefti (module_ident, fulltext, module_idx)
+        VALUES ( NEW.module_ident, _baretext, _idx_title_vectors || _idx_keyword_vectors
+                 || _idx_abstract_vectors || _idx_text_vectors);
+
+    ELSE
+      UPDATE modulefti
+        SET (fulltext, module_idx) = (_baretext, _idx_title_vectors || _idx_keyword_vectors
+             || _idx_abstract_vectors || _idx_text_vectors)
+          WHERE module_ident = NEW.module_ident;
+    END IF;
+    RETURN NEW;
+  END;
+  $$
+  LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION index_collated_fulltext_trigger()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_record integer;
+    _baretext text;
+    _idx_vectors tsvector;
+  BEGIN
+    has_existing_record := (SELECT item FROM collated_fti WHERE item = NEW.item and context = NEW.context);
+    _baretext := (SELECT fulltext_baretext(f.file) FROM files AS f WHERE f.fileid = NEW.fileid);
+    _idx_vectors := to_tsvector(_baretext);
+
+    IF has_existing_record IS NULL THEN
+      INSERT INTO collated_fti (item, context, fulltext, module_idx)
+        VALUES ( NEW.item, NEW.context,_baretext, _idx_vectors );
+    ELSE
+      UPDATE collated_fti SET (fulltext, module_idx) = ( _baretext, _idx_vectors )
+        WHERE item = NEW.item and context = NEW.context;
+    END IF;
+    RETURN NEW;
+  END;
+  $$
+  LANGUAGE plpgsql;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION index_fulltext_trigger()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_record integer;
+    _baretext text;
+    _keyword text;
+    _title text;
+    _abstract text;
+    _idx_text_vectors tsvector;
+    _idx_title_vectors tsvector;
+    _idx_keyword_vectors tsvector;
+    _idx_abstract_vectors tsvector;
+
+  BEGIN
+    has_existing_record := (SELECT module_ident FROM modulefti WHERE module_ident = NEW.module_ident);
+    _baretext := (SELECT xml_to_baretext(convert_from(f.file, 'UTF8')::xml)::text
+                    FROM files AS f WHERE f.fileid = NEW.fileid);
+    _keyword := (SELECT LIST(k.word) FROM keywords k INNER JOIN modulekeywords m
+                   ON k.keywordid = m.keywordid
+                    WHERE m.module_ident = NEW.module_ident);
+    _title := (SELECT modules.name FROM modules WHERE module_ident = NEW.module_ident);
+    _abstract := (SELECT ab.abstract FROM abstracts ab INNER JOIN modules m
+                   ON ab.abstractid = m.abstractid
+                    WHERE m.module_ident = NEW.module_ident);
+    _idx_title_vectors := setweight(to_tsvector(COALESCE(_title, '')), 'A');
+    _idx_keyword_vectors := setweight(to_tsvector(COALESCE(_keyword, '')), 'B');
+    _idx_abstract_vectors := setweight(to_tsvector(COALESCE(_abstract, '')), 'B');
+    _idx_text_vectors := setweight(to_tsvector(COALESCE(_baretext, '')), 'C');
+
+
+    IF has_existing_record IS NULL THEN
+      INSERT INTO modulefti (module_ident, fulltext, module_idx)
+        VALUES ( NEW.module_ident, _baretext, _idx_title_vectors || _idx_keyword_vectors
+                 || _idx_abstract_vectors || _idx_text_vectors);
+
+    ELSE
+      UPDATE modulefti
+        SET (fulltext, module_idx) = (_baretext, _idx_title_vectors || _idx_keyword_vectors
+             || _idx_abstract_vectors || _idx_text_vectors)
+          WHERE module_ident = NEW.module_ident;
+    END IF;
+    RETURN NEW;
+  END;
+  $$
+  LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION index_collated_fulltext_trigger()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_record integer;
+    _baretext text;
+    _idx_vectors tsvector;
+  BEGIN
+    has_existing_record := (SELECT item FROM collated_fti WHERE item = NEW.item and context = NEW.context);
+    _baretext := (SELECT xml_to_baretext(convert_from(f.file, 'UTF8')::xml)::text FROM files AS f WHERE f.fileid = NEW.fileid);
+    _idx_vectors := to_tsvector(_baretext);
+
+    IF has_existing_record IS NULL THEN
+      INSERT INTO collated_fti (item, context, fulltext, module_idx)
+        VALUES ( NEW.item, NEW.context,_baretext, _idx_vectors );
+    ELSE
+      UPDATE collated_fti SET (fulltext, module_idx) = ( _baretext, _idx_vectors )
+        WHERE item = NEW.item and context = NEW.context;
+    END IF;
+    RETURN NEW;
+  END;
+  $$
+  LANGUAGE plpgsql;
+""")
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+DROP FUNCTION IF EXISTS fulltext_baretext(bytea);
+DROP FUNCTION IF EXISTS xml_to_baretext_lxml(bytea);
+""")
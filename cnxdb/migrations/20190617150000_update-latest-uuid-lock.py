@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_latest() RETURNS trigger AS $$
+BEGIN
+-- lastest content is the highest version that has successfully baked - states 1 and 8 (current and fallback)
+-- represent some sort of success (fallback used an old recipe due to errors)
+  IF NEW.stateid in (1, 8) THEN -- current and fallback
+    -- Only publishers of the same uuid need to wait on each other,
+    -- so lock the uuid rather than the whole latest_modules table.
+    PERFORM pg_advisory_xact_lock(hashtext('latest_modules'), hashtext(NEW.uuid::text));
+    IF ARRAY [NEW.major_version, NEW.minor_version] >= (SELECT ARRAY [major_version, minor_version]
+          FROM latest_modules WHERE uuid = NEW.uuid UNION ALL SELECT ARRAY[0, NULL] LIMIT 1) THEN
+      DELETE FROM latest_modules WHERE moduleid = NEW.moduleid AND uuid != NEW.uuid;
+      UPDATE latest_modules SET
+          uuid=NEW.uuid,
+          module_ident=NEW.module_ident,
+          moduleid=NEW.moduleid,
+          portal_type=NEW.portal_type,
+          version=NEW.version,
+          name=NEW.name,
+          created=NEW.created,
+          revised=NEW.revised,
+          abstractid=NEW.abstractid,
+          stateid=NEW.stateid,
+          doctype=NEW.doctype,
+          licenseid=NEW.licenseid,
+          submitter=NEW.submitter,
+          submitlog=NEW.submitlog,
+          parent=NEW.parent,
+          language=NEW.language,
+          authors=NEW.authors,
+          maintainers=NEW.maintainers,
+          licensors=NEW.licensors,
+          parentauthors=NEW.parentauthors,
+          google_analytics=NEW.google_analytics,
+          buylink=NEW.buylink,
+          major_version=NEW.major_version,
+          minor_version=NEW.minor_version,
+          print_style=NEW.print_style,
+          baked=NEW.baked,
+          recipe=NEW.recipe,
+          canonical=NEW.canonical
+        WHERE uuid = NEW.uuid;
+      IF NOT FOUND THEN
+        INSERT into latest_modules (
+                  uuid, module_ident, portal_type, moduleid, version, name,
+                  created, revised, abstractid, stateid, doctype, licenseid,
+                  submitter,submitlog, parent, language,
+                  authors, maintainers, licensors, parentauthors, google_analytics, buylink,
+                  major_version, minor_version, print_style, baked, recipe, canonical)
+          VALUES (
+           NEW.uuid, NEW.module_ident, NEW.portal_type, NEW.moduleid, NEW.version, NEW.name,
+           NEW.created, NEW.revised, NEW.abstractid, NEW.stateid, NEW.doctype, NEW.licenseid,
+           NEW.submitter, NEW.submitlog, NEW.parent, NEW.language,
+           NEW.authors, NEW.maintainers, NEW.licensors, NEW.parentauthors, NEW.google_analytics, NEW.buylink,
+           NEW.major_version, NEW.minor_version, NEW.print_style, NEW.baked, NEW.recipe, NEW.canonical);
+      END IF;
+    ELSIF TG_OP = 'UPDATE' THEN
+      UPDATE latest_modules SET
+          uuid=NEW.uuid,
+          module_ident=NEW.module_ident,
+          moduleid=NEW.moduleid,
+          portal_type=NEW.portal_type,
+          version=NEW.version,
+          name=NEW.name,
+          created=NEW.created,
+          revised=NEW.revised,
+          abstractid=NEW.abstractid,
+          stateid=NEW.stateid,
+          doctype=NEW.doctype,
+          licenseid=NEW.licenseid,
+          submitter=NEW.submitter,
+          submitlog=NEW.submitlog,
+          parent=NEW.parent,
+          language=NEW.language,
+          authors=NEW.authors,
+          maintainers=NEW.maintainers,
+          licensors=NEW.licensors,
+          parentauthors=NEW.parentauthors,
+          google_analytics=NEW.google_analytics,
+          buylink=NEW.buylink,
+          major_version=NEW.major_version,
+          minor_version=NEW.minor_version,
+          print_style=NEW.print_style,
+          baked=NEW.baked,
+          recipe=NEW.recipe,
+          canonical=NEW.canonical
+        WHERE module_ident = NEW.module_ident;
+    END IF;
+  END IF;
+
+RETURN NEW;
+END;
+
+$$ LANGUAGE 'plpgsql';
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_latest() RETURNS trigger AS '
+BEGIN
+-- lastest content is the highest version that has successfully baked - states 1 and 8 (current and fallback)
+-- represent some sort of success (fallback used an old recipe due to errors)
+  IF (TG_OP = ''INSERT'' OR TG_OP = ''UPDATE'') AND
+          ARRAY [NEW.major_version, NEW.minor_version] >= (SELECT ARRAY [major_version, minor_version]
+            FROM latest_modules WHERE uuid = NEW.uuid UNION ALL SELECT ARRAY[0, NULL] LIMIT 1) AND
+          NEW.stateid in (1, 8) THEN -- current and fallback
+      LOCK TABLE latest_modules IN SHARE ROW EXCLUSIVE MODE;
+      DELETE FROM latest_modules WHERE moduleid = NEW.moduleid OR uuid = NEW.uuid;
+      INSERT into latest_modules (
+                uuid, module_ident, portal_type, moduleid, version, name,
+  		created, revised, abstractid, stateid, doctype, licenseid,
+  		submitter,submitlog, parent, language,
+		authors, maintainers, licensors, parentauthors, google_analytics,
+                major_version, minor_version, print_style, baked, recipe, canonical)
+  	VALUES (
+         NEW.uuid, NEW.module_ident, NEW.portal_type, NEW.moduleid, NEW.version, NEW.name,
+  	 NEW.created, NEW.revised, NEW.abstractid, NEW.stateid, NEW.doctype, NEW.licenseid,
+  	 NEW.submitter, NEW.submitlog, NEW.parent, NEW.language,
+	 NEW.authors, NEW.maintainers, NEW.licensors, NEW.parentauthors, NEW.google_analytics,
+         NEW.major_version, NEW.minor_version, NEW.print_style, NEW.baked, NEW.recipe, NEW.canonical);
+  END IF;
+
+  IF TG_OP = ''UPDATE'' AND NEW.stateid in (1, 8) THEN -- current or fallback
+      UPDATE latest_modules SET
+        uuid=NEW.uuid,
+        moduleid=NEW.moduleid,
+        portal_type=NEW.portal_type,
+        version=NEW.version,
+        name=NEW.name,
+        created=NEW.created,
+        revised=NEW.revised,
+        abstractid=NEW.abstractid,
+        stateid=NEW.stateid,
+        doctype=NEW.doctype,
+        licenseid=NEW.licenseid,
+	submitter=NEW.submitter,
+	submitlog=NEW.submitlog,
+        parent=NEW.parent,
+	language=NEW.language,
+	authors=NEW.authors,
+	maintainers=NEW.maintainers,
+	licensors=NEW.licensors,
+	parentauthors=NEW.parentauthors,
+	google_analytics=NEW.google_analytics,
+        major_version=NEW.major_version,
+        minor_version=NEW.minor_version,
+        print_style=NEW.print_style,
+        baked=NEW.baked,
+        recipe=NEW.recipe,
+        canonical=NEW.canonical
+        WHERE module_ident=NEW.module_ident;
+  END IF;
+
+RETURN NEW;
+END;
+
+' LANGUAGE 'plpgsql';
+""")
@@ -0,0 +1,551 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute(r"""
+-- The following parse an ident_hash or version once, so that lookups can
+-- compare the native uuid, major_version and minor_version columns
+-- (see the modules_uuid_version_idx index) rather than text expressions.
+-- For example, ``m.uuid = ident_hash_uuid(%(ident_hash)s) AND
+-- module_version_is(m.major_version, m.minor_version,
+-- ident_hash_version(%(ident_hash)s))``.
+
+CREATE OR REPLACE FUNCTION to_uuid(value text)
+ RETURNS uuid
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~* '^[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}$'
+                   OR $1 ~* '^\{[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}\}$'
+              THEN $1::uuid END
+$function$;
+
+CREATE OR REPLACE FUNCTION ident_hash_uuid(ident_hash text)
+ RETURNS uuid
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$ select public.to_uuid(split_part($1, '@', 1)) $function$;
+
+CREATE OR REPLACE FUNCTION ident_hash_version(ident_hash text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$ select split_part($1, '@', 2) $function$;
+
+CREATE OR REPLACE FUNCTION version_major(version text)
+ RETURNS integer
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~ '^(0|[1-9]\d*)(\.(0|[1-9]\d*))?$'
+              THEN split_part($1, '.', 1)::integer END
+$function$;
+
+CREATE OR REPLACE FUNCTION version_minor(version text)
+ RETURNS integer
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select CASE WHEN $1 ~ '^(0|[1-9]\d*)\.(0|[1-9]\d*)$'
+              THEN split_part($1, '.', 2)::integer END
+$function$;
+
+-- Equivalent to ``module_version(major, minor) = version``. It is inlined
+-- by the planner, so the comparisons can use an index.
+CREATE OR REPLACE FUNCTION module_version_is(major integer, minor integer, version text)
+ RETURNS boolean
+ LANGUAGE sql
+ IMMUTABLE
+AS $function$
+  select major = public.version_major(version)
+         AND (minor = public.version_minor(version)
+              OR (minor IS NULL AND version !~ '\.'))
+$function$;
+""")
+    cursor.execute(r"""
+CREATE OR REPLACE FUNCTION tree_to_json(uuid TEXT, version TEXT, as_collated BOOLEAN DEFAULT TRUE) RETURNS TEXT as $$
+select string_agg(toc,'
+'
+) from (
+WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated, slug) AS (
+    SELECT nodeid,
+           title,
+           ARRAY[nodeid],
+           documentid,
+           1,
+           ARRAY[childorder],
+           is_collated,
+           slug
+    FROM trees tr, modules m
+    WHERE m.uuid = to_uuid($1) AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = $3
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated, c1.slug /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+SELECT
+    REPEAT('    ', depth - 1) || 
+    '{"id":"' || COALESCE(m.uuid::text,'subcol') || concat_ws('.','@'||m.major_version, m.minor_version) ||'",' ||
+    '"shortId":"' || COALESCE(short_id(m.uuid),'subcol') || concat_ws('.','@'||m.major_version, m.minor_version) ||'",' ||
+    '"slug":' ||
+        CASE WHEN (slug IS NULL) THEN 'null,'
+        ELSE '"'|| slug ||'",' END
+    ||
+    '"title":'||to_json(COALESCE(title,name))||
+      CASE WHEN (depth < lead(depth,1,0) over(w)) THEN ', "contents":['
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) = 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) over(w) - 1)
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) = 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) over(w) - 1)
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) != 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) over(w))||','
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) != 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) over(w))||','
+           WHEN m.uuid IS NULL THEN ', "contents":[]},'
+           ELSE '},' END
+      AS "toc"
+FROM t left join  modules m on t.value = m.module_ident
+    WINDOW w as (ORDER BY corder) order by corder ) tree ;
+$$ LANGUAGE SQL;
+
+
+
+
+
+CREATE OR REPLACE FUNCTION tree_to_json_for_legacy(TEXT, TEXT) RETURNS TEXT AS $$
+SELECT string_agg(toc,'
+'
+) FROM (
+WITH RECURSIVE t(node, title, path,value, depth, corder) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, 1, ARRAY[childorder]
+    FROM trees tr, modules m
+    WHERE m.uuid = to_uuid($1) AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = FALSE
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder] /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE NOT nodeid = ANY (t.path) AND c1.is_collated = FALSE
+)
+SELECT
+    REPEAT('    ', depth - 1) || '{"id":"' || COALESCE(m.moduleid,'subcol') ||  '",' ||
+      '"version":' || COALESCE('"'||m.version||'"', 'null') || ',' ||
+      '"title":'||to_json(COALESCE(title,name))||
+      CASE WHEN (depth < lead(depth,1,0) OVER(w)) THEN ', "contents":['
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) = 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w) - 1)
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) = 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w) - 1)
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) != 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w))||','
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) != 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w))||','
+           WHEN m.uuid IS NULL THEN ', "contents":[]},'
+           ELSE '},' END
+      AS "toc"
+FROM t LEFT JOIN modules m ON t.value = m.module_ident
+    WINDOW w AS (ORDER BY corder) ORDER BY corder ) tree ;
+$$ LANGUAGE SQL;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION public.subcol_uuids(uuid uuid, version text) RETURNS VOID
+ LANGUAGE sql
+AS $function$
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+INSERT INTO document_controls (uuid)
+
+SELECT
+    uuid5(m.uuid::uuid, t.title)
+    FROM t JOIN modules m on m.module_ident = t.parent WHERE t.documentid IS NULL and not exists (select 1 from document_controls where
+        uuid = uuid5(m.uuid::uuid, t.title));
+
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+INSERT INTO modules (
+    doctype,
+    portal_type,
+    moduleid,
+    uuid,
+    version,
+    name,
+    created,
+    revised,
+    licenseid,
+    submitter,
+    submitlog,
+    stateid,
+    parent,
+    language,
+    authors,
+    maintainers,
+    licensors,
+    parentauthors,
+    google_analytics,
+    buylink,
+    major_version,
+    minor_version,
+    print_style)
+
+SELECT
+    t.node,
+    'SubCollection',
+    'col' || nextval('collectionid_seq'),
+    uuid5(m.uuid::uuid, t.title),
+    m.version,
+    t.title,
+    m.created,
+    m.revised,
+    m.licenseid,
+    m.submitter,
+    m.submitlog,
+    m.stateid,
+    m.parent,
+    m.language,
+    m.authors,
+    m.maintainers,
+    m.licensors,
+    m.parentauthors,
+    m.google_analytics,
+    m.buylink,
+    m.major_version,
+    m.minor_version,
+    m.print_style
+
+FROM t join modules m on m.module_ident = t.parent WHERE t.documentid IS NULL
+    and not exists (select 1 from modules where uuid = uuid5(m.uuid::uuid, t.title) and module_version_is(major_version, minor_version, $2));
+
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+UPDATE trees
+    set documentid = module_ident 
+    FROM t, modules m WHERE nodeid = t.node AND t.documentid IS NULL and nodeid::text = m.doctype;
+
+$function$;
+
+CREATE OR REPLACE FUNCTION public.book_pages(uuid uuid, version text, as_collated boolean DEFAULT true)
+ RETURNS SETOF modules
+ LANGUAGE sql
+AS $function$
+WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version_is(m.major_version, m.minor_version, $2) AND
+      tr.documentid = m.module_ident AND
+      tr.is_collated = $3 AND
+      tr.parent_id is NULL
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+SELECT
+m.*
+FROM t left join  modules m on t.value = m.module_ident WHERE m.portal_type in ('Module','CompositeModule')
+
+$function$;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION is_baked(col_uuid uuid, col_ver text)
+ RETURNS boolean
+ IMMUTABLE
+AS $function$
+SELECT bool_or(is_collated)
+    FROM modules JOIN trees
+        ON module_ident = documentid
+    WHERE uuid = col_uuid
+          AND module_version_is(major_version, minor_version, col_ver)
+$function$ LANGUAGE SQL;
+""")
+    cursor.execute("""\
+DROP INDEX IF EXISTS modules_uuid_txt_version_idx;
+DROP INDEX IF EXISTS latest_modules_uuid_text_version_idx;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE INDEX modules_uuid_txt_version_idx on
+    modules (CAST(uuid as text), module_version(major_version, minor_version));
+CREATE INDEX latest_modules_uuid_text_version_idx on
+    latest_modules (cast(uuid as text), module_version(major_version, minor_version));
+""")
+    cursor.execute(r"""
+CREATE OR REPLACE FUNCTION tree_to_json(uuid TEXT, version TEXT, as_collated BOOLEAN DEFAULT TRUE) RETURNS TEXT as $$
+select string_agg(toc,'
+'
+) from (
+WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated, slug) AS (
+    SELECT nodeid,
+           title,
+           ARRAY[nodeid],
+           documentid,
+           1,
+           ARRAY[childorder],
+           is_collated,
+           slug
+    FROM trees tr, modules m
+    WHERE m.uuid::text = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = $3
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated, c1.slug /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+SELECT
+    REPEAT('    ', depth - 1) || 
+    '{"id":"' || COALESCE(m.uuid::text,'subcol') || concat_ws('.','@'||m.major_version, m.minor_version) ||'",' ||
+    '"shortId":"' || COALESCE(short_id(m.uuid),'subcol') || concat_ws('.','@'||m.major_version, m.minor_version) ||'",' ||
+    '"slug":' ||
+        CASE WHEN (slug IS NULL) THEN 'null,'
+        ELSE '"'|| slug ||'",' END
+    ||
+    '"title":'||to_json(COALESCE(title,name))||
+      CASE WHEN (depth < lead(depth,1,0) over(w)) THEN ', "contents":['
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) = 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) over(w) - 1)
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) = 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) over(w) - 1)
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) != 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) over(w))||','
+           WHEN (depth > lead(depth,1,0) over(w) AND lead(depth,1,0) over(w) != 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) over(w))||','
+           WHEN m.uuid IS NULL THEN ', "contents":[]},'
+           ELSE '},' END
+      AS "toc"
+FROM t left join  modules m on t.value = m.module_ident
+    WINDOW w as (ORDER BY corder) order by corder ) tree ;
+$$ LANGUAGE SQL;
+
+
+
+
+
+CREATE OR REPLACE FUNCTION tree_to_json_for_legacy(TEXT, TEXT) RETURNS TEXT AS $$
+SELECT string_agg(toc,'
+'
+) FROM (
+WITH RECURSIVE t(node, title, path,value, depth, corder) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, 1, ARRAY[childorder]
+    FROM trees tr, modules m
+    WHERE m.uuid::text = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = FALSE
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder] /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE NOT nodeid = ANY (t.path) AND c1.is_collated = FALSE
+)
+SELECT
+    REPEAT('    ', depth - 1) || '{"id":"' || COALESCE(m.moduleid,'subcol') ||  '",' ||
+      '"version":' || COALESCE('"'||m.version||'"', 'null') || ',' ||
+      '"title":'||to_json(COALESCE(title,name))||
+      CASE WHEN (depth < lead(depth,1,0) OVER(w)) THEN ', "contents":['
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) = 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w) - 1)
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) = 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w) - 1)
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) != 0 AND m.uuid IS NULL) THEN ', "contents":[]}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w))||','
+           WHEN (depth > lead(depth,1,0) OVER(w) AND lead(depth,1,0) OVER(w) != 0 ) THEN '}'||REPEAT(']}',depth - lead(depth,1,0) OVER(w))||','
+           WHEN m.uuid IS NULL THEN ', "contents":[]},'
+           ELSE '},' END
+      AS "toc"
+FROM t LEFT JOIN modules m ON t.value = m.module_ident
+    WINDOW w AS (ORDER BY corder) ORDER BY corder ) tree ;
+$$ LANGUAGE SQL;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION public.subcol_uuids(uuid uuid, version text) RETURNS VOID
+ LANGUAGE sql
+AS $function$
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+INSERT INTO document_controls (uuid)
+
+SELECT
+    uuid5(m.uuid::uuid, t.title)
+    FROM t JOIN modules m on m.module_ident = t.parent WHERE t.documentid IS NULL and not exists (select 1 from document_controls where
+        uuid = uuid5(m.uuid::uuid, t.title));
+
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+INSERT INTO modules (
+    doctype,
+    portal_type,
+    moduleid,
+    uuid,
+    version,
+    name,
+    created,
+    revised,
+    licenseid,
+    submitter,
+    submitlog,
+    stateid,
+    parent,
+    language,
+    authors,
+    maintainers,
+    licensors,
+    parentauthors,
+    google_analytics,
+    buylink,
+    major_version,
+    minor_version,
+    print_style)
+
+SELECT
+    t.node,
+    'SubCollection',
+    'col' || nextval('collectionid_seq'),
+    uuid5(m.uuid::uuid, t.title),
+    m.version,
+    t.title,
+    m.created,
+    m.revised,
+    m.licenseid,
+    m.submitter,
+    m.submitlog,
+    m.stateid,
+    m.parent,
+    m.language,
+    m.authors,
+    m.maintainers,
+    m.licensors,
+    m.parentauthors,
+    m.google_analytics,
+    m.buylink,
+    m.major_version,
+    m.minor_version,
+    m.print_style
+
+FROM t join modules m on m.module_ident = t.parent WHERE t.documentid IS NULL
+    and not exists (select 1 from modules where uuid = uuid5(m.uuid::uuid, t.title) and module_version(major_version, minor_version) = $2);
+
+WITH RECURSIVE t(node, title, path, documentid, parent, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, NULL::integer, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.parent_id IS NULL AND
+      tr.is_collated = False
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+UPDATE trees
+    set documentid = module_ident 
+    FROM t, modules m WHERE nodeid = t.node AND t.documentid IS NULL and nodeid::text = m.doctype;
+
+$function$;
+
+CREATE OR REPLACE FUNCTION public.book_pages(uuid uuid, version text, as_collated boolean DEFAULT true)
+ RETURNS SETOF modules
+ LANGUAGE sql
+AS $function$
+WITH RECURSIVE t(node, title, path,value, depth, corder, is_collated) AS (
+    SELECT nodeid, title, ARRAY[nodeid], documentid, 1, ARRAY[childorder],
+           is_collated
+    FROM trees tr, modules m
+    WHERE m.uuid = $1 AND
+          module_version( m.major_version, m.minor_version) = $2 AND
+      tr.documentid = m.module_ident AND
+      tr.is_collated = $3 AND
+      tr.parent_id is NULL
+UNION ALL
+    SELECT c1.nodeid, c1.title, t.path || ARRAY[c1.nodeid], c1.documentid, t.depth+1, t.corder || ARRAY[c1.childorder], c1.is_collated /* Recursion */
+    FROM trees c1 JOIN t ON (c1.parent_id = t.node)
+    WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
+)
+SELECT
+m.*
+FROM t left join  modules m on t.value = m.module_ident WHERE m.portal_type in ('Module','CompositeModule')
+
+$function$;
+""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION is_baked(col_uuid uuid, col_ver text)
+ RETURNS boolean
+ IMMUTABLE
+AS $function$
+SELECT bool_or(is_collated)
+    FROM modules JOIN trees
+        ON module_ident = documentid
+    WHERE uuid = col_uuid AND module_version(major_version, minor_version) = col_ver
+$function$ LANGUAGE SQL;
+""")
+    cursor.execute("""\
+DROP FUNCTION IF EXISTS module_version_is(integer, integer, text);
+DROP FUNCTION IF EXISTS version_minor(text);
+DROP FUNCTION IF EXISTS version_major(text);
+DROP FUNCTION IF EXISTS ident_hash_version(text);
+DROP FUNCTION IF EXISTS ident_hash_uuid(text);
+DROP FUNCTION IF EXISTS to_uuid(text);
+""")
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from dbmigrator import super_user
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+CREATE OR REPLACE FUNCTION uuid_generate_v4 () RETURNS uuid LANGUAGE sql VOLATILE AS $$ SELECT gen_random_uuid() $$ ;
+
+-- RFC 4122 name based (SHA-1) uuid, equivalent to python's uuid.uuid5
+CREATE OR REPLACE FUNCTION uuid5 (namespace uuid, name text)
+  RETURNS uuid
+  LANGUAGE sql
+  IMMUTABLE
+  STRICT
+AS $$
+  SELECT encode(
+           set_byte(
+             set_byte(h, 6, (get_byte(h, 6) & 15) | 80),
+             8, (get_byte(h, 8) & 63) | 128),
+           'hex')::uuid
+  FROM (SELECT substring(digest(uuid_send(namespace) ||
+                                convert_to(name, 'UTF8'), 'sha1')
+                         FROM 1 FOR 16) AS h) AS d
+$$ ;
+""")
+
+
+def down(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+CREATE OR REPLACE FUNCTION uuid_generate_v4 () RETURNS uuid LANGUAGE plpythonu AS $$ import uuid; return uuid.uuid4() $$ ;
+CREATE OR REPLACE FUNCTION uuid5 (namespace uuid, name text) RETURNS uuid LANGUAGE plpythonu AS $$ import uuid; return uuid.uuid5(uuid.UUID(namespace), name) $$ ;
+
+DROP EXTENSION IF EXISTS pgcrypto;
+""")
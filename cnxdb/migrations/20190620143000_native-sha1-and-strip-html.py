@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from dbmigrator import super_user
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+CREATE OR REPLACE FUNCTION sha1(file text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE STRICT
+AS $function$
+SELECT encode(digest(file, 'sha1'), 'hex')
+$function$;
+
+CREATE OR REPLACE FUNCTION sha1(f bytea)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE STRICT
+AS $function$
+SELECT encode(digest(f, 'sha1'), 'hex')
+$function$;
+
+CREATE OR REPLACE FUNCTION strip_html(html_text TEXT)
+  RETURNS text
+AS $$
+  SELECT regexp_replace(html_text, '<[^>]*>', '', 'g')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_sha1()
+    RETURNS TRIGGER
+AS $$
+BEGIN
+  NEW.sha1 = sha1(NEW.file);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- strip_html now removes every tag, rather than only the first eight.
+REINDEX INDEX modules_strip_html_name_trgm_gin;
+""")
+
+
+def down(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+CREATE OR REPLACE FUNCTION sha1(file text)
+ RETURNS text
+ LANGUAGE plpythonu
+ IMMUTABLE STRICT
+AS $function$
+import hashlib
+return hashlib.new('sha1', file).hexdigest()
+$function$;
+
+CREATE OR REPLACE FUNCTION sha1(f bytea)
+ RETURNS text
+ LANGUAGE plpythonu
+ IMMUTABLE STRICT
+AS $function$
+import hashlib
+return hashlib.new('sha1',f).hexdigest()
+$function$;
+
+CREATE OR REPLACE FUNCTION strip_html(html_text TEXT)
+  RETURNS text
+AS $$
+  import re
+  return re.sub('<[^>]*?>', '', html_text, re.MULTILINE)
+$$ LANGUAGE plpythonu IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_sha1()
+    RETURNS TRIGGER
+AS $$
+    import hashlib
+
+    TD['new']['sha1'] = hashlib.new('sha1', TD['new']['file']).hexdigest()
+    return 'MODIFY'
+$$ LANGUAGE plpythonu;
+
+REINDEX INDEX modules_strip_html_name_trgm_gin;
+""")
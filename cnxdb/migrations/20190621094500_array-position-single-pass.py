@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYELEMENT)
+RETURNS INTEGER
+IMMUTABLE STRICT
+LANGUAGE SQL
+AS $$
+  SELECT a.i::integer + array_lower($1, 1) - 1
+  FROM unnest($1) WITH ORDINALITY AS a(e, i)
+  WHERE a.e = $2
+  LIMIT 1
+$$;
+
+CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYARRAY)
+RETURNS INTEGER
+IMMUTABLE STRICT
+LANGUAGE SQL
+AS $$
+  SELECT a.i::integer + array_lower($1, 1) - 1
+  FROM unnest($1) WITH ORDINALITY AS a(e, i)
+  WHERE ARRAY[a.e] = $2
+  LIMIT 1
+$$;
+
+CREATE OR REPLACE FUNCTION idx(anyarray, anyelement)
+  RETURNS INT AS 
+$$
+  SELECT array_position($1, $2);
+$$ LANGUAGE SQL IMMUTABLE;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYELEMENT)
+RETURNS INTEGER
+IMMUTABLE STRICT
+LANGUAGE PLPGSQL
+AS $$
+BEGIN
+  for i in array_lower($1,1) .. array_upper($1,1)
+  LOOP
+    IF ($1[i] = $2)
+    THEN
+      RETURN i;
+    END IF;
+  END LOOP;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION array_position (ANYARRAY, ANYARRAY)
+RETURNS INTEGER
+IMMUTABLE STRICT
+LANGUAGE PLPGSQL
+AS $$
+BEGIN
+  for i in array_lower($1,1) .. array_upper($1,1)
+  LOOP
+    IF ($1[i:i] = $2)
+    THEN
+      RETURN i;
+    END IF;
+  END LOOP;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION idx(anyarray, anyelement)
+  RETURNS INT AS 
+$$
+  SELECT i FROM (
+     SELECT generate_series(array_lower($1,1),array_upper($1,1))
+  ) g(i)
+  WHERE $1[i] = $2
+  LIMIT 1;
+$$ LANGUAGE SQL IMMUTABLE;
+""")
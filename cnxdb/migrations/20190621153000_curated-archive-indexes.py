@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- supports the recursive tree queries, which join children on
+-- (parent_id, is_collated), and the parent_id ON DELETE CASCADE
+CREATE INDEX trees_parent_id_idx on trees(parent_id, is_collated) where parent_id is not null;
+
+-- The search results exclude these portal types (see archive-sql/search)
+CREATE INDEX latest_modules_searchable_idx on latest_modules (module_ident)
+    WHERE portal_type NOT IN ('CompositeModule', 'SubCollection');
+
+-- Covered by the leading column of modules_uuid_version_idx
+DROP INDEX IF EXISTS modules_uuid_idx;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE INDEX modules_uuid_idx on modules (uuid);
+DROP INDEX IF EXISTS latest_modules_searchable_idx;
+DROP INDEX IF EXISTS trees_parent_id_idx;
+""")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+ALTER TABLE files ADD COLUMN size bigint;
+
+CREATE OR REPLACE FUNCTION update_file_size()
+    RETURNS TRIGGER
+AS $$
+BEGIN
+  NEW.size = octet_length(NEW.file);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_files_size
+    BEFORE INSERT OR UPDATE OF file ON files
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_file_size();
+
+-- Content addressed insert-or-get of a file. Returns the fileid of the file
+-- with the same content (sha1) when there is one, otherwise inserts it.
+-- The media_type may be NULL, the content may not.
+CREATE OR REPLACE FUNCTION get_or_insert_file(content bytea, media_type text)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  _sha1 text := sha1(content);
+  _fileid integer;
+BEGIN
+  IF content IS NULL THEN
+    RAISE EXCEPTION USING
+      ERRCODE = 'null_value_not_allowed',
+      MESSAGE = 'get_or_insert_file: the file content must not be NULL';
+  END IF;
+  LOOP
+    SELECT fileid INTO _fileid FROM files WHERE sha1 = _sha1;
+    IF FOUND THEN
+      RETURN _fileid;
+    END IF;
+    BEGIN
+      INSERT INTO files (file, media_type)
+        VALUES (content, media_type)
+        RETURNING fileid INTO _fileid;
+      RETURN _fileid;
+    EXCEPTION WHEN unique_violation THEN
+      -- inserted concurrently, loop to select it
+    END;
+  END LOOP;
+END;
+$function$;
+""")
+    # octet_length reads the size from the TOAST header,
+    # so this doesn't fetch the content of the files.
+    cursor.execute("UPDATE files SET size = octet_length(file)")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP TRIGGER IF EXISTS update_files_size ON files;
+DROP FUNCTION IF EXISTS update_file_size();
+DROP FUNCTION IF EXISTS get_or_insert_file(bytea, text);
+ALTER TABLE files DROP COLUMN IF EXISTS size;
+""")
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION legacy_content(nodeid int,
+    repo text default 'https://legacy.cnx.org/content')
+RETURNS xml
+IMMUTABLE STRICT
+LANGUAGE SQL
+AS
+$$
+WITH RECURSIVE nodes AS (
+    SELECT t.nodeid, t.parent_id, t.title, t.latest,
+           m.portal_type, m.moduleid, m.version, m.name,
+           ARRAY[t.childorder, t.nodeid] AS path
+    FROM trees t JOIN modules m ON t.documentid = m.module_ident
+    WHERE t.parent_id = legacy_content.nodeid
+      AND m.portal_type in ('Module', 'CompositeModule',
+                            'SubCollection', 'CompositeSubCollection')
+  UNION ALL
+    SELECT t.nodeid, t.parent_id, t.title, t.latest,
+           m.portal_type, m.moduleid, m.version, m.name,
+           n.path || ARRAY[t.childorder, t.nodeid]
+    FROM nodes n
+      JOIN trees t ON t.parent_id = n.nodeid
+      JOIN modules m ON t.documentid = m.module_ident
+    WHERE n.portal_type in ('SubCollection', 'CompositeSubCollection')
+      AND m.portal_type in ('Module', 'CompositeModule',
+                            'SubCollection', 'CompositeSubCollection')
+),
+parents AS (
+    SELECT DISTINCT parent_id AS nodeid FROM nodes
+),
+markup (path, piece) AS (
+    SELECT n.path,
+           CASE WHEN n.portal_type in ('Module', 'CompositeModule')
+               THEN xmlelement(name "col:module",
+                   xmlattributes(n.moduleid as "document",
+                                 ( CASE WHEN n.latest THEN 'latest'
+                                   ELSE n.version END ) as "version",
+                                 legacy_content.repo as "repository",
+                                 n.version as "cnxorg:version-at-this-collection-version"),
+                   xmlelement(name "md:title", COALESCE (n.title, n.name))
+                   )::text
+               ELSE '<col:subcollection>' ||
+                   xmlelement(name "md:title", COALESCE (n.title, n.name))::text ||
+                   CASE WHEN p.nodeid IS NULL THEN '<col:content/>'
+                       ELSE '<col:content>' END
+           END
+    FROM nodes n LEFT JOIN parents p ON p.nodeid = n.nodeid
+  UNION ALL
+    -- NULLs sort after any childorder and nodeid,
+    -- so this follows all of the subcollection's descendants.
+    SELECT n.path || ARRAY[NULL::int, NULL::int],
+           CASE WHEN p.nodeid IS NULL THEN '' ELSE '</col:content>' END ||
+               '</col:subcollection>'
+    FROM nodes n LEFT JOIN parents p ON p.nodeid = n.nodeid
+    WHERE n.portal_type in ('SubCollection', 'CompositeSubCollection')
+)
+SELECT (CASE WHEN count(*) = 0 THEN '<col:content/>'
+            ELSE '<col:content>' || string_agg(piece, '' ORDER BY path) ||
+                 '</col:content>'
+        END)::xml
+FROM markup
+$$;
+
+CREATE OR REPLACE FUNCTION replace_collxml(coll_id integer)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+  DECLARE
+    existing_collxml_id integer;
+    _collxml_id integer;
+
+  BEGIN
+    existing_collxml_id := (SELECT fileid FROM module_files
+        WHERE module_ident = coll_id AND filename = 'collection.xml');
+
+    _collxml_id := get_or_insert_file(
+      pretty_print(legacy_collxml(coll_id, True))::text::bytea,
+      'text/xml');
+
+
+    IF existing_collxml_id IS NULL THEN
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES ( coll_id, _collxml_id, 'collection.xml');
+    ELSIF _collxml_id != existing_collxml_id THEN
+      DELETE FROM module_files WHERE module_ident = coll_id AND filename = 'collection.xml';
+      DELETE FROM files WHERE fileid = existing_collxml_id;
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES ( coll_id, _collxml_id, 'collection.xml');
+    END IF;
+
+    RETURN _collxml_id;
+  END;
+
+$function$;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION legacy_content(nodeid int,
+    repo text default 'https://legacy.cnx.org/content')
+RETURNS xml
+IMMUTABLE STRICT
+LANGUAGE SQL
+AS
+$$
+SELECT
+    xmlelement(name "col:content",
+    (SELECT xmlagg(
+            CASE WHEN c.portal_type in ('Module','CompositeModule')
+                THEN legacy_module(c.nodeid, legacy_content.repo)
+                WHEN c.portal_type in ('SubCollection','CompositeSubCollection')
+                THEN legacy_subcol(c.nodeid, legacy_content.repo)
+            END)
+            FROM (SELECT nodeid, portal_type FROM trees t JOIN modules m
+                ON t.documentid = m.module_ident
+                WHERE parent_id = legacy_content.nodeid
+                ORDER BY childorder) AS c
+            )
+        )
+$$;
+
+CREATE OR REPLACE FUNCTION replace_collxml(coll_id integer)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+  DECLARE
+    existing_collxml_id integer;
+    _collxml_id integer;
+
+  BEGIN
+    existing_collxml_id := (SELECT fileid FROM module_files
+        WHERE module_ident = coll_id AND filename = 'collection.xml');
+
+    SELECT fileid FROM files WHERE sha1 = 
+      sha1(pretty_print(legacy_collxml(coll_id, True))::text::bytea)
+        INTO _collxml_id;
+
+    IF _collxml_id IS NULL THEN
+      INSERT INTO files (file, media_type) SELECT
+        pretty_print(legacy_collxml(coll_id, True))::text::bytea,
+        'text/xml'
+        RETURNING fileid INTO _collxml_id;
+    END IF;
+
+
+    IF existing_collxml_id IS NULL THEN
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES ( coll_id, _collxml_id, 'collection.xml');
+    ELSIF _collxml_id != existing_collxml_id THEN
+      DELETE FROM module_files WHERE module_ident = coll_id AND filename = 'collection.xml';
+      DELETE FROM files WHERE fileid = existing_collxml_id;
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES ( coll_id, _collxml_id, 'collection.xml');
+    END IF;
+
+    RETURN _collxml_id;
+  END;
+
+$function$;
+""")
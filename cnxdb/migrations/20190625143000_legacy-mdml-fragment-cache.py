@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Rendered legacy_mdml_inner fragments, filled lazily by
+-- legacy_mdml_inner_cached and invalidated by the
+-- invalidate_legacy_mdml triggers when the metadata changes.
+CREATE TABLE legacy_mdml_fragments (
+  module_ident INTEGER,
+  recurse BOOLEAN,
+  repo TEXT,
+  fragment XML,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE,
+  PRIMARY KEY (module_ident, recurse, repo)
+);
+
+CREATE INDEX modules_parent_idx on modules (parent);
+
+-- Drops the cached legacy_mdml_inner fragments (see legacy_mdml_fragments)
+-- of the modules whose metadata changed, along with the fragments of the
+-- modules derived from them: their derived-from element has the parent's
+-- url and, in the recursive fragments, the metadata of all the ancestors.
+CREATE OR REPLACE FUNCTION invalidate_legacy_mdml()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  idents integer[];
+BEGIN
+  IF TG_LEVEL = 'STATEMENT' THEN
+    -- licenses and persons, which can affect any module
+    DELETE FROM legacy_mdml_fragments;
+    RETURN NULL;
+  ELSIF TG_TABLE_NAME = 'abstracts' THEN
+    idents := ARRAY(SELECT module_ident FROM modules
+                    WHERE abstractid = NEW.abstractid);
+  ELSIF TG_TABLE_NAME = 'keywords' THEN
+    idents := ARRAY(SELECT module_ident FROM modulekeywords
+                    WHERE keywordid = NEW.keywordid);
+  ELSIF TG_TABLE_NAME = 'tags' THEN
+    idents := ARRAY(SELECT module_ident FROM moduletags
+                    WHERE tagid = NEW.tagid);
+  ELSIF TG_TABLE_NAME = 'roles' THEN
+    idents := ARRAY(SELECT module_ident FROM moduleoptionalroles
+                    WHERE roleid = NEW.roleid);
+  ELSIF TG_OP = 'DELETE' THEN
+    idents := ARRAY[OLD.module_ident];
+  ELSIF TG_OP = 'UPDATE' THEN
+    idents := ARRAY[OLD.module_ident, NEW.module_ident];
+  ELSE
+    idents := ARRAY[NEW.module_ident];
+  END IF;
+
+  DELETE FROM legacy_mdml_fragments
+  WHERE module_ident = ANY (idents)
+     OR module_ident IN (SELECT m.module_ident FROM modules AS m
+                         WHERE m.parent = ANY (idents))
+     OR (recurse AND module_ident IN (
+           WITH RECURSIVE derived (module_ident) AS (
+               SELECT m.module_ident FROM modules AS m
+               WHERE m.parent = ANY (idents)
+             UNION
+               SELECT m.module_ident
+               FROM modules AS m JOIN derived AS d
+                 ON m.parent = d.module_ident)
+           SELECT module_ident FROM derived));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF moduleid, version, name, created, revised, abstractid,
+                  licenseid, parent, language, authors, maintainers, licensors
+  ON modules FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON moduleoptionalroles FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON moduletags FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON modulekeywords FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF abstract ON abstracts FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF word ON keywords FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF tag, scheme ON tags FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE OF roleparam ON roles FOR EACH ROW
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER UPDATE ON licenses FOR EACH STATEMENT
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+CREATE TRIGGER invalidate_legacy_mdml
+  AFTER INSERT OR UPDATE OR DELETE ON persons FOR EACH STATEMENT
+  EXECUTE PROCEDURE invalidate_legacy_mdml();
+
+-- legacy_mdml_inner, cached in legacy_mdml_fragments
+
+CREATE OR REPLACE FUNCTION legacy_mdml_inner_cached (
+    mod_ident int,
+    recurse bool default False,
+    repo text default 'https://legacy.cnx.org/content')
+RETURNS XML
+STRICT
+AS
+$$
+DECLARE
+  _fragment xml;
+BEGIN
+  SELECT fragment INTO _fragment FROM legacy_mdml_fragments AS f
+  WHERE f.module_ident = mod_ident AND f.recurse = legacy_mdml_inner_cached.recurse
+        AND f.repo = legacy_mdml_inner_cached.repo;
+  IF FOUND THEN
+    RETURN _fragment;
+  END IF;
+
+  _fragment := legacy_mdml_inner(mod_ident, recurse, repo);
+  -- Read-only transactions (e.g. on a hot standby) only read the cache.
+  IF current_setting('transaction_read_only') = 'off' THEN
+    BEGIN
+      INSERT INTO legacy_mdml_fragments (module_ident, recurse, repo, fragment)
+        VALUES (mod_ident, recurse, repo, _fragment);
+    EXCEPTION WHEN unique_violation OR foreign_key_violation THEN
+      -- cached concurrently or not a module, nothing to do
+    END;
+  END IF;
+  RETURN _fragment;
+END;
+$$
+LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION legacy_collxml (ident int,
+      recurse bool default False,
+      repo text default 'https://legacy.cnx.org/content')
+RETURNS xml
+LANGUAGE SQL
+STRICT
+AS
+$$
+SELECT xmlelement(name "col:collection",
+             xmlattributes( 'http://cnx.rice.edu/collxml' as "xmlns",
+                            'http://cnx.rice.edu/cnxml' as "xmlns:cnx",
+                            'http://cnx.rice.edu/system-info' as "xmlns:cnxorg",
+                            'http://cnx.rice.edu/mdml' as "xmlns:md",
+                            'http://cnx.rice.edu/collxml' as "xmlns:col",
+                            m.language as "xml:lang"),
+    xmlelement(name "metadata",
+        xmlattributes( 'http://cnx.rice.edu/mdml' as "xmlns:md",
+                       '0.5' as "mdml-version"),
+        legacy_mdml_inner_cached(legacy_collxml.ident,
+                                 legacy_collxml.recurse,
+                                 legacy_collxml.repo)
+    ),
+    xmlelement(name "col:parameters",
+        xmlelement(name "col:param",
+            xmlattributes('print-style' as "name", COALESCE(print_style, '') as "value")
+        )
+    ),
+    legacy_content(nodeid, legacy_collxml.repo)
+)
+FROM modules m JOIN trees t ON m.module_ident = t.documentid WHERE m.module_ident = legacy_collxml.ident
+$$;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION legacy_collxml (ident int,
+      recurse bool default False,
+      repo text default 'https://legacy.cnx.org/content')
+RETURNS xml
+LANGUAGE SQL
+IMMUTABLE STRICT
+AS
+$$
+SELECT xmlelement(name "col:collection",
+             xmlattributes( 'http://cnx.rice.edu/collxml' as "xmlns",
+                            'http://cnx.rice.edu/cnxml' as "xmlns:cnx",
+                            'http://cnx.rice.edu/system-info' as "xmlns:cnxorg",
+                            'http://cnx.rice.edu/mdml' as "xmlns:md",
+                            'http://cnx.rice.edu/collxml' as "xmlns:col",
+                            m.language as "xml:lang"),
+    xmlelement(name "metadata",
+        xmlattributes( 'http://cnx.rice.edu/mdml' as "xmlns:md",
+                       '0.5' as "mdml-version"),
+        legacy_mdml_inner(legacy_collxml.ident,
+                          legacy_collxml.recurse,
+                          legacy_collxml.repo)
+    ),
+    xmlelement(name "col:parameters",
+        xmlelement(name "col:param",
+            xmlattributes('print-style' as "name", COALESCE(print_style, '') as "value")
+        )
+    ),
+    legacy_content(nodeid, legacy_collxml.repo)
+)
+FROM modules m JOIN trees t ON m.module_ident = t.documentid WHERE m.module_ident = legacy_collxml.ident
+$$;
+
+DROP FUNCTION IF EXISTS legacy_mdml_inner_cached(int, bool, text);
+
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON persons;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON roles;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON tags;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON keywords;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON licenses;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON abstracts;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON modulekeywords;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON moduletags;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON moduleoptionalroles;
+DROP TRIGGER IF EXISTS invalidate_legacy_mdml ON modules;
+DROP FUNCTION IF EXISTS invalidate_legacy_mdml();
+
+DROP INDEX IF EXISTS modules_parent_idx;
+DROP TABLE IF EXISTS legacy_mdml_fragments;
+""")
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Collections waiting for their collection.xml to be generated,
+-- when gen_minor_collxml runs in the 'async' cnxdb.collxml_mode
+-- (see the cnx-db gen-collxml command).
+CREATE TABLE collxml_queue (
+  module_ident INTEGER PRIMARY KEY,
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- failed generations, the last error is kept
+  attempts INTEGER NOT NULL DEFAULT 0,
+  error TEXT,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+-- The collection.xml is generated here, unless the ``cnxdb.collxml_mode``
+-- setting is 'async', in which case the collection is queued in
+-- collxml_queue to be generated outside of the publishing transaction.
+CREATE OR REPLACE FUNCTION gen_minor_collxml()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_collxml integer;
+    _collxml_id integer;
+    mode text;
+
+  BEGIN
+    has_existing_collxml := (SELECT fileid FROM module_files
+        WHERE module_ident = NEW.module_ident
+        AND filename = 'collection.xml');
+
+    BEGIN
+      mode := current_setting('cnxdb.collxml_mode');
+    EXCEPTION WHEN undefined_object THEN
+      mode := 'sync';
+    END;
+
+    IF has_existing_collxml IS NULL AND mode = 'async' THEN
+      INSERT INTO collxml_queue (module_ident)
+        SELECT NEW.module_ident
+        WHERE NOT EXISTS (SELECT 1 FROM collxml_queue
+                          WHERE module_ident = NEW.module_ident);
+    ELSIF has_existing_collxml IS NULL THEN
+      INSERT INTO files (file, media_type) SELECT
+          pretty_print(legacy_collxml(NEW.module_ident, True))::text::bytea,
+          'text/xml'
+          RETURNING fileid INTO _collxml_id;
+
+      INSERT INTO module_files (module_ident, fileid, filename)
+          VALUES ( NEW.module_ident, _collxml_id, 'collection.xml');
+
+    END IF;
+    RETURN NEW;
+  END;
+
+$$ LANGUAGE PLPGSQL;
+
+-- Generates the collection.xml of a collection, unless it already has one.
+-- Returns the fileid of the collection.xml.
+
+CREATE OR REPLACE FUNCTION gen_collxml(coll_id integer)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+  DECLARE
+    _collxml_id integer;
+
+  BEGIN
+    _collxml_id := (SELECT fileid FROM module_files
+        WHERE module_ident = coll_id AND filename = 'collection.xml');
+    IF _collxml_id IS NOT NULL THEN
+      RETURN _collxml_id;
+    END IF;
+
+    _collxml_id := get_or_insert_file(
+      pretty_print(legacy_collxml(coll_id, True))::text::bytea,
+      'text/xml');
+    BEGIN
+      INSERT INTO module_files (module_ident, fileid, filename)
+        VALUES (coll_id, _collxml_id, 'collection.xml');
+    EXCEPTION WHEN unique_violation THEN
+      -- generated concurrently
+      _collxml_id := (SELECT fileid FROM module_files
+          WHERE module_ident = coll_id AND filename = 'collection.xml');
+    END;
+
+    RETURN _collxml_id;
+  END;
+
+$function$;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION gen_minor_collxml()
+  RETURNS TRIGGER AS $$
+  DECLARE
+    has_existing_collxml integer;
+    _collxml_id integer;
+
+  BEGIN
+    has_existing_collxml := (SELECT fileid FROM module_files
+        WHERE module_ident = NEW.module_ident
+        AND filename = 'collection.xml');
+
+    IF has_existing_collxml IS NULL THEN
+      INSERT INTO files (file, media_type) SELECT
+          pretty_print(legacy_collxml(NEW.module_ident, True))::text::bytea,
+          'text/xml'
+          RETURNING fileid INTO _collxml_id;
+
+      INSERT INTO module_files (module_ident, fileid, filename)
+          VALUES ( NEW.module_ident, _collxml_id, 'collection.xml');
+
+    END IF;
+    RETURN NEW;
+  END;
+
+$$ LANGUAGE PLPGSQL;
+
+DROP FUNCTION IF EXISTS gen_collxml(integer);
+DROP TABLE IF EXISTS collxml_queue;
+""")
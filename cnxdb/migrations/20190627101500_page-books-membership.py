@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Membership of documents in books (e.g. used to find the default canonical
+-- book of a page): one row per non-root node of the trees, with the uuid of
+-- the node's document and the module_ident of its root's document (the book).
+-- Maintained by the update_page_books trigger.
+CREATE TABLE page_books (
+    nodeid integer PRIMARY KEY,
+    page_uuid uuid NOT NULL,
+    book_ident integer NOT NULL,
+    FOREIGN KEY (nodeid) REFERENCES trees (nodeid) ON DELETE CASCADE
+);
+
+CREATE INDEX page_books_page_uuid_idx on page_books(page_uuid);
+CREATE INDEX page_books_book_ident_idx on page_books(book_ident);
+
+-- Recomputes the page_books rows of the given nodes and their descendants
+CREATE OR REPLACE FUNCTION refresh_page_books(nodeids integer[])
+RETURNS void AS $$
+DECLARE
+  subtree integer[];
+BEGIN
+  subtree := ARRAY(
+    WITH RECURSIVE sub(nodeid, path) AS (
+        SELECT nodeid, ARRAY[nodeid] FROM trees WHERE nodeid = ANY (nodeids)
+      UNION ALL
+        SELECT c.nodeid, sub.path || c.nodeid
+        FROM trees c JOIN sub ON c.parent_id = sub.nodeid
+        WHERE NOT c.nodeid = ANY (sub.path)
+    )
+    SELECT nodeid FROM sub);
+
+  DELETE FROM page_books WHERE nodeid = ANY (subtree);
+
+  INSERT INTO page_books (nodeid, page_uuid, book_ident)
+    WITH RECURSIVE up(nodeid, ancestor, parent, path) AS (
+        SELECT nodeid, nodeid, parent_id, ARRAY[nodeid] FROM trees
+        WHERE nodeid = ANY (subtree) AND parent_id IS NOT NULL
+      UNION ALL
+        SELECT up.nodeid, p.nodeid, p.parent_id, up.path || p.nodeid
+        FROM trees p JOIN up ON p.nodeid = up.parent
+        WHERE NOT p.nodeid = ANY (up.path)
+    )
+    SELECT up.nodeid, m.uuid, r.documentid
+    FROM up
+      JOIN trees n ON n.nodeid = up.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+      JOIN trees r ON r.nodeid = up.ancestor
+    WHERE up.parent IS NULL AND r.documentid IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes all of page_books, walking down from every root at once
+CREATE OR REPLACE FUNCTION rebuild_page_books()
+RETURNS void AS $$
+BEGIN
+  DELETE FROM page_books;
+
+  INSERT INTO page_books (nodeid, page_uuid, book_ident)
+    WITH RECURSIVE down(nodeid, book_ident, path) AS (
+        SELECT nodeid, documentid, ARRAY[nodeid] FROM trees
+        WHERE parent_id IS NULL AND documentid IS NOT NULL
+      UNION ALL
+        SELECT c.nodeid, down.book_ident, down.path || c.nodeid
+        FROM trees c JOIN down ON c.parent_id = down.nodeid
+        WHERE NOT c.nodeid = ANY (down.path)
+    )
+    SELECT down.nodeid, m.uuid, down.book_ident
+    FROM down
+      JOIN trees n ON n.nodeid = down.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+    WHERE n.parent_id IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_page_books()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_page_books(ARRAY[NEW.nodeid]);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_page_books
+  AFTER INSERT OR UPDATE OF parent_id, documentid ON trees FOR EACH ROW
+  EXECUTE PROCEDURE update_page_books();
+""")
+    cursor.execute("SELECT rebuild_page_books()")
+    cursor.execute("""\
+-- Find the first book containing a given uuid (candidate canonical for page)
+CREATE OR REPLACE FUNCTION default_canonical_book(id uuid)
+RETURNS uuid LANGUAGE SQL STRICT STABLE AS $$
+  SELECT m.uuid
+  FROM page_books AS pb JOIN modules AS m ON m.module_ident = pb.book_ident
+  WHERE pb.page_uuid = $1
+  ORDER BY m.revised, m.major_version, m.minor_version
+  LIMIT 1
+$$;
+
+-- The default canonical book of every document in a book, e.g. to recompute
+-- modules.canonical in bulk
+CREATE OR REPLACE FUNCTION default_canonical_books()
+RETURNS TABLE (page_uuid uuid, book_uuid uuid) LANGUAGE SQL STABLE AS $$
+  SELECT DISTINCT ON (pb.page_uuid) pb.page_uuid, m.uuid
+  FROM page_books AS pb JOIN modules AS m ON m.module_ident = pb.book_ident
+  ORDER BY pb.page_uuid, m.revised, m.major_version, m.minor_version
+$$;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP FUNCTION IF EXISTS default_canonical_books();
+
+-- Find the first book containing a given uuid (candidate canonical for page)
+CREATE OR REPLACE FUNCTION default_canonical_book(id uuid)
+RETURNS uuid LANGUAGE SQL STRICT IMMUTABLE AS $$
+WITH RECURSIVE t(node, title, parent, path, value) AS (
+      SELECT nodeid, coalesce(title,name), parent_id, ARRAY[nodeid], documentid
+      FROM trees tr, modules m
+      WHERE m.uuid = $1
+      AND tr.documentid = m.module_ident
+      AND tr.parent_id IS NOT NULL
+    UNION ALL
+      SELECT c1.nodeid, c1.title, c1.parent_id,
+             t.path || ARRAY[c1.nodeid], c1.documentid
+              FROM trees c1
+              JOIN t ON (c1.nodeid = t.parent)
+              WHERE not nodeid = any (t.path)
+        )
+
+        SELECT uuid
+        from t join modules on t.value = module_ident
+        where t.parent is NULL
+        ORDER BY revised, major_version, minor_version
+        LIMIT 1
+$$;
+
+DROP TRIGGER IF EXISTS update_page_books ON trees;
+DROP FUNCTION IF EXISTS update_page_books();
+DROP FUNCTION IF EXISTS rebuild_page_books();
+DROP FUNCTION IF EXISTS refresh_page_books(integer[]);
+DROP TABLE IF EXISTS page_books;
+""")
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+ALTER TABLE page_books
+  ADD COLUMN page_ident integer,
+  ADD COLUMN book_nodeid integer;
+
+-- Recomputes the page_books rows of the given nodes and their descendants
+CREATE OR REPLACE FUNCTION refresh_page_books(nodeids integer[])
+RETURNS void AS $$
+DECLARE
+  subtree integer[];
+BEGIN
+  subtree := ARRAY(
+    WITH RECURSIVE sub(nodeid, path) AS (
+        SELECT nodeid, ARRAY[nodeid] FROM trees WHERE nodeid = ANY (nodeids)
+      UNION ALL
+        SELECT c.nodeid, sub.path || c.nodeid
+        FROM trees c JOIN sub ON c.parent_id = sub.nodeid
+        WHERE NOT c.nodeid = ANY (sub.path)
+    )
+    SELECT nodeid FROM sub);
+
+  DELETE FROM page_books WHERE nodeid = ANY (subtree);
+
+  INSERT INTO page_books (nodeid, page_ident, page_uuid, book_nodeid,
+                          book_ident)
+    WITH RECURSIVE up(nodeid, ancestor, parent, path) AS (
+        SELECT nodeid, nodeid, parent_id, ARRAY[nodeid] FROM trees
+        WHERE nodeid = ANY (subtree) AND parent_id IS NOT NULL
+      UNION ALL
+        SELECT up.nodeid, p.nodeid, p.parent_id, up.path || p.nodeid
+        FROM trees p JOIN up ON p.nodeid = up.parent
+        WHERE NOT p.nodeid = ANY (up.path)
+    )
+    SELECT up.nodeid, n.documentid, m.uuid, r.nodeid, r.documentid
+    FROM up
+      JOIN trees n ON n.nodeid = up.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+      JOIN trees r ON r.nodeid = up.ancestor
+    WHERE up.parent IS NULL AND r.documentid IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes all of page_books, walking down from every root at once
+CREATE OR REPLACE FUNCTION rebuild_page_books()
+RETURNS void AS $$
+BEGIN
+  DELETE FROM page_books;
+
+  INSERT INTO page_books (nodeid, page_ident, page_uuid, book_nodeid,
+                          book_ident)
+    WITH RECURSIVE down(nodeid, book_nodeid, book_ident, path) AS (
+        SELECT nodeid, nodeid, documentid, ARRAY[nodeid] FROM trees
+        WHERE parent_id IS NULL AND documentid IS NOT NULL
+      UNION ALL
+        SELECT c.nodeid, down.book_nodeid, down.book_ident,
+               down.path || c.nodeid
+        FROM trees c JOIN down ON c.parent_id = down.nodeid
+        WHERE NOT c.nodeid = ANY (down.path)
+    )
+    SELECT down.nodeid, n.documentid, m.uuid, down.book_nodeid,
+           down.book_ident
+    FROM down
+      JOIN trees n ON n.nodeid = down.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+    WHERE n.parent_id IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+""")
+    cursor.execute("SELECT rebuild_page_books()")
+    cursor.execute("""\
+ALTER TABLE page_books
+  ALTER COLUMN page_ident SET NOT NULL,
+  ALTER COLUMN book_nodeid SET NOT NULL;
+
+CREATE INDEX page_books_page_ident_idx on page_books(page_ident);
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP INDEX IF EXISTS page_books_page_ident_idx;
+
+ALTER TABLE page_books
+  DROP COLUMN page_ident,
+  DROP COLUMN book_nodeid;
+
+-- Recomputes the page_books rows of the given nodes and their descendants
+CREATE OR REPLACE FUNCTION refresh_page_books(nodeids integer[])
+RETURNS void AS $$
+DECLARE
+  subtree integer[];
+BEGIN
+  subtree := ARRAY(
+    WITH RECURSIVE sub(nodeid, path) AS (
+        SELECT nodeid, ARRAY[nodeid] FROM trees WHERE nodeid = ANY (nodeids)
+      UNION ALL
+        SELECT c.nodeid, sub.path || c.nodeid
+        FROM trees c JOIN sub ON c.parent_id = sub.nodeid
+        WHERE NOT c.nodeid = ANY (sub.path)
+    )
+    SELECT nodeid FROM sub);
+
+  DELETE FROM page_books WHERE nodeid = ANY (subtree);
+
+  INSERT INTO page_books (nodeid, page_uuid, book_ident)
+    WITH RECURSIVE up(nodeid, ancestor, parent, path) AS (
+        SELECT nodeid, nodeid, parent_id, ARRAY[nodeid] FROM trees
+        WHERE nodeid = ANY (subtree) AND parent_id IS NOT NULL
+      UNION ALL
+        SELECT up.nodeid, p.nodeid, p.parent_id, up.path || p.nodeid
+        FROM trees p JOIN up ON p.nodeid = up.parent
+        WHERE NOT p.nodeid = ANY (up.path)
+    )
+    SELECT up.nodeid, m.uuid, r.documentid
+    FROM up
+      JOIN trees n ON n.nodeid = up.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+      JOIN trees r ON r.nodeid = up.ancestor
+    WHERE up.parent IS NULL AND r.documentid IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes all of page_books, walking down from every root at once
+CREATE OR REPLACE FUNCTION rebuild_page_books()
+RETURNS void AS $$
+BEGIN
+  DELETE FROM page_books;
+
+  INSERT INTO page_books (nodeid, page_uuid, book_ident)
+    WITH RECURSIVE down(nodeid, book_ident, path) AS (
+        SELECT nodeid, documentid, ARRAY[nodeid] FROM trees
+        WHERE parent_id IS NULL AND documentid IS NOT NULL
+      UNION ALL
+        SELECT c.nodeid, down.book_ident, down.path || c.nodeid
+        FROM trees c JOIN down ON c.parent_id = down.nodeid
+        WHERE NOT c.nodeid = ANY (down.path)
+    )
+    SELECT down.nodeid, m.uuid, down.book_ident
+    FROM down
+      JOIN trees n ON n.nodeid = down.nodeid
+      JOIN modules m ON m.module_ident = n.documentid
+    WHERE n.parent_id IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+""")
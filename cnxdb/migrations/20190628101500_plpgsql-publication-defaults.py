@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+from dbmigrator import super_user
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Inserts the next minor version of a collection (or subcollection),
+-- with the keywords, tags and files (except collection.xml) of the given
+-- version, and returns its module_ident
+CREATE OR REPLACE FUNCTION republish_collection (
+  collection_ident integer, new_submitter text, new_submitlog text)
+  RETURNS integer
+AS $$
+DECLARE
+  next_minor_version integer;
+  new_ident integer;
+BEGIN
+  -- The max minor version in the database, in case the given
+  -- collection_ident is not the latest version
+  SELECT max(m.minor_version) + 1 INTO next_minor_version
+  FROM modules m JOIN modules c
+    ON m.uuid = c.uuid AND m.major_version = c.major_version
+  WHERE c.module_ident = collection_ident;
+
+  INSERT INTO modules (portal_type, moduleid, uuid, version, name, created,
+      revised, abstractid, licenseid, doctype, submitter, submitlog,
+      stateid, parent, language, authors, maintainers, licensors,
+      parentauthors, google_analytics, buylink, print_style,
+      major_version, minor_version)
+    SELECT m.portal_type, m.moduleid, m.uuid, m.version, m.name, m.created,
+      CURRENT_TIMESTAMP, m.abstractid, m.licenseid, m.doctype,
+      new_submitter, new_submitlog,
+      m.stateid, m.parent, m.language, m.authors, m.maintainers, m.licensors,
+      m.parentauthors, m.google_analytics, m.buylink, m.print_style,
+      m.major_version, next_minor_version
+    FROM modules m
+    WHERE m.module_ident = collection_ident
+    RETURNING module_ident INTO new_ident;
+
+  INSERT INTO modulekeywords (module_ident, keywordid)
+    SELECT new_ident, keywordid FROM modulekeywords
+    WHERE module_ident = collection_ident;
+
+  INSERT INTO moduletags (module_ident, tagid)
+    SELECT new_ident, tagid FROM moduletags
+    WHERE module_ident = collection_ident;
+
+  INSERT INTO module_files (module_ident, fileid, filename)
+    SELECT new_ident, fileid, filename FROM module_files
+    WHERE module_ident = collection_ident AND filename != 'collection.xml';
+
+  RETURN new_ident;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Copies the (raw) tree of a collection, replacing the documents
+-- in old_idents with the ones at the same position in new_idents
+CREATE OR REPLACE FUNCTION rebuild_collection_tree (
+  collection_ident integer, old_idents integer[], new_idents integer[])
+  RETURNS void
+AS $$
+BEGIN
+  INSERT INTO trees (nodeid, parent_id, documentid, title, childorder, latest)
+    WITH RECURSIVE t(node, parent, document, title, childorder, latest,
+                     path) AS (
+        SELECT nodeid, parent_id, documentid, title, childorder, latest,
+               ARRAY[nodeid]
+        FROM trees
+        WHERE documentid = collection_ident AND parent_id IS NULL
+              AND is_collated = 'False'
+      UNION ALL
+        SELECT c.nodeid, c.parent_id, c.documentid, c.title, c.childorder,
+               c.latest, t.path || c.nodeid
+        FROM trees c JOIN t ON c.parent_id = t.node
+        WHERE NOT c.nodeid = ANY (t.path)
+    ),
+    -- the new nodeids are assigned before inserting the nodes,
+    -- so the children can point to their new parents
+    nodes AS (
+      SELECT t.*, nextval('nodeid_seq')::integer AS new_node FROM t
+    )
+    SELECT n.new_node, p.new_node,
+           coalesce(new_idents[array_position(old_idents, n.document)],
+                    n.document),
+           n.title, n.childorder, n.latest
+    FROM nodes n LEFT JOIN nodes p ON p.node = n.parent;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fills in the defaults of a publication, in this order:
+-- 1. the uuid (with its document_controls entry) of legacy publications
+-- 2. the ACL and users of the roles of legacy publications
+-- 3. the legacy moduleid of cnx-publishing publications
+-- 4. the versions of legacy publications, republishing the collections
+--    (and subcollections) containing a republished module
+-- 5. the collection minor version and the legacy version of cnx-publishing
+--    publications
+CREATE OR REPLACE FUNCTION module_publication_defaults ()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  -- Legacy always supplies the version.
+  is_legacy_publication boolean := NEW.version IS NOT NULL;
+  legacy_major integer;
+  legacy_minor integer;
+  current_ident integer;
+  current_uuid uuid;
+  old_idents integer[];
+  new_idents integer[];
+  republished_ident integer;
+BEGIN
+  -- 1. The uuid default is not on the modules.uuid column, because the value
+  -- needs to be associated with a document_controls entry to prevent uuid
+  -- collisions with pending publications.
+  IF NEW.uuid IS NULL THEN
+    INSERT INTO document_controls (uuid, licenseid)
+      VALUES (DEFAULT, NEW.licenseid)
+      RETURNING uuid INTO NEW.uuid;
+  END IF;
+
+  -- 2. Give the authors and maintainers publish permission,
+  -- and shadow all the roles from persons into users.
+  IF is_legacy_publication THEN
+    INSERT INTO document_acl (uuid, user_id, permission)
+      SELECT DISTINCT NEW.uuid, r.user_id, 'publish'::permission_type
+      FROM unnest(coalesce(NEW.authors, '{}'::text[]) ||
+                  coalesce(NEW.maintainers, '{}'::text[])) AS r(user_id)
+      WHERE NOT EXISTS (
+        SELECT 1 FROM document_acl a
+        WHERE a.uuid = NEW.uuid AND a.user_id = r.user_id
+              AND a.permission = 'publish');
+
+    INSERT INTO users (username, first_name, last_name, full_name, title)
+      SELECT p.personid, p.firstname, p.surname, p.fullname, p.honorific
+      FROM persons p
+      WHERE p.personid = ANY (coalesce(NEW.authors, '{}'::text[]) ||
+                              coalesce(NEW.maintainers, '{}'::text[]) ||
+                              coalesce(NEW.licensors, '{}'::text[]))
+            AND NOT EXISTS (
+              SELECT 1 FROM users u WHERE u.username = p.personid);
+  END IF;
+
+  -- 3. Legacy supplied moduleids are kept as is.
+  IF NEW.moduleid IS NULL THEN
+    IF NEW.portal_type IN ('Collection', 'SubCollection') THEN
+      NEW.moduleid := 'col' || nextval('collectionid_seq')::text;
+    ELSE
+      NEW.moduleid := 'm' || nextval('moduleid_seq')::text;
+    END IF;
+  END IF;
+
+  -- 4. e.g. there is a collection c1 v2.1, which contains a chapter sc1 v2.1,
+  -- which contains a module m1 v3. When m1 v4 is published, c1 v2.2 and
+  -- sc1 v2.2 are published with a copy of the c1 v2.1 tree, where m1 v4,
+  -- sc1 v2.2 and c1 v2.2 replace m1 v3, sc1 v2.1 and c1 v2.1.
+  -- Another chapter sc2 stays at v2.1.
+  IF is_legacy_publication THEN
+    IF NEW.portal_type IN ('Collection', 'Module') THEN
+      legacy_major := split_part(NEW.version, '.', 1)::integer;
+      legacy_minor := split_part(NEW.version, '.', 2)::integer;
+    END IF;
+    IF NEW.portal_type = 'Collection' THEN
+      NEW.major_version := legacy_minor;
+      IF NEW.minor_version IS NULL THEN
+        NEW.minor_version := 1;
+      END IF;
+    ELSIF NEW.portal_type = 'Module' THEN
+      -- N.B. a very few older modules had major=2 and minor zero-based.
+      NEW.major_version := legacy_minor + (legacy_major - 1);
+      NEW.minor_version := NULL;
+    END IF;
+
+    SELECT module_ident, uuid INTO current_ident, current_uuid
+    FROM modules WHERE moduleid = NEW.moduleid
+    ORDER BY revised DESC LIMIT 1;
+
+    IF current_ident IS NOT NULL THEN
+      -- Keep the uuid constant per moduleid
+      NEW.uuid := current_uuid;
+    END IF;
+
+    IF current_ident IS NOT NULL AND NEW.portal_type = 'Module' THEN
+      old_idents := ARRAY[current_ident];
+      new_idents := ARRAY[NEW.module_ident];
+
+      -- The subcollections containing the module, in any collection
+      FOR republished_ident IN
+        WITH RECURSIVE t(node, parent, path, document) AS (
+            SELECT nodeid, parent_id, ARRAY[nodeid], documentid
+            FROM trees
+            WHERE documentid = current_ident AND is_collated = 'False'
+          UNION ALL
+            SELECT c.nodeid, c.parent_id, t.path || c.nodeid, c.documentid
+            FROM trees c JOIN t ON c.nodeid = t.parent
+            WHERE NOT c.nodeid = ANY (t.path)
+        )
+        SELECT DISTINCT m.module_ident
+        FROM t JOIN modules m ON t.document = m.module_ident
+        WHERE m.portal_type = 'SubCollection'
+        ORDER BY m.module_ident
+      LOOP
+        old_idents := old_idents || republished_ident;
+        new_idents := new_idents || republish_collection(
+          republished_ident, NEW.submitter, NEW.submitlog);
+      END LOOP;
+
+      -- The latest versions of the collections containing the module
+      FOR republished_ident IN
+        WITH RECURSIVE t(node, parent, path, document) AS (
+            SELECT nodeid, parent_id, ARRAY[nodeid], documentid
+            FROM trees
+            WHERE documentid = current_ident AND is_collated = 'False'
+          UNION ALL
+            SELECT c.nodeid, c.parent_id, t.path || c.nodeid, c.documentid
+            FROM trees c JOIN t ON c.nodeid = t.parent
+            WHERE NOT c.nodeid = ANY (t.path)
+        )
+        SELECT DISTINCT m.module_ident
+        FROM t JOIN modules m ON t.document = m.module_ident
+        WHERE m.portal_type = 'Collection'
+              AND NOT EXISTS (
+                SELECT 1 FROM modules l
+                WHERE l.uuid = m.uuid AND l.portal_type = 'Collection'
+                      AND l.revised > m.revised)
+        ORDER BY m.module_ident
+      LOOP
+        old_idents := old_idents || republished_ident;
+        new_idents := new_idents || republish_collection(
+          republished_ident, NEW.submitter, NEW.submitlog);
+        PERFORM rebuild_collection_tree(republished_ident,
+                                        old_idents, new_idents);
+      END LOOP;
+    END IF;
+  END IF;
+
+  -- 5. The minor version of collections is NULL by default,
+  -- which is the correct default for modules.
+  IF NEW.minor_version IS NULL
+     AND NEW.portal_type IN ('Collection', 'SubCollection') THEN
+    NEW.minor_version := 1;
+  END IF;
+  IF NEW.version IS NULL THEN
+    NEW.version := '1.' || NEW.major_version;
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER act_10_module_publication_defaults
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE module_publication_defaults();
+
+CREATE OR REPLACE FUNCTION update_page_books()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_TABLE_NAME = 'modules' THEN
+    -- The nodes inserted before their document
+    -- (e.g. when republishing a legacy module)
+    PERFORM refresh_page_books(ARRAY(
+      SELECT nodeid FROM trees WHERE documentid = NEW.module_ident));
+  ELSE
+    PERFORM refresh_page_books(ARRAY[NEW.nodeid]);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_page_books
+  AFTER INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE update_page_books();
+""")
+    # The nodes of the legacy republications, which were inserted
+    # before their documents
+    cursor.execute("SELECT rebuild_page_books()")
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+DROP TRIGGER IF EXISTS act_10_module_uuid_default ON modules;
+DROP TRIGGER IF EXISTS act_20_module_acl_upsert ON modules;
+DROP TRIGGER IF EXISTS act_80_legacy_module_user_upsert ON modules;
+DROP TRIGGER IF EXISTS module_moduleid_default ON modules;
+DROP TRIGGER IF EXISTS module_published ON modules;
+DROP TRIGGER IF EXISTS module_version_default ON modules;
+
+DROP FUNCTION IF EXISTS republish_module();
+DROP FUNCTION IF EXISTS assign_moduleid_default();
+DROP FUNCTION IF EXISTS assign_version_default();
+DROP FUNCTION IF EXISTS assign_uuid_default();
+DROP FUNCTION IF EXISTS upsert_document_acl();
+DROP FUNCTION IF EXISTS upsert_user_shadow();
+""")
+
+
+def down(cursor):
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+CREATE OR REPLACE FUNCTION republish_module ()
+  RETURNS trigger
+AS $$
+  from cnxarchive.database import republish_module_trigger
+  return republish_module_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE OR REPLACE FUNCTION assign_moduleid_default ()
+  RETURNS TRIGGER
+AS $$
+  from cnxarchive.database import assign_moduleid_default_trigger
+  return assign_moduleid_default_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE OR REPLACE FUNCTION assign_version_default ()
+  RETURNS TRIGGER
+AS $$
+  from cnxarchive.database import assign_version_default_trigger
+  return assign_version_default_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE OR REPLACE FUNCTION assign_uuid_default ()
+  RETURNS TRIGGER
+AS $$
+  from cnxarchive.database import assign_document_controls_default_trigger
+  return assign_document_controls_default_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE OR REPLACE FUNCTION upsert_document_acl ()
+  RETURNS TRIGGER
+AS $$
+  from cnxarchive.database import upsert_document_acl_trigger
+  return upsert_document_acl_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE OR REPLACE FUNCTION upsert_user_shadow ()
+  RETURNS TRIGGER
+AS $$
+  from cnxarchive.database import upsert_users_from_legacy_publication_trigger
+  return upsert_users_from_legacy_publication_trigger(plpy, TD)
+$$ LANGUAGE plpythonu;
+
+CREATE TRIGGER act_10_module_uuid_default
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE assign_uuid_default();
+
+CREATE TRIGGER act_20_module_acl_upsert
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE upsert_document_acl();
+
+CREATE TRIGGER act_80_legacy_module_user_upsert
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE upsert_user_shadow();
+
+CREATE TRIGGER module_moduleid_default
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE assign_moduleid_default();
+
+CREATE TRIGGER module_published
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE republish_module();
+
+CREATE TRIGGER module_version_default
+  BEFORE INSERT ON modules FOR EACH ROW
+  EXECUTE PROCEDURE assign_version_default();
+""")
+    cursor.execute("""\
+DROP TRIGGER IF EXISTS act_10_module_publication_defaults ON modules;
+DROP FUNCTION IF EXISTS module_publication_defaults();
+DROP FUNCTION IF EXISTS rebuild_collection_tree(integer, integer[], integer[]);
+DROP FUNCTION IF EXISTS republish_collection(integer, text, text);
+
+DROP TRIGGER IF EXISTS update_page_books ON modules;
+CREATE OR REPLACE FUNCTION update_page_books()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_page_books(ARRAY[NEW.nodeid]);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""")
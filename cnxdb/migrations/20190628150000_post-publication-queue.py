@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Modules waiting for post-publication processing, when post_publication
+-- runs in the 'queue' cnxdb.post_publication_mode
+-- (see cnxdb.post_publication.claim_post_publications).
+CREATE TABLE post_publication_queue (
+  module_ident INTEGER PRIMARY KEY,
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+DECLARE
+  mode text;
+BEGIN
+      -- skip if this is an update that has already sent a notify that has not yet been picked up - avoid double notify
+      IF TG_OP = 'INSERT' OR ( TG_OP = 'UPDATE' AND OLD.stateid != 5 ) THEN
+            BEGIN
+              mode := current_setting('cnxdb.post_publication_mode');
+            EXCEPTION WHEN undefined_object THEN
+              mode := 'notify';
+            END;
+
+            IF mode = 'queue' THEN
+              INSERT INTO post_publication_queue (module_ident)
+                SELECT NEW.module_ident
+                WHERE NOT EXISTS (SELECT 1 FROM post_publication_queue
+                                  WHERE module_ident = NEW.module_ident);
+              PERFORM pg_notify('post_publication_queue', '');
+            ELSE
+              PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+            END IF;
+              END IF;
+              RETURN NEW;
+        END;
+$$ LANGUAGE 'plpgsql';
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+BEGIN
+      -- skip if this is an update that has already sent a notify that has not yet been picked up - avoid double notify
+      IF TG_OP = 'INSERT' OR ( TG_OP = 'UPDATE' AND OLD.stateid != 5 ) THEN
+            PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+              END IF;
+              RETURN NEW;
+        END;
+$$ LANGUAGE 'plpgsql';
+
+DROP TABLE IF EXISTS post_publication_queue;
+""")
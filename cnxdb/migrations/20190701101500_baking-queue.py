@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE baking_queue (
+  -- The modules.module_ident entering the post-publication state,
+  -- queued by the post_publication trigger when the
+  -- cnxdb.post_publication_mode setting is 'queue' (see cnxdb.baking).
+  "module_ident" INTEGER PRIMARY KEY,
+  -- Higher priorities are claimed first, e.g. new publications (1)
+  -- before rebakes (0).
+  "priority" INTEGER NOT NULL DEFAULT 0,
+  -- The number of times the job has been claimed.
+  "attempts" INTEGER NOT NULL DEFAULT 0,
+  "queued" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- A claimed job is hidden from the other consumers until this time,
+  -- after which it is claimed again (e.g. when the consumer died).
+  "visible_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- Set when a bake is requested while the job is claimed, so that
+  -- completing the job queues it again instead of removing it.
+  "requeued" BOOLEAN NOT NULL DEFAULT FALSE,
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident") ON DELETE CASCADE
+);
+
+CREATE INDEX baking_queue_priority_idx ON baking_queue (priority DESC, queued);
+
+
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+DECLARE
+  mode text;
+BEGIN
+      -- skip if this is an update that has already sent a notify that has not yet been picked up - avoid double notify
+      IF TG_OP = 'INSERT' OR ( TG_OP = 'UPDATE' AND OLD.stateid != 5 ) THEN
+            BEGIN
+              mode := current_setting('cnxdb.post_publication_mode');
+            EXCEPTION WHEN undefined_object THEN
+              mode := 'notify';
+            END;
+
+            IF mode = 'queue' THEN
+              -- A module already queued is not queued twice. A claimed
+              -- job (hidden until its visible_at) may be baking an older
+              -- state, so it is flagged to be baked again once completed.
+              -- A waiting job is given back its attempts.
+              UPDATE baking_queue
+                SET requeued = requeued OR visible_at > CURRENT_TIMESTAMP,
+                    attempts = CASE WHEN visible_at > CURRENT_TIMESTAMP
+                                    THEN attempts ELSE 0 END
+                WHERE module_ident = NEW.module_ident;
+              IF NOT FOUND THEN
+                BEGIN
+                  INSERT INTO baking_queue (module_ident, priority)
+                    VALUES (NEW.module_ident,
+                            CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE 0 END);
+                EXCEPTION WHEN unique_violation THEN
+                  -- queued by a concurrent transaction
+                  NULL;
+                END;
+              END IF;
+              PERFORM pg_notify('post_publication_queue', '');
+            ELSE
+              PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+            END IF;
+              END IF;
+              RETURN NEW;
+        END;
+$$ LANGUAGE 'plpgsql';
+
+-- baking_queue replaces post_publication_queue
+INSERT INTO baking_queue (module_ident, queued)
+  SELECT module_ident, queued FROM post_publication_queue;
+DROP TABLE IF EXISTS post_publication_queue;
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+-- Modules waiting for post-publication processing, when post_publication
+-- runs in the 'queue' cnxdb.post_publication_mode
+-- (see cnxdb.post_publication.claim_post_publications).
+CREATE TABLE post_publication_queue (
+  module_ident INTEGER PRIMARY KEY,
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+DECLARE
+  mode text;
+BEGIN
+      -- skip if this is an update that has already sent a notify that has not yet been picked up - avoid double notify
+      IF TG_OP = 'INSERT' OR ( TG_OP = 'UPDATE' AND OLD.stateid != 5 ) THEN
+            BEGIN
+              mode := current_setting('cnxdb.post_publication_mode');
+            EXCEPTION WHEN undefined_object THEN
+              mode := 'notify';
+            END;
+
+            IF mode = 'queue' THEN
+              INSERT INTO post_publication_queue (module_ident)
+                SELECT NEW.module_ident
+                WHERE NOT EXISTS (SELECT 1 FROM post_publication_queue
+                                  WHERE module_ident = NEW.module_ident);
+              PERFORM pg_notify('post_publication_queue', '');
+            ELSE
+              PERFORM pg_notify('post_publication', '{"module_ident": '||NEW.module_ident||', "ident_hash": "'||ident_hash(NEW.uuid, NEW.major_version, NEW.minor_version)||'", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+            END IF;
+              END IF;
+              RETURN NEW;
+        END;
+$$ LANGUAGE 'plpgsql';
+
+INSERT INTO post_publication_queue (module_ident, queued)
+  SELECT module_ident, queued FROM baking_queue;
+DROP TABLE IF EXISTS baking_queue;
+""")
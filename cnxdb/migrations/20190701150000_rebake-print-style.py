@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Rebakes (i.e. moves to the post-publication state) the latest version of
+-- the books using the given print style, at most ``throttle`` books per call
+-- (all of them when NULL), in one statement. Only the books after the
+-- ``after_ident`` module_ident are considered, so that the books baked
+-- (and returned to another state) in the meantime are not moved again.
+-- Returns the number of books moved, the number of books left and the
+-- module_ident to pass as ``after_ident`` to the next call, so the caller
+-- can commit between batches (see the cnx-db rebake-print-style command).
+CREATE OR REPLACE FUNCTION rebake_print_style(
+  print_style text, throttle integer DEFAULT NULL,
+  after_ident integer DEFAULT 0)
+RETURNS TABLE (rebaking integer, remaining integer, last_ident integer)
+LANGUAGE SQL AS $$
+  WITH books AS (
+    SELECT m.module_ident
+    FROM latest_modules AS lm JOIN modules AS m
+      ON m.module_ident = lm.module_ident
+    WHERE lm.print_style = $1 AND lm.portal_type = 'Collection'
+          AND m.stateid NOT IN (5, 6) AND m.module_ident > $3
+  ),
+  batch AS (
+    UPDATE modules SET stateid = 5
+    WHERE module_ident IN (
+      SELECT module_ident FROM books ORDER BY module_ident LIMIT $2)
+    RETURNING module_ident
+  )
+  SELECT (SELECT count(*) FROM batch)::integer,
+         ((SELECT count(*) FROM books) - (SELECT count(*) FROM batch))::integer,
+         coalesce((SELECT max(module_ident) FROM batch), $3)
+$$;
+
+DROP TRIGGER IF EXISTS update_latest_version ON modules;
+
+-- update_latest only acts on current and fallback states, the WHEN clause
+-- skips the function call for the other states (e.g. rebakes).
+CREATE TRIGGER update_latest_version
+  BEFORE INSERT OR UPDATE ON modules FOR EACH ROW
+  WHEN (NEW.stateid in (1, 8))
+  EXECUTE PROCEDURE update_latest();
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP FUNCTION IF EXISTS rebake_print_style(text, integer, integer);
+
+DROP TRIGGER IF EXISTS update_latest_version ON modules;
+
+CREATE TRIGGER update_latest_version
+  BEFORE INSERT OR UPDATE ON modules FOR EACH ROW
+  EXECUTE PROCEDURE update_latest();
+""")
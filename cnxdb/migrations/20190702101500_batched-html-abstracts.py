@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from dbmigrator import super_user
+
+
+# Uncomment should_run if this is a repeat migration
+# def should_run(cursor):
+#     # TODO return True if migration should run
+
+
+def up(cursor):
+    cursor.execute("""\
+-- Abstracts waiting for their HTML, with one of the modules using them,
+-- queued by the html_abstract triggers. They are transformed at the end of
+-- the statement, unless the cnxdb.html_abstract_mode setting is 'async'
+-- (see the cnx-db gen-html-abstracts command).
+CREATE TABLE html_abstract_queue (
+  abstractid INTEGER PRIMARY KEY,
+  module_ident INTEGER NOT NULL,
+  -- the transaction that queued the abstract
+  queued_by BIGINT NOT NULL DEFAULT txid_current(),
+  queued TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- failed transformations, the last error is kept
+  attempts INTEGER NOT NULL DEFAULT 0,
+  error TEXT,
+  FOREIGN KEY (abstractid) REFERENCES abstracts (abstractid) ON DELETE CASCADE,
+  FOREIGN KEY (module_ident) REFERENCES modules (module_ident) ON DELETE CASCADE
+);
+""")
+    with super_user() as super_cursor:
+        super_cursor.execute("""\
+-- Same as html_abstract(module_ident), for an abstract already at hand
+CREATE OR REPLACE FUNCTION html_abstract(abstract text, module_ident int)
+  RETURNS text
+AS $$
+  from cnxtransforms import transform_abstract_to_html
+  html_abstract, warning_messages = transform_abstract_to_html(abstract, module_ident, plpy)
+  if warning_messages:
+    plpy.warning(warning_messages)
+  return html_abstract
+$$ LANGUAGE plpythonu;
+""")
+    cursor.execute("""\
+-- Queues the abstract of the module (or of the module_files' module)
+-- when it has no HTML yet. Modules sharing an abstract queue it once.
+CREATE OR REPLACE FUNCTION queue_html_abstract ()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  abstract_id integer;
+BEGIN
+  IF TG_TABLE_NAME = 'modules' THEN
+    abstract_id := NEW.abstractid;
+  ELSE
+    SELECT abstractid INTO abstract_id
+    FROM modules WHERE module_ident = NEW.module_ident;
+  END IF;
+
+  BEGIN
+    INSERT INTO html_abstract_queue (abstractid, module_ident)
+      SELECT abstractid, NEW.module_ident FROM abstracts
+      WHERE abstractid = abstract_id AND html IS NULL
+            AND NOT EXISTS (SELECT 1 FROM html_abstract_queue
+                            WHERE abstractid = abstract_id);
+  EXCEPTION WHEN unique_violation THEN
+    -- queued by a concurrent transaction
+    NULL;
+  END;
+  RETURN NULL;
+END;
+$$ LANGUAGE PLPGSQL;
+
+-- Transforms the abstracts queued by the statement's transaction
+-- to HTML, once per abstract, unless the ``cnxdb.html_abstract_mode``
+-- setting is 'async', in which case they are left in html_abstract_queue
+-- to be transformed outside of the transaction.
+CREATE OR REPLACE FUNCTION process_html_abstracts ()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  mode text;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM html_abstract_queue) THEN
+    RETURN NULL;
+  END IF;
+
+  BEGIN
+    mode := current_setting('cnxdb.html_abstract_mode');
+  EXCEPTION WHEN undefined_object THEN
+    mode := 'sync';
+  END;
+
+  IF mode != 'async' THEN
+    WITH queued AS (
+      DELETE FROM html_abstract_queue WHERE queued_by = txid_current()
+      RETURNING abstractid, module_ident
+    )
+    UPDATE abstracts a SET html = html_abstract(a.abstract, q.module_ident)
+    FROM queued q
+    WHERE a.abstractid = q.abstractid AND a.html IS NULL;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE PLPGSQL;
+
+DROP TRIGGER IF EXISTS collection_html_abstract_trigger ON modules;
+DROP TRIGGER IF EXISTS module_html_abstract_trigger ON module_files;
+
+CREATE TRIGGER collection_html_abstract_trigger
+  AFTER INSERT OR UPDATE ON modules FOR EACH ROW
+  WHEN (new.portal_type = 'Collection'::text)
+  EXECUTE PROCEDURE queue_html_abstract();
+
+CREATE TRIGGER module_html_abstract_trigger
+  AFTER INSERT OR UPDATE ON module_files FOR EACH ROW
+  WHEN (new.filename = 'index.cnxml'::text)
+  EXECUTE PROCEDURE queue_html_abstract();
+
+CREATE TRIGGER process_html_abstracts
+  AFTER INSERT OR UPDATE ON modules FOR EACH STATEMENT
+  EXECUTE PROCEDURE process_html_abstracts();
+
+CREATE TRIGGER process_html_abstracts
+  AFTER INSERT OR UPDATE ON module_files FOR EACH STATEMENT
+  EXECUTE PROCEDURE process_html_abstracts();
+
+DROP FUNCTION IF EXISTS module_html_abstract();
+""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION module_html_abstract ()
+  RETURNS TRIGGER
+AS $$
+DECLARE
+  has_html text;
+BEGIN
+  SELECT html INTO has_html FROM abstracts a JOIN modules m ON a.abstractid = m.abstractid WHERE module_ident = NEW.module_ident;
+  IF has_html IS NULL
+    THEN
+      UPDATE abstracts SET html = html_abstract(NEW.module_ident)
+        WHERE abstractid = NEW.abstractid;
+  END IF;
+RETURN NEW;
+END;
+$$ LANGUAGE PLPGSQL;
+
+DROP TRIGGER IF EXISTS collection_html_abstract_trigger ON modules;
+DROP TRIGGER IF EXISTS module_html_abstract_trigger ON module_files;
+
+DROP TRIGGER IF EXISTS process_html_abstracts ON modules;
+DROP TRIGGER IF EXISTS process_html_abstracts ON module_files;
+
+CREATE TRIGGER collection_html_abstract_trigger
+  AFTER INSERT OR UPDATE ON modules FOR EACH ROW
+  WHEN (new.portal_type = 'Collection'::text)
+  EXECUTE PROCEDURE module_html_abstract();
+
+CREATE TRIGGER module_html_abstract_trigger
+  AFTER INSERT OR UPDATE ON module_files FOR EACH ROW
+  WHEN (new.filename = 'index.cnxml'::text)
+  EXECUTE PROCEDURE module_html_abstract();
+
+DROP FUNCTION IF EXISTS queue_html_abstract();
+DROP FUNCTION IF EXISTS process_html_abstracts();
+DROP TABLE IF EXISTS html_abstract_queue;
+""")
+    with super_user() as super_cursor:
+        super_cursor.execute(
+            "DROP FUNCTION IF EXISTS html_abstract(text, int)")
@@ -9,3 +9,4 @@
 CREATE INDEX "pending_resources_hash_idx" on "pending_resources" ("hash");
 CREATE INDEX "pending_documents_ident_hash" on pending_documents (ident_hash(uuid, major_version, minor_version));
 CREATE INDEX document_baking_result_associations_module_ident_fkey ON document_baking_result_associations (module_ident);
+CREATE INDEX baking_queue_priority_idx ON baking_queue (priority DESC, queued);
@@ -121,3 +121,24 @@ CREATE TABLE document_baking_result_associations (
   PRIMARY KEY ("module_ident", "result_id"),
   FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident") ON DELETE CASCADE
 );
+
+
+CREATE TABLE baking_queue (
+  -- The modules.module_ident entering the post-publication state,
+  -- queued by the post_publication trigger when the
+  -- cnxdb.post_publication_mode setting is 'queue' (see cnxdb.baking).
+  "module_ident" INTEGER PRIMARY KEY,
+  -- Higher priorities are claimed first, e.g. new publications (1)
+  -- before rebakes (0).
+  "priority" INTEGER NOT NULL DEFAULT 0,
+  -- The number of times the job has been claimed.
+  "attempts" INTEGER NOT NULL DEFAULT 0,
+  "queued" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- A claimed job is hidden from the other consumers until this time,
+  -- after which it is claimed again (e.g. when the consumer died).
+  "visible_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- Set when a bake is requested while the job is claimed, so that
+  -- completing the job queues it again instead of removing it.
+  "requeued" BOOLEAN NOT NULL DEFAULT FALSE,
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident") ON DELETE CASCADE
+);
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Registry of the archive-sql queries, executed as server-side
+prepared statements.
+
+The ``cnxdb/archive-sql/get-*.sql`` and ``query-*.sql`` files are read
+once, when this module is imported. Each query is registered by its
+filename without the ``.sql`` extension (e.g. ``get-module``).
+The search queries, which are assembled from templates, are not included.
+
+"""
+import os
+import re
+import threading
+import time
+import weakref
+
+import psycopg2
+
+
+here = os.path.abspath(os.path.dirname(__file__))
+ARCHIVE_SQL_DIR = os.path.join(here, 'archive-sql')
+
+#: Matches the psycopg2 placeholders and escaped percent signs
+PLACEHOLDER_PATTERN = re.compile(r'%\((\w+)\)s|%s|%%')
+#: Matches the python format fields used by the query templates
+TEMPLATE_FIELD_PATTERN = re.compile(r'\{\w*\}')
+
+
+def _to_server_side(sql):
+    """Converts psycopg2 placeholders to numbered (``$1``) parameters.
+
+    :param str sql: query using ``%(name)s`` or ``%s`` placeholders
+    :return: the converted query and the list of parameter keys,
+        the names or positions of the placeholders
+    :rtype: tuple
+
+    """
+    keys = []
+
+    def replace(match):
+        text = match.group(0)
+        if text == '%%':
+            return '%'
+        key = match.group(1)
+        if key is None:
+            key = len(keys)
+        elif key in keys:
+            return '${}'.format(keys.index(key) + 1)
+        keys.append(key)
+        return '${}'.format(len(keys))
+
+    return PLACEHOLDER_PATTERN.sub(replace, sql), keys
+
+
+class Query(object):
+    """A registered query"""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.statement_name = 'cnxdb_{}'.format(re.sub(r'\W', '_', name))
+        self.server_side_sql, self.keys = _to_server_side(
+            sql.strip().rstrip(';'))
+        #: False when the statement can't be prepared (e.g. the parameter
+        #: types can't be determined), in which case it runs as plain text.
+        self.is_preparable = True
+        self.calls = 0
+        self.total_time = 0.0
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+    def ordered_params(self, params):
+        if params is None:
+            params = ()
+        return [params[key] for key in self.keys]
+
+
+class QueryRegistry(object):
+    """Loads the queries in ``directory`` and executes them as
+    server-side prepared statements, which are prepared once per
+    connection, so the query plans can be reused across calls.
+
+    :param str directory: directory of ``.sql`` files
+
+    """
+
+    def __init__(self, directory=ARCHIVE_SQL_DIR):
+        self.queries = {}
+        # connection -> set of prepared statement names
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        for filename in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(filename)
+            if ext != '.sql' or not name.startswith(('get-', 'query-')):
+                continue
+            with open(os.path.join(directory, filename), 'r') as fb:
+                sql = fb.read()
+            if TEMPLATE_FIELD_PATTERN.search(sql):
+                continue
+            self.queries[name] = Query(name, sql)
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def __getitem__(self, name):
+        return self.queries[name]
+
+    def _prepare(self, cursor, query):
+        """Prepares the query on the cursor's connection.
+        Returns False when the query can't be prepared.
+
+        """
+        conn = cursor.connection
+        in_transaction = not conn.autocommit
+        if in_transaction:
+            cursor.execute('SAVEPOINT cnxdb_prepare')
+        try:
+            cursor.execute('PREPARE {} AS {}'.format(
+                query.statement_name, query.server_side_sql))
+        except psycopg2.ProgrammingError:
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT cnxdb_prepare')
+            query.is_preparable = False
+            return False
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT cnxdb_prepare')
+        with self._lock:
+            self._prepared.setdefault(conn, set()).add(query.name)
+        return True
+
+    def execute(self, cursor, name, params=None):
+        """Executes the named query using the given cursor.
+        The results are fetched from the cursor as usual.
+
+        :param cursor: database cursor
+        :param str name: name of the query (e.g. ``get-module``)
+        :param params: mapping of named parameters or sequence of
+            positional parameters, as used in the query file
+        :return: the cursor
+
+        """
+        query = self.queries[name]
+        start = time.time()
+        if query.is_preparable:
+            prepared = self._prepared.get(cursor.connection, ())
+            if query.name not in prepared:
+                self._prepare(cursor, query)
+        if query.is_preparable:
+            params = query.ordered_params(params)
+            placeholders = ', '.join(['%s'] * len(params))
+            if placeholders:
+                placeholders = ' ({})'.format(placeholders)
+            statement = 'EXECUTE {}{}'.format(query.statement_name,
+                                              placeholders)
+            cursor.execute(statement, params)
+        else:
+            cursor.execute(query.sql, params)
+        with self._lock:
+            query.calls += 1
+            query.total_time += time.time() - start
+        return cursor
+
+    def deallocate(self, connection):
+        """Forget the statements prepared on the given connection,
+        e.g. after running ``DISCARD ALL`` on it.
+
+        """
+        with self._lock:
+            self._prepared.pop(connection, None)
+
+    @property
+    def stats(self):
+        """Per query call counts and the total time spent in seconds
+
+        :rtype: dict
+
+        """
+        return dict(
+            (name, {'calls': query.calls, 'total_time': query.total_time})
+            for name, query in self.queries.items()
+        )
+
+    def reset_stats(self):
+        with self._lock:
+            for query in self.queries.values():
+                query.calls = 0
+                query.total_time = 0.0
+
+
+#: The registry of the ``cnxdb/archive-sql`` queries
+archive_queries = QueryRegistry()
+
+
+def execute(cursor, name, params=None):
+    """Executes the named archive-sql query.
+    See :meth:`QueryRegistry.execute`.
+
+    """
+    return archive_queries.execute(cursor, name, params)
+
+
+__all__ = (
+    'archive_queries',
+    'execute',
+    'Query',
+    'QueryRegistry',
+)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Claiming batches of the rows of the queue tables
+
+PostgreSQL 9.4 has no ``FOR UPDATE SKIP LOCKED``. Instead, each claimed
+row is locked with ``pg_try_advisory_xact_lock``, keyed by the queue's
+table name and the row's key, so that concurrent consumers skip the rows
+claimed by the others without waiting on them. The locks are released
+at the end of the consumer's transaction.
+
+"""
+
+# The outer LIMIT stops the scan, so only the returned rows are locked.
+CLAIM_BATCH = """\
+SELECT {key}
+FROM (SELECT {key} FROM {table}
+      WHERE {where}
+      ORDER BY {order_by} LIMIT %(candidates)s) AS candidates
+WHERE pg_try_advisory_xact_lock(hashtext('{table}'), {key})
+LIMIT %(limit)s"""
+
+#: Number of candidates scanned per row to claim, so that the rows
+#: locked by the other consumers are looked past
+CANDIDATES_PER_ROW = 4
+
+
+def claim_batch_sql(table, key, order_by, where='TRUE'):
+    """Builds the query selecting the keys of a batch of the rows
+    of a queue table, and locking them for the transaction. The query
+    is meant to be used as is or as a subquery (e.g. of a ``DELETE``
+    or ``UPDATE`` of the claimed rows), with the parameters from
+    :func:`claim_batch_params`.
+
+    :param str table: the queue table
+    :param str key: the integer column identifying the rows
+    :param str order_by: the order in which the rows are claimed
+    :param str where: condition on the rows that can be claimed
+    :return: the query
+    :rtype: str
+
+    """
+    return CLAIM_BATCH.format(table=table, key=key, order_by=order_by,
+                              where=where)
+
+
+def claim_batch_params(batch_size, **params):
+    """Builds the parameters of a query from :func:`claim_batch_sql`,
+    along with any of the query's own ``params``.
+
+    :param int batch_size: maximum number of rows to claim
+    :return: the query parameters
+    :rtype: dict
+
+    """
+    params.update(candidates=batch_size * CANDIDATES_PER_ROW,
+                  limit=batch_size)
+    return params
+
+
+__all__ = (
+    'claim_batch_params',
+    'claim_batch_sql',
+)
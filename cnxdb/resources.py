@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Streaming access to resources (the content of ``files``)"""
+import hashlib
+from collections import namedtuple
+
+import psycopg2
+
+from cnxdb.queries import archive_queries
+
+
+#: Default number of bytes read per query
+CHUNK_SIZE = 1024 * 1024
+
+#: Information about a file, resolved without reading its content
+ResourceInfo = namedtuple('ResourceInfo', 'fileid media_type size sha1')
+
+
+FIND_FILEID = "SELECT fileid FROM files WHERE sha1 = %s"
+GET_OR_INSERT_FILE = "SELECT get_or_insert_file(%s, %s)"
+
+
+def _fetch_info(cursor):
+    row = cursor.fetchone()
+    return row is not None and ResourceInfo(*row) or None
+
+
+def get_resource_info(cursor, id, version, filename):
+    """Resolves a module's file to its resource info.
+
+    :param cursor: database cursor
+    :param str id: uuid of the module
+    :param str version: version of the module (e.g. ``1.2`` or ``3``)
+    :param str filename: name of the file within the module
+    :return: the resource info or ``None`` when not found
+    :rtype: :class:`ResourceInfo`
+
+    """
+    archive_queries.execute(cursor, 'get-resource-info-by-filename',
+                            {'id': id, 'version': version,
+                             'filename': filename})
+    return _fetch_info(cursor)
+
+
+def get_resource_info_by_hash(cursor, hash):
+    """Resolves a file hash (sha1 or md5) to its resource info.
+
+    :param cursor: database cursor
+    :param str hash: sha1 or md5 hash of the file
+    :return: the resource info or ``None`` when not found
+    :rtype: :class:`ResourceInfo`
+
+    """
+    archive_queries.execute(cursor, 'get-resource-info', {'hash': hash})
+    return _fetch_info(cursor)
+
+
+def read_resource(cursor, fileid, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Reads the content of a file in chunks of at most ``chunk_size``
+    bytes, so no more than one chunk is held in memory at a time.
+    ``start`` and ``end`` select a byte range of the file, as given by an
+    HTTP range request (e.g. ``bytes=0-499`` is ``start=0, end=500``).
+
+    :param cursor: database cursor
+    :param int fileid: id of the file (see :func:`get_resource_info`)
+    :param int start: zero based offset of the first byte to read
+    :param int end: offset after the last byte to read, defaults to
+        the end of the file
+    :param int chunk_size: number of bytes to read per query
+    :return: generator of ``bytes`` chunks
+
+    """
+    offset = start
+    while end is None or offset < end:
+        length = chunk_size
+        if end is not None:
+            length = min(length, end - offset)
+        archive_queries.execute(cursor, 'get-resource-chunk',
+                                {'fileid': fileid, 'offset': offset,
+                                 'length': length})
+        row = cursor.fetchone()
+        if row is None or not row[0]:
+            break
+        chunk = bytes(row[0])
+        yield chunk
+        if len(chunk) < length:
+            break
+        offset += len(chunk)
+
+
+def store_resource(cursor, content, media_type):
+    """Stores the file content, unless a file with the same content
+    (sha1) already exists. The hash is computed here, so the content is
+    only sent to the database when it isn't already stored.
+
+    :param cursor: database cursor
+    :param bytes content: content of the file
+    :param str media_type: media type of the file
+    :return: the fileid of the stored or existing file
+    :rtype: int
+
+    """
+    cursor.execute(FIND_FILEID, (hashlib.sha1(content).hexdigest(),))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(GET_OR_INSERT_FILE,
+                       (psycopg2.Binary(content), media_type))
+        row = cursor.fetchone()
+    return row[0]
+
+
+__all__ = (
+    'CHUNK_SIZE',
+    'get_resource_info',
+    'get_resource_info_by_hash',
+    'read_resource',
+    'ResourceInfo',
+    'store_resource',
+)
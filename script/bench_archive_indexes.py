@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+This script reports the plans of the archive queries affected by the
+``trees_parent_id_idx`` and ``latest_modules_searchable_idx`` indexes,
+without (before) and with (after) those indexes.
+
+1. Use `DB_URL=postgresql://... ./bench_archive_indexes.py <ident_hash>`
+   to run it against a database with published content (e.g. a restored
+   dump), where `<ident_hash>` is the ident hash of a book.
+
+2. The "before" plans are taken in a transaction that drops the indexes,
+   which is rolled back, so nothing is changed. The output is the
+   `EXPLAIN ANALYZE` of each query, before and after.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+import psycopg2
+
+from cnxdb.queries import archive_queries
+
+
+DB_URL = os.getenv('DB_URL')
+
+INDEXES = ('trees_parent_id_idx', 'latest_modules_searchable_idx')
+
+SEARCHABLE = """\
+SELECT lm.module_ident, lm.name
+FROM latest_modules AS lm NATURAL JOIN modulefti AS mfti
+WHERE lm.portal_type not in  ('CompositeModule','SubCollection')"""
+
+DELETE_TREE = """\
+DELETE FROM trees
+WHERE parent_id IS NULL AND documentid = (
+  SELECT module_ident FROM modules
+  WHERE ident_hash(uuid, major_version, minor_version) = %(ident_hash)s)"""
+
+
+def explain(cursor, title, query, params):
+    cursor.execute('EXPLAIN ANALYZE ' + query, params)
+    print('-- {}'.format(title))
+    for row in cursor.fetchall():
+        print(row[0])
+    print()
+
+
+def report(cursor, when, ident_hash):
+    queries = (
+        ('get-book-core-info',
+         archive_queries['get-book-core-info'].sql.strip().rstrip(';'),
+         {'ident_hash': ident_hash, 'is_collated': False}),
+        ('search results filter', SEARCHABLE, None),
+        ('tree delete cascade', DELETE_TREE, {'ident_hash': ident_hash}),
+    )
+    for title, query, params in queries:
+        cursor.execute('SAVEPOINT explain')
+        explain(cursor, '{}, {}'.format(title, when), query, params)
+        cursor.execute('ROLLBACK TO SAVEPOINT explain')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    if not argv:
+        sys.stderr.write('usage: bench_archive_indexes.py <ident_hash>\n')
+        return 1
+    ident_hash = argv[0]
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            for index in INDEXES:
+                cursor.execute('DROP INDEX IF EXISTS {}'.format(index))
+            report(cursor, 'before', ident_hash)
+            db_conn.rollback()
+            report(cursor, 'after', ident_hash)
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+This script compares the previous (plpgsql loop and ``generate_series``)
+and the current (single pass ``unnest``, or the builtin on
+PostgreSQL >= 9.5) implementations of ``array_position`` and ``idx``
+on large author arrays.
+
+1. Use `DB_URL=postgresql://... ./bench_array_position.py` to run it
+   against an initialized database.
+
+   1.1 The optional first argument is the number of authors in the array
+       (default 1000) and the second the number of lookups (default 1000).
+
+2. The previous implementations are created as temporary functions, so
+   nothing is left behind. The output is the time taken by each
+   implementation to find every position of the array.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SETUP = """\
+CREATE FUNCTION pg_temp.array_position_plpgsql (ANYARRAY, ANYELEMENT)
+RETURNS INTEGER
+IMMUTABLE STRICT
+LANGUAGE PLPGSQL
+AS $$
+BEGIN
+  for i in array_lower($1,1) .. array_upper($1,1)
+  LOOP
+    IF ($1[i] = $2)
+    THEN
+      RETURN i;
+    END IF;
+  END LOOP;
+  RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION pg_temp.idx_generate_series(anyarray, anyelement)
+  RETURNS INT AS
+$$
+  SELECT i FROM (
+     SELECT generate_series(array_lower($1,1),array_upper($1,1))
+  ) g(i)
+  WHERE $1[i] = $2
+  LIMIT 1;
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE TEMPORARY TABLE bench_authors AS
+  SELECT array_agg('author' || i ORDER BY i) AS authors
+  FROM generate_series(1, %(authors)s) AS i;
+"""
+
+FUNCTIONS = (
+    ('array_position, previous', 'pg_temp.array_position_plpgsql'),
+    ('idx, previous', 'pg_temp.idx_generate_series'),
+    ('array_position', 'array_position'),
+    ('idx', 'idx'),
+)
+
+LOOKUP = """\
+SELECT sum({}(authors, 'author' || (1 + i %% %(authors)s)))
+FROM bench_authors, generate_series(1, %(lookups)s) AS i"""
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    params = {
+        'authors': int(argv[0]) if argv else 1000,
+        'lookups': int(argv[1]) if len(argv) > 1 else 1000,
+    }
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(SETUP, params)
+            for title, function in FUNCTIONS:
+                start = time.time()
+                cursor.execute(LOOKUP.format(function), params)
+                total = cursor.fetchone()[0]
+                print('{}: {:.3f}s (checksum {})'.format(
+                    title, time.time() - start, total))
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
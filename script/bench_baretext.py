@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+This script compares the XSLT (``xml_to_baretext``) and lxml
+(``xml_to_baretext_lxml``) fulltext text extractors on the pages
+already in a database, checking that both produce the same text.
+
+1. Use `DB_URL=postgresql://... ./bench_baretext.py` to run it against a
+   database with published content (e.g. a restored dump or a database
+   loaded using `dump_book.py`).
+
+   1.1 The optional first argument is the number of pages to sample
+       (default 200). Pass book ident hashes as further arguments
+       to only use the pages of those books.
+
+2. The output is the total time spent in each extractor and the pages,
+   if any, where the extracted text differs.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SAMPLE_PAGES = """\
+SELECT mf.module_ident, mf.fileid
+FROM module_files AS mf
+WHERE mf.filename = 'index.cnxml.html'
+ORDER BY random()
+LIMIT %(limit)s"""
+
+SAMPLE_BOOK_PAGES = """\
+SELECT p.module_ident, mf.fileid
+FROM modules AS m,
+     LATERAL book_pages(m.uuid, module_version(m.major_version,
+                                               m.minor_version), false) AS p
+     JOIN module_files AS mf ON (mf.module_ident = p.module_ident)
+WHERE ident_hash(m.uuid, m.major_version, m.minor_version) = ANY (%(books)s)
+      AND mf.filename = 'index.cnxml.html'
+LIMIT %(limit)s"""
+
+EXTRACTORS = (
+    ('xslt', """\
+SELECT xml_to_baretext(convert_from(file, 'UTF8')::xml)::text
+FROM files WHERE fileid = %s"""),
+    ('lxml', """\
+SELECT xml_to_baretext_lxml(file) FROM files WHERE fileid = %s"""),
+)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    limit = int(argv[0]) if argv else 200
+    books = argv[1:]
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            if books:
+                cursor.execute(SAMPLE_BOOK_PAGES,
+                               {'books': books, 'limit': limit})
+            else:
+                cursor.execute(SAMPLE_PAGES, {'limit': limit})
+            pages = cursor.fetchall()
+
+            timings = dict((name, 0.0) for name, query in EXTRACTORS)
+            differences = []
+            for module_ident, fileid in pages:
+                results = {}
+                for name, query in EXTRACTORS:
+                    start = time.time()
+                    cursor.execute(query, (fileid,))
+                    results[name] = cursor.fetchone()[0]
+                    timings[name] += time.time() - start
+                if results['xslt'] != results['lxml']:
+                    differences.append(module_ident)
+
+    print('pages: {}'.format(len(pages)))
+    for name, query in EXTRACTORS:
+        print('{}: {:.3f}s'.format(name, timings[name]))
+    for module_ident in differences:
+        print('differs: module_ident {}'.format(module_ident))
+    return differences and 2 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
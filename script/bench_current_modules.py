@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+This script compares the previous (correlated ``max()`` subqueries) and the
+current (``DISTINCT ON``) formulations of the ``current_modules`` view on a
+synthetic 1M row copy of the versioning columns of ``modules``.
+
+1. Use `DB_URL=postgresql://... ./bench_current_modules.py` to run it.
+
+   1.1 The optional first argument is the number of rows to generate
+       (default 1000000). Each uuid gets ten versions.
+
+2. Everything is created in temporary tables, so nothing is left behind.
+   The output is the `EXPLAIN ANALYZE` of each formulation, for the whole
+   view and for the single uuid lookup done by the `delete_from_latest`
+   trigger.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SETUP = """\
+CREATE TEMPORARY TABLE bench_modules AS
+  SELECT i AS module_ident,
+         md5((i / 10)::text)::uuid AS uuid,
+         'm' || (i / 10) AS moduleid,
+         1 + (i %% 10) / 3 AS major_version,
+         CASE WHEN i %% 2 = 0 THEN NULL ELSE i %% 10 END AS minor_version,
+         CASE WHEN i %% 7 = 0 THEN 6 ELSE 1 END AS stateid
+  FROM generate_series(1, %(rows)s) AS i;
+CREATE INDEX ON bench_modules (uuid);
+CREATE INDEX ON bench_modules (moduleid);
+CREATE INDEX ON bench_modules
+  (uuid, major_version DESC NULLS LAST, minor_version DESC NULLS LAST);
+ANALYZE bench_modules;
+"""
+
+PREVIOUS = """\
+WITH latest_idents (module_ident) AS (
+  SELECT module_ident FROM bench_modules m2
+  WHERE m2.major_version = (
+          SELECT max(major_version) FROM bench_modules m3
+          WHERE m2.uuid = m3.uuid)
+        AND (m2.minor_version IS NULL OR
+             m2.minor_version = (
+               SELECT max(minor_version) FROM bench_modules m4
+               WHERE m2.uuid = m4.uuid
+                     AND m2.major_version = m4.major_version))
+        AND m2.stateid in (1, 8))
+SELECT m.* FROM latest_idents li JOIN bench_modules m
+  ON m.module_ident = li.module_ident"""
+
+CURRENT = """\
+SELECT m.* FROM (
+    SELECT DISTINCT ON (uuid) uuid, major_version, minor_version
+    FROM bench_modules
+    ORDER BY uuid, major_version DESC NULLS LAST,
+             minor_version DESC NULLS LAST) AS lv
+  JOIN bench_modules m ON m.uuid = lv.uuid
+       AND m.major_version = lv.major_version
+       AND (m.minor_version IS NULL OR m.minor_version = lv.minor_version)
+WHERE m.stateid in (1, 8)"""
+
+
+def explain(cursor, title, query):
+    cursor.execute('EXPLAIN ANALYZE ' + query)
+    print('-- {}'.format(title))
+    for row in cursor.fetchall():
+        print(row[0])
+    print()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    rows = int(argv[0]) if argv else 1000000
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(SETUP, {'rows': rows})
+            lookup = "SELECT * FROM ({}) AS v WHERE moduleid = 'm42'"
+            for title, query in (('previous', PREVIOUS),
+                                 ('current', CURRENT)):
+                explain(cursor, title + ', whole view', query)
+                explain(cursor, title + ', moduleid lookup',
+                        lookup.format(query))
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
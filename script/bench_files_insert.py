@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+This script measures bulk ``files`` insert throughput with the previous
+(plpythonu ``hashlib``) and the current (plpgsql on pgcrypto ``digest``)
+implementations of the ``update_sha1`` trigger.
+
+1. Use `DB_URL=postgresql://... ./bench_files_insert.py` to run it against
+   an initialized database (the pgcrypto extension and plpythonu language
+   must be installed).
+
+   1.1 The optional first argument is the number of rows to insert
+       (default 20000) and the second the size of each file in bytes
+       (default 4096).
+
+2. Everything is created in temporary tables, so nothing is left behind.
+   The output is the rows per second of each implementation.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SETUP = """\
+CREATE TEMPORARY TABLE bench_files (
+  fileid SERIAL PRIMARY KEY,
+  md5 text,
+  sha1 text,
+  file bytea
+);
+
+CREATE FUNCTION pg_temp.update_sha1_plpython()
+    RETURNS TRIGGER
+AS $$
+    import hashlib
+
+    TD['new']['sha1'] = hashlib.new('sha1', TD['new']['file']).hexdigest()
+    return 'MODIFY'
+$$ LANGUAGE plpythonu;
+"""
+
+TRIGGERS = (
+    ('plpythonu', 'pg_temp.update_sha1_plpython'),
+    ('pgcrypto', 'update_sha1'),
+)
+
+INSERT = """\
+INSERT INTO bench_files (file)
+SELECT convert_to(repeat(md5(i::text), %(size)s / 32 + 1), 'UTF8')
+FROM generate_series(1, %(rows)s) AS i"""
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    rows = int(argv[0]) if argv else 20000
+    size = int(argv[1]) if len(argv) > 1 else 4096
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(SETUP)
+            for title, function in TRIGGERS:
+                cursor.execute(
+                    "CREATE TRIGGER bench_sha1 BEFORE INSERT ON bench_files "
+                    "FOR EACH ROW EXECUTE PROCEDURE {}()".format(function))
+                start = time.time()
+                cursor.execute(INSERT, {'rows': rows, 'size': size})
+                elapsed = time.time() - start
+                print('{}: {} rows in {:.3f}s ({:.0f} rows/s)'.format(
+                    title, rows, elapsed, rows / elapsed))
+                cursor.execute("DROP TRIGGER bench_sha1 ON bench_files; "
+                               "TRUNCATE bench_files")
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
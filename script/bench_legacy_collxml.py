@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+This script compares the previous (per node ``legacy_module`` and
+``legacy_subcol`` calls) and the current (flattened tree) implementations
+of ``legacy_content``, which generates the content of ``collection.xml``,
+and checks that both produce the same output.
+
+1. Use `DB_URL=postgresql://... ./bench_legacy_collxml.py` to run it
+   against a database with published content (e.g. a restored dump).
+
+   1.1 The optional first argument is the module_ident of the collection
+       to use, by default the collection with the largest tree
+       (e.g. a book of 1,000 nodes). The optional second argument is
+       the number of times to generate it (default 10).
+
+2. The previous implementation is created as temporary functions, so
+   nothing is left behind. The output is the time taken by each
+   implementation.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SETUP = """\
+SET LOCAL check_function_bodies = false;
+
+CREATE FUNCTION pg_temp.legacy_subcol(nodeid int, repo text)
+RETURNS xml
+LANGUAGE SQL
+AS
+$$
+SELECT
+    xmlelement(name "col:subcollection",
+    xmlelement(name "md:title", COALESCE (t.title, m.name)),
+    pg_temp.legacy_content(legacy_subcol.nodeid, legacy_subcol.repo)
+    )
+
+    FROM trees t JOIN modules m on t.documentid = module_ident
+    WHERE t.nodeid = legacy_subcol.nodeid
+$$;
+
+CREATE FUNCTION pg_temp.legacy_content(nodeid int, repo text)
+RETURNS xml
+LANGUAGE SQL
+AS
+$$
+SELECT
+    xmlelement(name "col:content",
+    (SELECT xmlagg(
+            CASE WHEN c.portal_type in ('Module','CompositeModule')
+                THEN legacy_module(c.nodeid, legacy_content.repo)
+                WHEN c.portal_type in ('SubCollection',
+                                       'CompositeSubCollection')
+                THEN pg_temp.legacy_subcol(c.nodeid, legacy_content.repo)
+            END)
+            FROM (SELECT nodeid, portal_type FROM trees t JOIN modules m
+                ON t.documentid = m.module_ident
+                WHERE parent_id = legacy_content.nodeid
+                ORDER BY childorder) AS c
+            )
+        )
+$$;
+"""
+
+ROOT_NODES = """\
+SELECT r.nodeid, (WITH RECURSIVE t AS (
+                    SELECT r.nodeid
+                  UNION ALL
+                    SELECT c.nodeid FROM trees c
+                    JOIN t ON c.parent_id = t.nodeid
+                  ) SELECT count(*) FROM t)
+FROM trees AS r
+WHERE r.parent_id IS NULL AND NOT r.is_collated
+      AND (%(ident)s IS NULL OR r.documentid = %(ident)s)
+ORDER BY 2 DESC
+LIMIT 1"""
+
+IMPLEMENTATIONS = (
+    ('previous', "SELECT pg_temp.legacy_content(%s, 'repo')::text"),
+    ('current', "SELECT legacy_content(%s, 'repo')::text"),
+)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    ident = int(argv[0]) if argv else None
+    times = int(argv[1]) if len(argv) > 1 else 10
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(SETUP)
+            cursor.execute(ROOT_NODES, {'ident': ident})
+            nodeid, size = cursor.fetchone()
+            print('tree nodes: {}'.format(size))
+
+            outputs = {}
+            for title, query in IMPLEMENTATIONS:
+                start = time.time()
+                for i in range(times):
+                    cursor.execute(query, (nodeid,))
+                    outputs[title] = cursor.fetchone()[0]
+                print('{}: {:.3f}s'.format(title, time.time() - start))
+        db_conn.rollback()
+
+    if outputs['previous'] != outputs['current']:
+        print('outputs differ')
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+This script measures the ``modules`` insert throughput of legacy and
+cnx-publishing style publications, which run the publication defaults
+triggers (see ``act_10_module_publication_defaults``) on every row.
+
+1. Use `DB_URL=postgresql://... ./bench_publish.py` to run it against
+   an initialized database.
+
+   1.1 The optional first argument is the number of pages to publish
+       (default 300, about the size of a book).
+
+2. The publications are rolled back, so nothing is left behind.
+   The output is the rows per second of each publication style.
+   Run it before and after a trigger change to compare them.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+LICENSEID = "SELECT max(licenseid) FROM licenses"
+
+PUBLICATIONS = (
+    # Legacy supplies the moduleid and version, but not the uuid.
+    ('legacy', """\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid,
+                     doctype, authors, maintainers, licensors,
+                     submitter, submitlog)
+SELECT 'Module', 'm' || (900000 + i), '1.1', 'bench ' || i,
+       %(licenseid)s, '', ARRAY['bench'], ARRAY['bench'], ARRAY['bench'],
+       'bench', 'bench'
+FROM generate_series(1, %(rows)s) AS i"""),
+    # cnx-publishing supplies the uuid, from document_controls.
+    ('cnx-publishing', """\
+WITH controls AS (
+  INSERT INTO document_controls (licenseid)
+  SELECT %(licenseid)s FROM generate_series(1, %(rows)s)
+  RETURNING uuid
+)
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype,
+                     authors, maintainers, licensors, submitter, submitlog)
+SELECT 'Module', uuid, 'bench', %(licenseid)s, '',
+       ARRAY['bench'], ARRAY['bench'], ARRAY['bench'], 'bench', 'bench'
+FROM controls"""),
+)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    rows = int(argv[0]) if argv else 300
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(LICENSEID)
+            licenseid = cursor.fetchone()[0]
+            for title, query in PUBLICATIONS:
+                start = time.time()
+                cursor.execute(query, {'rows': rows, 'licenseid': licenseid})
+                elapsed = time.time() - start
+                print('{}: {} rows in {:.3f}s ({:.0f} rows/s)'.format(
+                    title, rows, elapsed, rows / elapsed))
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
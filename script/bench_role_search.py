@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+This script compares the role (author, maintainer, ...) search part query
+shapes on a synthetic 100k user table, with and without the trigram and
+array gin indexes.
+
+1. Use `DB_URL=postgresql://... ./bench_role_search.py` to run it against a
+   database that has the `pg_trgm` extension installed.
+
+   1.1 The optional first argument is the number of users to generate
+       (default 100000) and the optional second argument is the search term
+       (default 'smith').
+
+2. Everything is created in temporary tables, so nothing is left behind.
+   The output is the `EXPLAIN ANALYZE` of each query shape.
+
+**Note**: strictly for development use only.
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+import psycopg2
+
+
+DB_URL = os.getenv('DB_URL')
+
+SETUP = """\
+CREATE TEMPORARY TABLE bench_users AS
+  SELECT 'user' || i AS username,
+         'first' || (i %% 5000) AS first_name,
+         CASE WHEN i %% 1000 = 0 THEN 'smith' ELSE 'last' || i END
+           AS last_name,
+         'first' || (i %% 5000) || ' last' || i AS full_name
+  FROM generate_series(1, %(users)s) AS i;
+CREATE TEMPORARY TABLE bench_modules AS
+  SELECT i AS module_ident,
+         ARRAY['user' || (i * 7 %% %(users)s), 'user' || i] AS authors
+  FROM generate_series(1, %(users)s) AS i;
+ANALYZE bench_users;
+ANALYZE bench_modules;
+"""
+
+INDEXES = """\
+CREATE INDEX ON bench_users USING gin(first_name gin_trgm_ops);
+CREATE INDEX ON bench_users USING gin(last_name gin_trgm_ops);
+CREATE INDEX ON bench_users USING gin(full_name gin_trgm_ops);
+CREATE INDEX ON bench_users USING gin(username gin_trgm_ops);
+CREATE INDEX ON bench_modules USING gin(authors);
+ANALYZE bench_users;
+ANALYZE bench_modules;
+"""
+
+USER_FILTER = """\
+(u.first_name ~* %(term)s OR u.last_name ~* %(term)s
+ OR u.full_name ~* %(term)s OR u.username ~* %(term)s)"""
+
+# The shape used by the search parts before the trigram indexes were added.
+OLD_QUERY = """\
+SELECT module_ident FROM bench_modules AS m, bench_users AS u
+WHERE u.username = ANY (m.authors) AND {}""".format(USER_FILTER)
+
+# The shape used by the search parts now.
+NEW_QUERY = """\
+SELECT module_ident
+FROM (SELECT username FROM bench_users AS u WHERE {}) AS u
+     JOIN bench_modules AS m ON m.authors @> ARRAY[u.username]
+""".format(USER_FILTER)
+
+
+def explain(cursor, title, query, term):
+    cursor.execute('EXPLAIN ANALYZE ' + query, {'term': term})
+    print('-- {}'.format(title))
+    for row in cursor.fetchall():
+        print(row[0])
+    print()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not DB_URL:
+        sys.stderr.write('DB_URL must be set\n')
+        return 1
+    users = int(argv[0]) if argv else 100000
+    term = argv[1] if len(argv) > 1 else 'smith'
+
+    with psycopg2.connect(DB_URL) as db_conn:
+        with db_conn.cursor() as cursor:
+            cursor.execute(SETUP, {'users': users})
+            explain(cursor, 'old query, no indexes', OLD_QUERY, term)
+            explain(cursor, 'new query, no indexes', NEW_QUERY, term)
+            cursor.execute(INDEXES)
+            explain(cursor, 'old query, with indexes', OLD_QUERY, term)
+            explain(cursor, 'new query, with indexes', NEW_QUERY, term)
+        db_conn.rollback()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
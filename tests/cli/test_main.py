@@ -122,3 +122,223 @@ def test_venv_without_env_vars(capsys, mocker):
     expected_msg = ("'DB_URL' environment variable "
                     "OR the 'db.common.url' setting MUST be defined\n")
     assert expected_msg in capsys.readouterr()
+
+
+@pytest.mark.skipif(testing.is_py3(),
+                    reason="triggers are only python2.x compat")
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_ingest_hits(capsys, tmpdir, db_env_vars, db_engines):
+    conn = db_engines['common'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, name, licenseid, doctype)
+VALUES ('Module', 'Hits', 11, '')
+RETURNING module_ident""")
+        module_ident = cursor.fetchone()[0]
+    conn.commit()
+    hits_file = tmpdir.join('hits.csv')
+    hits_file.write('ident,start,end,hits\n'
+                    '{},2019-01-01,2019-01-02,3\n'.format(module_ident))
+
+    from cnxdb.cli.main import main
+    args = ['ingest-hits', '--header', str(hits_file)]
+
+    return_code = main(args)
+    assert return_code == 0
+    assert 'Loaded 1 hits' in capsys.readouterr()[0]
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT documentid, hits FROM document_hits")
+        assert cursor.fetchall() == [(module_ident, 3)]
+    conn.close()
+
+
+@pytest.mark.skipif(testing.is_py3(),
+                    reason="triggers are only python2.x compat")
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_ingest_hits_malformed(capsys, tmpdir, db_env_vars, db_engines):
+    conn = db_engines['common'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, name, licenseid, doctype)
+VALUES ('Module', 'Hits', 11, '')
+RETURNING module_ident""")
+        module_ident = cursor.fetchone()[0]
+    conn.commit()
+    hits_file = tmpdir.join('hits.csv')
+    hits_file.write('{0},2019-01-01,2019-01-02,3\n'
+                    '\n'
+                    '{0},2019-01-02\n'.format(module_ident))
+
+    from cnxdb.cli.main import main
+    args = ['ingest-hits', '--batch-size', '1', str(hits_file)]
+
+    return_code = main(args)
+    assert return_code == 5
+    assert 'line 3' in capsys.readouterr()[1]
+
+    # The batch copied before the malformed row is rolled back
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM document_hits")
+        assert cursor.fetchone()[0] == 0
+    conn.close()
+
+
+@pytest.mark.usefixtures('db_wipe')
+def test_ingest_hits_without_env_vars(capsys, mocker):
+    mocker.patch.dict('os.environ', {}, clear=True)
+
+    from cnxdb.cli.main import main
+    args = ['ingest-hits']
+
+    return_code = main(args)
+    assert return_code == 4
+
+    expected_msg = ("'DB_URL' environment variable "
+                    "OR the 'db.common.url' setting MUST be defined\n")
+    assert expected_msg in capsys.readouterr()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_gen_collxml(capsys, db_env_vars, db_engines):
+    conn = db_engines['super'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER")
+        cursor.execute("""\
+INSERT INTO abstracts (abstract) VALUES ('summary') RETURNING abstractid""")
+        abstractid = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     abstractid, major_version, minor_version)
+VALUES ('Collection', 'col1', '1.2', 'Book', 11, '', %s, 1, 2)
+RETURNING module_ident""", (abstractid,))
+        module_ident = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO trees (documentid) VALUES (%s)",
+                       (module_ident,))
+        cursor.execute("INSERT INTO collxml_queue (module_ident) VALUES (%s)",
+                       (module_ident,))
+    conn.commit()
+
+    from cnxdb.cli.main import main
+    args = ['gen-collxml', '--workers', '2']
+
+    return_code = main(args)
+    assert return_code == 0
+    assert 'Generated 1 collection.xml files' in capsys.readouterr()[0]
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM collxml_queue")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("SELECT count(*) FROM module_files "
+                       "WHERE filename = 'collection.xml'")
+        assert cursor.fetchone()[0] == 1
+    conn.close()
+
+
+@pytest.mark.usefixtures('db_wipe')
+def test_gen_collxml_without_env_vars(capsys, mocker):
+    mocker.patch.dict('os.environ', {}, clear=True)
+
+    from cnxdb.cli.main import main
+    args = ['gen-collxml']
+
+    return_code = main(args)
+    assert return_code == 4
+
+    expected_msg = ("'DB_URL' environment variable "
+                    "OR the 'db.common.url' setting MUST be defined\n")
+    assert expected_msg in capsys.readouterr()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_rebake_print_style(capsys, db_env_vars, db_engines):
+    conn = db_engines['super'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                       "ALTER TABLE modules "
+                       "ENABLE TRIGGER update_latest_version")
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, stateid,
+                     print_style)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, 'college'
+FROM generate_series(1, 3)""")
+    conn.commit()
+
+    from cnxdb.cli.main import main
+    args = ['rebake-print-style', 'college', '--throttle', '2']
+
+    return_code = main(args)
+    assert return_code == 0
+    out = capsys.readouterr()[0]
+    assert 'Rebaking 2 books, 1 remaining' in out
+    assert 'Rebaking 3 books, 0 remaining' in out
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM modules WHERE stateid = 5")
+        assert cursor.fetchone()[0] == 3
+    conn.close()
+
+
+@pytest.mark.usefixtures('db_wipe')
+def test_rebake_print_style_without_env_vars(capsys, mocker):
+    mocker.patch.dict('os.environ', {}, clear=True)
+
+    from cnxdb.cli.main import main
+    args = ['rebake-print-style', 'college']
+
+    return_code = main(args)
+    assert return_code == 4
+
+    expected_msg = ("'DB_URL' environment variable "
+                    "OR the 'db.common.url' setting MUST be defined\n")
+    assert expected_msg in capsys.readouterr()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_gen_html_abstracts(capsys, db_env_vars, db_engines):
+    conn = db_engines['super'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER collection_html_abstract_trigger;
+ALTER TABLE modules ENABLE TRIGGER process_html_abstracts;
+SET LOCAL cnxdb.html_abstract_mode = 'async';""")
+        cursor.execute("INSERT INTO abstracts (abstract) "
+                       "VALUES ('A book'), ('Another book') "
+                       "RETURNING abstractid")
+        abstractids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype, stateid, abstractid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, abstractid
+FROM unnest(%s) AS abstractid""", (abstractids,))
+    conn.commit()
+
+    from cnxdb.cli.main import main
+    args = ['gen-html-abstracts', '--batch-size', '1']
+
+    return_code = main(args)
+    assert return_code == 0
+    assert 'Transformed 2 abstracts' in capsys.readouterr()[0]
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM html_abstract_queue")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("SELECT count(*) FROM abstracts WHERE html IS NULL")
+        assert cursor.fetchone()[0] == 0
+    conn.close()
+
+
+@pytest.mark.usefixtures('db_wipe')
+def test_gen_html_abstracts_without_env_vars(capsys, mocker):
+    mocker.patch.dict('os.environ', {}, clear=True)
+
+    from cnxdb.cli.main import main
+    args = ['gen-html-abstracts']
+
+    return_code = main(args)
+    assert return_code == 4
+
+    expected_msg = ("'DB_URL' environment variable "
+                    "OR the 'db.common.url' setting MUST be defined\n")
+    assert expected_msg in capsys.readouterr()
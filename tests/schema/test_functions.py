@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+import uuid
+
+from cnxdb.contrib import testing
+
+
+def test_uuid5(db_init_and_wipe, db_cursor):
+    namespace = uuid.UUID('d395b566-5fe3-4428-bcb2-19016e3aa3ce')
+    for name in (u'Introduction', u'Préface', u''):
+        db_cursor.execute("SELECT uuid5(%s::uuid, %s)::text",
+                          (str(namespace), name))
+        if not testing.is_py3():
+            name = name.encode('utf-8')
+        expected = uuid.uuid5(namespace, name)
+        assert db_cursor.fetchone()[0] == str(expected)
+
+
+def test_uuid_generate_v4(db_init_and_wipe, db_cursor):
+    db_cursor.execute("SELECT uuid_generate_v4()::text, "
+                      "uuid_generate_v4()::text")
+    first, second = db_cursor.fetchone()
+    assert uuid.UUID(first).version == 4
+    assert first != second
+
+
+def test_sha1(db_init_and_wipe, db_cursor):
+    db_cursor.execute("SELECT sha1('abc'::text), sha1('abc'::bytea)")
+    expected = 'a9993e364706816aba3e25717850c26c9cd0d89d'
+    assert db_cursor.fetchone() == (expected, expected)
+
+
+def test_strip_html(db_init_and_wipe, db_cursor):
+    name = ''.join('<i>{}</i> '.format(i) for i in range(10))
+    db_cursor.execute("SELECT strip_html(%s)", (name,))
+    assert db_cursor.fetchone()[0] == '0 1 2 3 4 5 6 7 8 9 '
+
+
+def test_array_position(db_init_and_wipe, db_cursor):
+    db_cursor.execute("SELECT array_position(ARRAY['a', 'b', 'c'], 'b'), "
+                      "array_position(ARRAY['a', 'b'], 'z'), "
+                      "array_position('[0:2]={a,b,c}'::text[], 'c'), "
+                      "array_position(ARRAY['a', 'b', 'c'], ARRAY['c']), "
+                      "idx(ARRAY['a', 'b', 'c'], 'a')")
+    assert db_cursor.fetchone() == (2, None, 2, 3, 1)
+
+
+def test_to_uuid(db_init_and_wipe, db_cursor):
+    expected = 'd395b566-5fe3-4428-bcb2-19016e3aa3ce'
+    values = [
+        'd395b566-5fe3-4428-bcb2-19016e3aa3ce',
+        '{D395B566-5FE3-4428-BCB2-19016E3AA3CE}',
+        'd395b5665fe34428bcb219016e3aa3ce',
+        # Malformed
+        'd395b566-5fe3-4428-bcb2-19016e3aa3c',
+        'd395b566-5fe3-4428-bcb2-19016e3aa3ce}',
+        '{d395b566-5fe3-4428-bcb2-19016e3aa3ce',
+        'd395b566-5fe3-4428-bcb2-19016e3aa3cg',
+        '',
+        None,
+    ]
+    db_cursor.execute("SELECT to_uuid(v)::text FROM unnest(%s::text[]) AS v",
+                      (values,))
+    assert [row[0] for row in db_cursor.fetchall()] == (
+        [expected] * 3 + [None] * 6)
+
+
+def test_ident_hash_parts(db_init_and_wipe, db_cursor):
+    uuid_ = 'd395b566-5fe3-4428-bcb2-19016e3aa3ce'
+    db_cursor.execute("""\
+SELECT ident_hash_uuid(v)::text, ident_hash_version(v)
+FROM unnest(%s::text[]) AS v""", ([uuid_ + '@1.2', uuid_ + '@3', uuid_,
+                                  'nope@1'],))
+    assert db_cursor.fetchall() == [(uuid_, '1.2'), (uuid_, '3'),
+                                    (uuid_, ''), (None, '1')]
+
+
+def test_version_parts(db_init_and_wipe, db_cursor):
+    values = ['1.2', '3', '0.0', '10.20',
+              # Malformed
+              '01.2', '1.02', '1.2.3', '1.', '.2', 'a.b', '', None]
+    db_cursor.execute("""\
+SELECT version_major(v), version_minor(v)
+FROM unnest(%s::text[]) AS v""", (values,))
+    assert db_cursor.fetchall() == [
+        (1, 2), (3, None), (0, 0), (10, 20),
+    ] + [(None, None)] * 8
+
+
+def test_module_version_is(db_init_and_wipe, db_cursor):
+    cases = [
+        # major, minor, version, expected
+        (1, 2, '1.2', True),
+        (3, None, '3', True),
+        (1, 2, '3', False),
+        (3, None, '1.2', False),
+        (1, 2, '1', False),
+        (1, None, '1.2', False),
+        (1, 2, '1.3', False),
+        (1, 2, '01.2', False),
+        (1, 2, '1.2.3', False),
+        (1, None, '', False),
+        (1, None, None, False),
+    ]
+    for major, minor, version, expected in cases:
+        # Matches the module_version comparison it replaces
+        db_cursor.execute("""\
+SELECT module_version_is(%(major)s, %(minor)s, %(version)s) IS TRUE,
+       module_version(%(major)s, %(minor)s) = %(version)s IS TRUE""",
+                          {'major': major, 'minor': minor,
+                           'version': version})
+        assert db_cursor.fetchone() == (expected, expected), \
+            (major, minor, version)
+
+
+def test_is_baked(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees DISABLE TRIGGER USER")
+    try:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype,
+                     major_version, minor_version)
+VALUES ('Collection', uuid_generate_v4(), 'Book', 11, '', 1, 2)
+RETURNING module_ident, uuid""")
+        module_ident, uuid_ = cursor.fetchone()
+        cursor.execute("INSERT INTO trees (documentid, is_collated) "
+                       "VALUES (%s, FALSE), (%s, TRUE)",
+                       (module_ident, module_ident))
+
+        for version, expected in [('1.2', True), ('1', None),
+                                  ('1.3', None), ('2.1', None)]:
+            cursor.execute("SELECT is_baked(%s, %s)", (uuid_, version))
+            assert cursor.fetchone()[0] is expected, version
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+BARETEXT_CNXML = b"""\
+<?xml version="1.0" encoding="utf-8"?>
+<document xmlns="http://cnx.rice.edu/cnxml"
+          xmlns:md="http://cnx.rice.edu/mdml"
+          xmlns:md4="http://cnx.rice.edu/mdml/0.4"
+          xmlns:m="http://www.w3.org/1998/Math/MathML"
+          xmlns:xhtml="http://www.w3.org/1999/xhtml">
+  <title>Mixed markup</title>
+  <metadata><md:title>Metadata title</md:title>
+    <md4:abstract>Old abstract</md4:abstract></metadata>
+  <content>
+    <para id="p1">A <term>term</term>, some <emphasis effect="bold">bold
+      <emphasis>nested</emphasis> text</emphasis> and a
+      <link url="http://cnx.org">link</link>.<xhtml:cnx-pi>pi</xhtml:cnx-pi>
+      Tail after the pi with <m:math><m:mi>x</m:mi></m:math> math.</para>
+  </content>
+</document>
+"""
+
+
+def test_baretext_extractors(db_init_and_wipe, db_cursor):
+    content = memoryview(BARETEXT_CNXML)
+    db_cursor.execute(
+        "SELECT xml_to_baretext(convert_from(%s, 'UTF8')::xml)::text, "
+        "xml_to_baretext_lxml(%s)", (content, content))
+    xslt_text, lxml_text = db_cursor.fetchone()
+
+    assert lxml_text == xslt_text
+    assert 'some bold\n      nested text and a' in lxml_text
+    assert 'Tail after the pi' in lxml_text
+    for stripped in ('Metadata title', 'Old abstract', 'link.pi'):
+        assert stripped not in lxml_text
+
+    # The setting selects the extractor used by fulltext_baretext
+    for extractor in ('xslt', 'lxml'):
+        db_cursor.execute("SET LOCAL cnxdb.baretext_extractor = %s",
+                          (extractor,))
+        db_cursor.execute("SELECT fulltext_baretext(%s)", (content,))
+        assert db_cursor.fetchone()[0] == xslt_text
+
+
+def test_legacy_content(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees DISABLE TRIGGER USER")
+
+    def insert_module(portal_type, moduleid, name):
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype)
+VALUES (%s, %s, '1.1', %s, 11, '') RETURNING module_ident""",
+                       (portal_type, moduleid, name))
+        return cursor.fetchone()[0]
+
+    def insert_node(parent_id, documentid, childorder, title=None,
+                    latest=None):
+        cursor.execute("""\
+INSERT INTO trees (parent_id, documentid, childorder, title, latest)
+VALUES (%s, %s, %s, %s, %s) RETURNING nodeid""",
+                       (parent_id, documentid, childorder, title, latest))
+        return cursor.fetchone()[0]
+
+    try:
+        root = insert_node(None, insert_module('Collection', 'col1', 'C'), 0)
+        subcol = insert_node(root, insert_module('SubCollection', None, 'S'),
+                             2)
+        insert_node(subcol, insert_module('SubCollection', None, 'E'), 2)
+        insert_node(subcol, insert_module('Module', 'm2', 'B'), 1,
+                    latest=True)
+        insert_node(root, insert_module('Module', 'm1', 'A'), 1,
+                    title='Intro & more')
+
+        cursor.execute("SELECT legacy_content(%s, 'R')::text", (root,))
+        assert cursor.fetchone()[0] == (
+            '<col:content>'
+            '<col:module document="m1" version="1.1" repository="R" '
+            'cnxorg:version-at-this-collection-version="1.1">'
+            '<md:title>Intro &amp; more</md:title></col:module>'
+            '<col:subcollection><md:title>S</md:title><col:content>'
+            '<col:module document="m2" version="latest" repository="R" '
+            'cnxorg:version-at-this-collection-version="1.1">'
+            '<md:title>B</md:title></col:module>'
+            '<col:subcollection><md:title>E</md:title><col:content/>'
+            '</col:subcollection>'
+            '</col:content></col:subcollection>'
+            '</col:content>')
+
+        cursor.execute("SELECT legacy_content(%s, 'R')::text", (subcol + 1,))
+        assert cursor.fetchone()[0] == '<col:content/>'
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_legacy_mdml_inner_cached(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE modules ENABLE TRIGGER invalidate_legacy_mdml")
+    try:
+        cursor.execute("""\
+INSERT INTO abstracts (abstract) VALUES ('summary') RETURNING abstractid""")
+        abstractid = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     abstractid)
+VALUES ('Module', 'm1', '1.1', 'Old name', 11, '', %s)
+RETURNING module_ident""", (abstractid,))
+        module_ident = cursor.fetchone()[0]
+
+        cursor.execute("SELECT legacy_mdml_inner_cached(%s)::text, "
+                       "legacy_mdml_inner(%s)::text",
+                       (module_ident, module_ident))
+        cached, fragment = cursor.fetchone()
+        assert cached == fragment
+        assert 'Old name' in cached
+        cursor.execute("SELECT count(*) FROM legacy_mdml_fragments")
+        assert cursor.fetchone()[0] == 1
+
+        cursor.execute("UPDATE modules SET name = 'New name' "
+                       "WHERE module_ident = %s", (module_ident,))
+        cursor.execute("SELECT count(*) FROM legacy_mdml_fragments")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("SELECT legacy_mdml_inner_cached(%s)::text",
+                       (module_ident,))
+        assert 'New name' in cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_legacy_mdml_invalidation(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE modules ENABLE TRIGGER invalidate_legacy_mdml")
+
+    def cache(module_ident):
+        cursor.execute("SELECT legacy_mdml_inner_cached(%s)::text",
+                       (module_ident,))
+        return cursor.fetchone()[0]
+
+    def cached():
+        cursor.execute("SELECT module_ident FROM legacy_mdml_fragments "
+                       "ORDER BY module_ident")
+        return [row[0] for row in cursor.fetchall()]
+
+    try:
+        cursor.execute("""\
+INSERT INTO abstracts (abstract) VALUES ('summary') RETURNING abstractid""")
+        abstractid = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     abstractid)
+VALUES ('Module', 'm1', '1.1', 'Parent', 11, '', %s)
+RETURNING module_ident""", (abstractid,))
+        parent = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     abstractid, parent)
+VALUES ('Module', 'm2', '1.1', 'Child', 11, '', %s, %s)
+RETURNING module_ident""", (abstractid, parent))
+        child = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO keywords (word) VALUES ('old keyword') RETURNING keywordid""")
+        keywordid = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO modulekeywords (module_ident, keywordid) "
+                       "VALUES (%s, %s)", (child, keywordid))
+
+        # The non-recursive derived-from has the parent's url
+        assert '/m1/1.1' in cache(child)
+        cursor.execute("UPDATE modules SET version = '1.2' "
+                       "WHERE module_ident = %s", (parent,))
+        assert cached() == []
+        assert '/m1/1.2' in cache(child)
+
+        assert 'old keyword' in cache(child)
+        cursor.execute("UPDATE keywords SET word = 'new keyword' "
+                       "WHERE keywordid = %s", (keywordid,))
+        assert cached() == []
+        assert 'new keyword' in cache(child)
+
+        cache(parent)
+        cursor.execute("INSERT INTO persons (personid) VALUES ('someone')")
+        assert cached() == []
+
+        # Read-only transactions don't write to the cache
+        cursor.execute("SET LOCAL transaction_read_only = on")
+        assert 'Child' in cache(child)
+        assert cached() == []
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_default_canonical_book(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees ENABLE TRIGGER update_page_books")
+
+    def insert_module(portal_type, uuid_, revised):
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, revised)
+VALUES (%s, %s, 'canonical test', 11, '', %s) RETURNING module_ident""",
+                       (portal_type, uuid_, revised))
+        return cursor.fetchone()[0]
+
+    def insert_node(parent_id, documentid):
+        cursor.execute("""\
+INSERT INTO trees (parent_id, documentid) VALUES (%s, %s)
+RETURNING nodeid""", (parent_id, documentid))
+        return cursor.fetchone()[0]
+
+    page_uuid = str(uuid.uuid4())
+    old_book_uuid = str(uuid.uuid4())
+    new_book_uuid = str(uuid.uuid4())
+    try:
+        page = insert_module('Module', page_uuid, '2018-01-01')
+        old_book = insert_node(
+            None, insert_module('Collection', old_book_uuid, '2018-02-01'))
+        new_book = insert_node(
+            None, insert_module('Collection', new_book_uuid, '2018-03-01'))
+        subcol = insert_node(
+            new_book, insert_module('SubCollection', str(uuid.uuid4()),
+                                    '2018-03-01'))
+        insert_node(subcol, page)
+        old_node = insert_node(None, page)
+
+        cursor.execute("SELECT default_canonical_book(%s)", (page_uuid,))
+        assert cursor.fetchone()[0] == new_book_uuid
+
+        # Moving the node into the older book
+        cursor.execute("UPDATE trees SET parent_id = %s WHERE nodeid = %s",
+                       (old_book, old_node))
+        cursor.execute("SELECT default_canonical_book(%s)", (page_uuid,))
+        assert cursor.fetchone()[0] == old_book_uuid
+
+        cursor.execute("DELETE FROM trees WHERE nodeid = %s", (old_node,))
+        cursor.execute("SELECT book_uuid::text FROM default_canonical_books() "
+                       "WHERE page_uuid = %s", (page_uuid,))
+        assert cursor.fetchall() == [(new_book_uuid,)]
+
+        # The incrementally maintained rows match a full rebuild
+        cursor.execute("SELECT * FROM page_books ORDER BY nodeid")
+        maintained = cursor.fetchall()
+        cursor.execute("SELECT rebuild_page_books()")
+        cursor.execute("SELECT * FROM page_books ORDER BY nodeid")
+        assert cursor.fetchall() == maintained
+        assert len(maintained) == 2
+    finally:
+        conn.rollback()
+        conn.close()
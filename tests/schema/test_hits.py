@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import uuid
+
+import pytest
+
+from cnxdb.contrib import testing
+
+
+@pytest.mark.skipif(testing.is_py3(),
+                    reason="triggers are only python2.x compat")
+class TestHitAggregates:
+
+    def _make_one(self, cursor):
+        """Insert the minimum necessary for creating a 'modules' entry."""
+        uuid_ = str(uuid.uuid4())
+        cursor.execute("INSERT INTO document_controls (uuid) VALUES (%s)",
+                       (uuid_,))
+        cursor.execute("""\
+        INSERT INTO modules
+          (module_ident, portal_type, uuid, name, licenseid, doctype)
+        VALUES
+          (DEFAULT, 'Module', %s, 'Hits', 11, '')
+        RETURNING module_ident""", (uuid_,))
+        return cursor.fetchone()[0]
+
+    def _add_hits(self, cursor, module_ident, *hits, **kwargs):
+        days_ago = kwargs.get('days_ago', 1)
+        for count in hits:
+            cursor.execute("""\
+            INSERT INTO document_hits
+              (documentid, start_timestamp, end_timestamp, hits)
+            VALUES (%s, NOW() - %s * interval '1 day',
+                    NOW() - (%s - 1) * interval '1 day', %s)""",
+                           (module_ident, days_ago, days_ago, count))
+
+    def test_incremental(self, db_cursor):
+        first = self._make_one(db_cursor)
+        second = self._make_one(db_cursor)
+        self._add_hits(db_cursor, first, 10, 20)
+        self._add_hits(db_cursor, second, 5)
+
+        db_cursor.execute("SELECT update_hit_aggregates()")
+        assert db_cursor.fetchone()[0] == 3
+        # Nothing new to fold in.
+        db_cursor.execute("SELECT update_hit_aggregates()")
+        assert db_cursor.fetchone()[0] == 0
+
+        self._add_hits(db_cursor, first, 30)
+        db_cursor.execute("SELECT update_hit_aggregates()")
+        assert db_cursor.fetchone()[0] == 1
+
+        db_cursor.execute("""\
+        SELECT hit_average(%s, 'f'), hit_rank(%s, 'f'),
+               hit_average(%s, 'f'), hit_rank(%s, 'f')""",
+                          (first, first, second, second))
+        assert db_cursor.fetchone() == (20.0, 2, 5.0, 1)
+
+    def test_update_hit_ranks(self, db_cursor):
+        module_ident = self._make_one(db_cursor)
+        self._add_hits(db_cursor, module_ident, 1, 3)
+
+        db_cursor.execute("SELECT update_hit_ranks()")
+        db_cursor.execute("""\
+        SELECT hits, average FROM overall_hit_ranks
+        WHERE document = (SELECT uuid FROM modules WHERE module_ident = %s)""",
+                          (module_ident,))
+        assert db_cursor.fetchone() == (4, 2.0)
+
+    def test_prune(self, db_cursor):
+        module_ident = self._make_one(db_cursor)
+        self._add_hits(db_cursor, module_ident, 100, days_ago=400)
+        self._add_hits(db_cursor, module_ident, 2, 4)
+
+        db_cursor.execute("SELECT prune_document_hits('1 year')")
+        assert db_cursor.fetchone()[0] == 1
+
+        db_cursor.execute("""\
+        SELECT count(*) FROM document_hits WHERE documentid = %s""",
+                          (module_ident,))
+        assert db_cursor.fetchone()[0] == 2
+        # The pruned hits are still part of the overall totals,
+        # but not part of the recent ones.
+        db_cursor.execute("SELECT hit_average(%s, 'f'), hit_average(%s, 't')",
+                          (module_ident, module_ident))
+        assert db_cursor.fetchone() == (106 / 3.0, 3.0)
+
+    def test_recent_with_unfolded_hits(self, db_cursor):
+        module_ident = self._make_one(db_cursor)
+        self._add_hits(db_cursor, module_ident, 10, days_ago=10)
+        db_cursor.execute("SELECT update_hit_aggregates()")
+        # Newer hits, loaded but not folded into the rollups yet,
+        # do not move the recent window past the rollups.
+        self._add_hits(db_cursor, module_ident, 50, days_ago=-10)
+
+        db_cursor.execute("SELECT hit_average(%s, 't'), hit_rank(%s, 't')",
+                          (module_ident, module_ident))
+        assert db_cursor.fetchone() == (10.0, 1)
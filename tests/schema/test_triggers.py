@@ -130,3 +130,325 @@ INSERT INTO latest_modules (moduleid, version, name, \
         _, exit_code = os.waitpid(pid, 0)
         if exit_code != 0:
             assert False, 'update_latest trigger test failed'
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_update_latest(db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE latest_modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER update_latest_version;""")
+
+    def publish(uuid_, moduleid, major_version, buylink=None):
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, moduleid, name, licenseid, doctype,
+                     major_version, buylink)
+VALUES ('Module', %s, %s, 'Page', 11, '', %s, %s)
+RETURNING module_ident""", (uuid_, moduleid, major_version, buylink))
+        return cursor.fetchone()[0]
+
+    def latest(uuid_):
+        cursor.execute("""\
+SELECT module_ident, moduleid, major_version, buylink
+FROM latest_modules WHERE uuid = %s""", (uuid_,))
+        return cursor.fetchall()
+
+    try:
+        page_uuid = str(uuid.uuid4())
+        first = publish(page_uuid, 'm1', 1, 'http://buy/1')
+        assert latest(page_uuid) == [(first, 'm1', 1, 'http://buy/1')]
+
+        # A newer version replaces the row
+        second = publish(page_uuid, 'm1', 2, 'http://buy/2')
+        assert latest(page_uuid) == [(second, 'm1', 2, 'http://buy/2')]
+
+        # An older version is ignored
+        publish(page_uuid, 'm1', 1)
+        assert latest(page_uuid) == [(second, 'm1', 2, 'http://buy/2')]
+
+        # The moduleid reused under another uuid removes the old row
+        other_uuid = str(uuid.uuid4())
+        other = publish(other_uuid, 'm1', 1)
+        assert latest(page_uuid) == []
+        assert latest(other_uuid) == [(other, 'm1', 1, None)]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_module_publication_defaults(db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER act_10_module_publication_defaults;
+ALTER TABLE trees DISABLE TRIGGER USER;""")
+    try:
+        # cnx-publishing publication
+        uuid_ = str(uuid.uuid4())
+        cursor.execute("INSERT INTO document_controls (uuid) VALUES (%s)",
+                       (uuid_,))
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype)
+VALUES ('Collection', %s, 'Book', 11, '')
+RETURNING moduleid, version, major_version, minor_version""", (uuid_,))
+        moduleid, version, major_version, minor_version = cursor.fetchone()
+        assert moduleid.startswith('col')
+        assert (version, major_version, minor_version) == ('1.1', 1, 1)
+
+        # legacy publications
+        cursor.execute("""\
+INSERT INTO persons (personid, firstname, surname, fullname)
+VALUES ('ream', 'Ream', 'E', 'Ream E')""")
+
+        def publish(portal_type, moduleid, version):
+            cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid,
+                     doctype, authors, maintainers, licensors, submitter,
+                     submitlog)
+VALUES (%s, %s, %s, 'Legacy', 11, '', '{ream}', '{ream}', '{ream}',
+        'ream', 'log')
+RETURNING module_ident, uuid, major_version, minor_version""",
+                           (portal_type, moduleid, version))
+            return cursor.fetchone()
+
+        module_ident, module_uuid, major_version, minor_version = publish(
+            'Module', 'm42', '1.3')
+        assert (major_version, minor_version) == (3, None)
+        cursor.execute("SELECT user_id, permission::text FROM document_acl "
+                       "WHERE uuid = %s", (module_uuid,))
+        assert cursor.fetchall() == [('ream', 'publish')]
+        cursor.execute("SELECT full_name FROM users "
+                       "WHERE username = 'ream'")
+        assert cursor.fetchall() == [('Ream E',)]
+
+        book_ident, book_uuid, major_version, minor_version = publish(
+            'Collection', 'col42', '1.2')
+        assert (major_version, minor_version) == (2, 1)
+        cursor.execute("""\
+INSERT INTO trees (parent_id, documentid, childorder)
+VALUES (NULL, %s, 0) RETURNING nodeid""", (book_ident,))
+        cursor.execute("""\
+INSERT INTO trees (parent_id, documentid, childorder)
+VALUES (%s, %s, 1)""", (cursor.fetchone()[0], module_ident))
+
+        # Republishing the module republishes the collection
+        new_ident, new_uuid, major_version, minor_version = publish(
+            'Module', 'm42', '1.4')
+        assert (new_uuid, major_version) == (module_uuid, 4)
+        cursor.execute("""\
+SELECT m.major_version, m.minor_version, t.documentid
+FROM modules m
+  JOIN trees r ON r.documentid = m.module_ident AND r.parent_id IS NULL
+  JOIN trees t ON t.parent_id = r.nodeid
+WHERE m.uuid = %s ORDER BY m.minor_version""", (book_uuid,))
+        assert cursor.fetchall() == [(2, 1, module_ident),
+                                     (2, 2, new_ident)]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_post_publication_queue(db_engines):
+    from cnxdb.baking import claim_baking_jobs
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER post_publication_trigger;
+SET LOCAL cnxdb.post_publication_mode = 'queue';""")
+    try:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, stateid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 5
+FROM generate_series(1, 3)
+RETURNING module_ident, ident_hash(uuid, major_version, minor_version)""")
+        published = sorted(cursor.fetchall())
+        # Moving to stateid 5 again does not queue the modules twice
+        cursor.execute("UPDATE modules SET stateid = 5")
+
+        claimed = claim_baking_jobs(cursor, batch_size=2)
+        claimed.extend(claim_baking_jobs(cursor, batch_size=2))
+        assert sorted([row[:2] for row in claimed]) == published
+        assert claim_baking_jobs(cursor) == []
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_html_abstract_queue(db_engines):
+    from cnxdb.abstracts import process_html_abstract_queue
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER collection_html_abstract_trigger;
+ALTER TABLE modules ENABLE TRIGGER process_html_abstracts;
+SET LOCAL cnxdb.html_abstract_mode = 'async';""")
+    try:
+        cursor.execute("INSERT INTO abstracts (abstract) VALUES ('A book') "
+                       "RETURNING abstractid")
+        abstractid = cursor.fetchone()[0]
+        cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype, stateid, abstractid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, %s
+FROM generate_series(1, 3)""", (abstractid,))
+        # The abstract shared by the collections is queued once
+        cursor.execute("SELECT abstractid FROM html_abstract_queue")
+        assert cursor.fetchall() == [(abstractid,)]
+        cursor.execute("SELECT html FROM abstracts WHERE abstractid = %s",
+                       (abstractid,))
+        assert cursor.fetchone()[0] is None
+
+        assert process_html_abstract_queue(cursor) == ([abstractid], [])
+        assert process_html_abstract_queue(cursor) == ([], [])
+        cursor.execute("SELECT html FROM abstracts WHERE abstractid = %s",
+                       (abstractid,))
+        assert 'A book' in cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_html_abstract_queue_failure(db_engines):
+    from cnxdb.abstracts import process_html_abstract_queue
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER collection_html_abstract_trigger;
+ALTER TABLE modules ENABLE TRIGGER process_html_abstracts;
+SET LOCAL cnxdb.html_abstract_mode = 'async';""")
+    try:
+        cursor.execute("INSERT INTO abstracts (abstract) "
+                       "VALUES ('A book'), ('Broken') RETURNING abstractid")
+        abstractids = sorted(row[0] for row in cursor.fetchall())
+        cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype, stateid, abstractid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, abstractid
+FROM unnest(%s) AS abstractid""", (abstractids,))
+        # Make the transformation of the second abstract fail
+        cursor.execute("""\
+CREATE FUNCTION fail_html_abstract() RETURNS TRIGGER AS $$
+BEGIN
+  RAISE EXCEPTION 'cannot transform %', NEW.abstract;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER fail_html_abstract BEFORE UPDATE ON abstracts FOR EACH ROW
+WHEN (NEW.abstract = 'Broken') EXECUTE PROCEDURE fail_html_abstract();""")
+
+        processed, failed = process_html_abstract_queue(cursor)
+        assert (processed, failed) == ([abstractids[0]], [abstractids[1]])
+        # The failure is recorded, without undoing the other abstract
+        cursor.execute("SELECT abstractid, attempts, error "
+                       "FROM html_abstract_queue")
+        [(abstractid, attempts, error)] = cursor.fetchall()
+        assert (abstractid, attempts) == (abstractids[1], 1)
+        assert 'cannot transform Broken' in error
+        cursor.execute("SELECT html IS NOT NULL FROM abstracts "
+                       "ORDER BY abstractid")
+        assert cursor.fetchall() == [(True,), (False,)]
+
+        assert process_html_abstract_queue(cursor, max_attempts=1) == (
+            [], [])
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_process_html_abstracts(db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER collection_html_abstract_trigger;
+ALTER TABLE modules ENABLE TRIGGER process_html_abstracts;
+ALTER TABLE module_files DISABLE TRIGGER USER;
+ALTER TABLE module_files ENABLE TRIGGER module_html_abstract_trigger;
+ALTER TABLE module_files ENABLE TRIGGER process_html_abstracts;""")
+    try:
+        cursor.execute("INSERT INTO abstracts (abstract) "
+                       "VALUES ('A book'), ('A page') RETURNING abstractid")
+        book_abstractid, page_abstractid = sorted(
+            row[0] for row in cursor.fetchall())
+
+        # collections sharing an abstract, in one statement
+        cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype, stateid, abstractid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, %s
+FROM generate_series(1, 3)""", (book_abstractid,))
+        cursor.execute("SELECT count(*) FROM html_abstract_queue")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("SELECT html FROM abstracts WHERE abstractid = %s",
+                       (book_abstractid,))
+        assert 'A book' in cursor.fetchone()[0]
+
+        # a module's abstract is transformed with its index.cnxml
+        cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype, stateid, abstractid)
+VALUES ('Module', uuid_generate_v4(), 'Page', 11, '', 1, %s)
+RETURNING module_ident""", (page_abstractid,))
+        module_ident = cursor.fetchone()[0]
+        cursor.execute("SELECT html FROM abstracts WHERE abstractid = %s",
+                       (page_abstractid,))
+        assert cursor.fetchone()[0] is None
+        cursor.execute("INSERT INTO files (file, media_type) "
+                       "VALUES (%s, 'text/xml') RETURNING fileid",
+                       (memoryview(b'<document/>'),))
+        fileid = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO module_files "
+                       "(module_ident, fileid, filename) "
+                       "VALUES (%s, %s, 'index.cnxml')",
+                       (module_ident, fileid))
+        cursor.execute("SELECT count(*) FROM html_abstract_queue")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("SELECT html FROM abstracts WHERE abstractid = %s",
+                       (page_abstractid,))
+        assert 'A page' in cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_gen_minor_collxml_async(db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("""\
+ALTER TABLE modules DISABLE TRIGGER USER;
+ALTER TABLE modules ENABLE TRIGGER collection_minor_ver_collxml;
+SET LOCAL cnxdb.collxml_mode = 'async';""")
+    try:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     major_version, minor_version)
+VALUES ('Collection', 'col1', '1.2', 'Book', 11, '', 1, 2)
+RETURNING module_ident""")
+        module_ident = cursor.fetchone()[0]
+        # Fire the deferred trigger, twice
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("UPDATE modules SET name = 'Book' "
+                       "WHERE module_ident = %s", (module_ident,))
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        # Queued once, instead of generated
+        cursor.execute("SELECT module_ident FROM collxml_queue")
+        assert cursor.fetchall() == [(module_ident,)]
+        cursor.execute("SELECT count(*) FROM module_files "
+                       "WHERE module_ident = %s", (module_ident,))
+        assert cursor.fetchone()[0] == 0
+    finally:
+        conn.rollback()
+        conn.close()
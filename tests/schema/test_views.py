@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import uuid
+
+import pytest
+
+
+# The correlated subquery formulation these views used before
+# the DISTINCT ON formulation, which the results are compared against.
+PREVIOUS_LATEST_IDENTS = """\
+SELECT m2.module_ident
+FROM modules m2 JOIN modulestates ms ON m2.stateid = ms.stateid
+WHERE m2.major_version = (
+        SELECT max(major_version) FROM modules m3
+        WHERE m2.uuid = m3.uuid)
+      AND
+      (m2.minor_version IS NULL OR
+       m2.minor_version = (
+          SELECT max(minor_version) FROM modules m4
+          WHERE m2.uuid = m4.uuid AND m2.major_version = m4.major_version))
+"""
+
+# (major_version, minor_version, stateid) of each uuid's modules rows
+VERSIONS = [
+    # latest version is current
+    [(1, None, 1), (2, None, 1), (3, None, 1)],
+    # latest version has not baked
+    [(1, None, 1), (2, None, 6)],
+    # collection minor versions
+    [(1, 1, 1), (1, 2, 1), (2, 1, 8), (2, 2, 7)],
+    [(1, 1, 1), (2, 1, 1), (2, 3, 8), (2, 2, 1)],
+    # mixed null and non-null minor versions
+    [(1, None, 1), (1, 2, 1), (1, 3, 1)],
+    # duplicate versions
+    [(4, None, 1), (4, None, 8)],
+]
+
+
+@pytest.fixture
+def modules_cursor(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER")
+    for versions in VERSIONS:
+        uuid_ = str(uuid.uuid4())
+        for major_version, minor_version, stateid in versions:
+            cursor.execute("""\
+INSERT INTO modules
+  (portal_type, uuid, name, licenseid, doctype,
+   major_version, minor_version, stateid)
+VALUES ('Module', %s, 'view test', 11, '', %s, %s, %s)""",
+                           (uuid_, major_version, minor_version, stateid))
+    yield cursor
+    conn.rollback()
+    conn.close()
+
+
+def test_current_modules(modules_cursor):
+    modules_cursor.execute(
+        "SELECT module_ident FROM ({}) AS li "
+        "JOIN modules USING (module_ident) JOIN modulestates USING (stateid) "
+        "WHERE statename in ('current', 'fallback') "
+        "ORDER BY module_ident".format(PREVIOUS_LATEST_IDENTS))
+    expected = modules_cursor.fetchall()
+
+    modules_cursor.execute(
+        "SELECT module_ident FROM current_modules ORDER BY module_ident")
+    assert modules_cursor.fetchall() == expected
+    assert len(expected) == 6
+
+
+def test_all_current_modules(modules_cursor):
+    modules_cursor.execute("SELECT module_ident FROM ({}) AS li "
+                           "ORDER BY module_ident"
+                           .format(PREVIOUS_LATEST_IDENTS))
+    expected = modules_cursor.fetchall()
+
+    modules_cursor.execute(
+        "SELECT module_ident FROM all_current_modules ORDER BY module_ident")
+    assert modules_cursor.fetchall() == expected
+    assert len(expected) == 8
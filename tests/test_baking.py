@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+@pytest.fixture
+def queued_cursor(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE modules "
+                   "ENABLE TRIGGER post_publication_trigger;"
+                   "SET LOCAL cnxdb.post_publication_mode = 'queue'")
+    cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, stateid)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', stateid
+FROM unnest(ARRAY[1, 5, 1]) AS stateid
+RETURNING module_ident""")
+    idents = [row[0] for row in cursor.fetchall()]
+    # a rebake
+    cursor.execute("UPDATE modules SET stateid = 5 WHERE module_ident = %s",
+                   (idents[0],))
+    yield cursor, idents
+    conn.rollback()
+    conn.close()
+
+
+def test_claim_baking_jobs(queued_cursor):
+    from cnxdb.baking import (
+        claim_baking_jobs, complete_baking_job, release_baking_job,
+    )
+    cursor, idents = queued_cursor
+
+    # the new publication comes before the rebake
+    claimed = claim_baking_jobs(cursor, batch_size=1)
+    assert [(row[0], row[2]) for row in claimed] == [(idents[1], 1)]
+    claimed = claim_baking_jobs(cursor, batch_size=5)
+    assert [(row[0], row[2]) for row in claimed] == [(idents[0], 1)]
+    # the claimed jobs are hidden
+    assert claim_baking_jobs(cursor, batch_size=5) == []
+
+    complete_baking_job(cursor, idents[1])
+    release_baking_job(cursor, idents[0])
+    claimed = claim_baking_jobs(cursor, batch_size=5, max_attempts=2)
+    assert [(row[0], row[2]) for row in claimed] == [(idents[0], 2)]
+
+    release_baking_job(cursor, idents[0])
+    assert claim_baking_jobs(cursor, batch_size=5, max_attempts=2) == []
+    cursor.execute("SELECT module_ident FROM baking_queue")
+    assert cursor.fetchall() == [(idents[0],)]
+
+
+def test_complete_requeued_baking_job(queued_cursor):
+    from cnxdb.baking import claim_baking_jobs, complete_baking_job
+    cursor, idents = queued_cursor
+
+    claimed = claim_baking_jobs(cursor, batch_size=1)
+    assert [row[0] for row in claimed] == [idents[1]]
+    # a rebake requested while the job is claimed
+    cursor.execute("UPDATE modules SET stateid = 1 WHERE module_ident = %s;"
+                   "UPDATE modules SET stateid = 5 WHERE module_ident = %s",
+                   (idents[1], idents[1]))
+    cursor.execute("SELECT count(*) FROM baking_queue")
+    assert cursor.fetchone() == (2,)
+
+    complete_baking_job(cursor, idents[1])
+    cursor.execute("SELECT attempts, requeued FROM baking_queue "
+                   "WHERE module_ident = %s", (idents[1],))
+    assert cursor.fetchone() == (0, False)
+    claimed = claim_baking_jobs(cursor, batch_size=5)
+    assert sorted(row[0] for row in claimed) == sorted(idents[:2])
+
+    # without a new request, the completed job is removed
+    complete_baking_job(cursor, idents[1])
+    cursor.execute("SELECT module_ident FROM baking_queue")
+    assert cursor.fetchall() == [(idents[0],)]
+
+
+def test_rebake_print_style(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE modules ENABLE TRIGGER update_latest_version")
+    try:
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, stateid,
+                     print_style)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, print_style
+FROM unnest(ARRAY['college', 'college', 'college', 'other'])
+  AS print_style
+RETURNING module_ident""")
+        idents = sorted(row[0] for row in cursor.fetchall())
+
+        cursor.execute("SELECT * FROM rebake_print_style('college', 2)")
+        assert cursor.fetchone() == (2, 1, idents[1])
+        # a book baked and republished in the meantime is not moved again
+        cursor.execute("UPDATE modules SET stateid = 1 "
+                       "WHERE module_ident = %s", (idents[0],))
+        cursor.execute("SELECT * FROM rebake_print_style('college', 2, %s)",
+                       (idents[1],))
+        assert cursor.fetchone() == (1, 0, idents[2])
+        cursor.execute("SELECT * FROM rebake_print_style('college', NULL, %s)",
+                       (idents[2],))
+        assert cursor.fetchone() == (0, 0, idents[2])
+
+        cursor.execute("SELECT print_style, stateid FROM modules "
+                       "ORDER BY print_style, stateid")
+        assert cursor.fetchall() == [('college', 1), ('college', 5),
+                                     ('college', 5), ('other', 1)]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.usefixtures('db_init_and_wipe')
+def test_rebake_print_style_batches(db_engines):
+    from cnxdb.baking import rebake_print_style
+
+    conn = db_engines['super'].raw_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                       "ALTER TABLE modules "
+                       "ENABLE TRIGGER update_latest_version")
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, name, licenseid, doctype, stateid,
+                     print_style)
+SELECT 'Collection', uuid_generate_v4(), 'Book', 11, '', 1, 'college'
+FROM generate_series(1, 3)
+RETURNING module_ident""")
+        idents = sorted(row[0] for row in cursor.fetchall())
+    conn.commit()
+
+    results = []
+    try:
+        for rebaking, remaining in rebake_print_style(conn, 'college',
+                                                      throttle=1):
+            results.append((rebaking, remaining))
+            # every book is baked and back in the current state
+            # before the next batch
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE modules SET stateid = 1")
+            conn.commit()
+            assert len(results) <= len(idents)
+    finally:
+        conn.close()
+    assert results == [(1, 2), (1, 1), (1, 0)]
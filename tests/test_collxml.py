@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+@pytest.fixture
+def queued_cursor(db_init_and_wipe, db_engines):
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE module_files DISABLE TRIGGER USER")
+    cursor.execute("""\
+INSERT INTO abstracts (abstract) VALUES ('summary') RETURNING abstractid""")
+    abstractid = cursor.fetchone()[0]
+    idents = []
+    for i in range(3):
+        cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     abstractid, major_version, minor_version)
+VALUES ('Collection', 'col1', '1.2', 'Book', 11, '', %s, 1, 2)
+RETURNING module_ident""", (abstractid,))
+        ident = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO trees (documentid) VALUES (%s)", (ident,))
+        cursor.execute("INSERT INTO collxml_queue (module_ident) VALUES (%s)",
+                       (ident,))
+        idents.append(ident)
+    yield cursor, idents
+    conn.rollback()
+    conn.close()
+
+
+def test_process_collxml_queue(queued_cursor):
+    from cnxdb.collxml import process_collxml_queue
+    cursor, idents = queued_cursor
+
+    generated, failed = process_collxml_queue(cursor, batch_size=2)
+    assert (sorted(generated), failed) == (idents[:2], [])
+    assert process_collxml_queue(cursor, batch_size=2) == (idents[2:], [])
+    assert process_collxml_queue(cursor, batch_size=2) == ([], [])
+
+    cursor.execute("SELECT count(*) FROM collxml_queue")
+    assert cursor.fetchone()[0] == 0
+    cursor.execute("""\
+SELECT module_ident, convert_from(file, 'UTF8') LIKE '%%<col:collection%%'
+FROM module_files NATURAL JOIN files
+WHERE filename = 'collection.xml'
+ORDER BY module_ident""")
+    assert cursor.fetchall() == [(ident, True) for ident in idents]
+
+
+def test_process_collxml_queue_failure(queued_cursor):
+    from cnxdb.collxml import process_collxml_queue
+    cursor, idents = queued_cursor
+    # A collection without a tree, which fails to generate
+    cursor.execute("""\
+INSERT INTO modules (portal_type, moduleid, version, name, licenseid, doctype,
+                     major_version, minor_version)
+VALUES ('Collection', 'col2', '1.2', 'Broken', 11, '', 1, 2)
+RETURNING module_ident""")
+    broken = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO collxml_queue (module_ident) VALUES (%s)",
+                   (broken,))
+
+    generated, failed = process_collxml_queue(cursor, batch_size=10,
+                                              max_attempts=2)
+    assert (sorted(generated), failed) == (idents, [broken])
+    cursor.execute("SELECT module_ident, attempts, error IS NOT NULL "
+                   "FROM collxml_queue")
+    assert cursor.fetchall() == [(broken, 1, True)]
+
+    assert process_collxml_queue(cursor, max_attempts=2) == ([], [broken])
+    # Skipped once it failed max_attempts times
+    assert process_collxml_queue(cursor, max_attempts=2) == ([], [])
+    cursor.execute("SELECT attempts FROM collxml_queue")
+    assert cursor.fetchall() == [(2,)]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import io
+import uuid
+
+import pytest
+
+from cnxdb.contrib import testing
+
+
+def test_read_hits_csv():
+    from cnxdb.hits import read_hits_csv
+    fileobj = io.StringIO(
+        u'ident,start,end,hits\n'
+        u'12,2019-01-01T00:00:00Z,2019-01-02T00:00:00Z,10\n'
+        u'd395b566-5fe3-4428-bcb2-19016e3aa3ce@1,2019-01-01,2019-01-02,\n')
+
+    records = list(read_hits_csv(fileobj, has_header=True))
+
+    assert records == [
+        (12, '2019-01-01T00:00:00Z', '2019-01-02T00:00:00Z', 10),
+        ('d395b566-5fe3-4428-bcb2-19016e3aa3ce@1',
+         '2019-01-01', '2019-01-02', None),
+    ]
+
+
+def test_read_hits_csv_malformed():
+    from cnxdb.hits import read_hits_csv
+    fileobj = io.StringIO(
+        u'12,2019-01-01,2019-01-02,10\n'
+        u'\n'
+        u' , , , \n'
+        u'13,2019-01-01,2019-01-02,3\n'
+        u'14,2019-01-01\n')
+
+    records = read_hits_csv(fileobj)
+    # The empty rows are skipped
+    assert next(records) == (12, '2019-01-01', '2019-01-02', 10)
+    assert next(records) == (13, '2019-01-01', '2019-01-02', 3)
+    with pytest.raises(ValueError) as exc_info:
+        next(records)
+    assert 'line 5' in str(exc_info.value)
+
+    fileobj = io.StringIO(u'12,2019-01-01,2019-01-02,many\n')
+    with pytest.raises(ValueError) as exc_info:
+        list(read_hits_csv(fileobj))
+    assert 'line 1' in str(exc_info.value)
+
+
+@pytest.mark.skipif(testing.is_py3(),
+                    reason="triggers are only python2.x compat")
+def test_ingest_hits(db_cursor):
+    from cnxdb.hits import ingest_hits
+    uuid_ = str(uuid.uuid4())
+    db_cursor.execute("INSERT INTO document_controls (uuid) VALUES (%s)",
+                      (uuid_,))
+    db_cursor.execute("""\
+    INSERT INTO modules
+      (module_ident, portal_type, uuid, name, licenseid, doctype)
+    VALUES
+      (DEFAULT, 'Module', %s, 'Hits', 11, '')
+    RETURNING module_ident, ident_hash(uuid, major_version, minor_version)""",
+                      (uuid_,))
+    module_ident, ident_hash = db_cursor.fetchone()
+    unknown = '{}@1'.format(uuid.uuid4())
+    records = [
+        (module_ident, '2019-01-01', '2019-01-02', 3),
+        (ident_hash, '2019-01-02', '2019-01-03', 5),
+        (unknown, '2019-01-02', '2019-01-03', 7),
+    ]
+
+    loaded, unresolved = ingest_hits(db_cursor, records, batch_size=2,
+                                     update_ranks=True)
+
+    assert (loaded, unresolved) == (2, [unknown])
+    db_cursor.execute("""\
+    SELECT hits, average FROM overall_hit_ranks WHERE document = %s""",
+                      (uuid_,))
+    assert db_cursor.fetchone() == (8, 4.0)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+
+def test_to_server_side():
+    from cnxdb.queries import _to_server_side
+    sql, keys = _to_server_side(
+        "SELECT %(a)s, %(b)s, %(a)s WHERE x LIKE 'y%%'")
+    assert sql == "SELECT $1, $2, $1 WHERE x LIKE 'y%'"
+    assert keys == ['a', 'b']
+
+    sql, keys = _to_server_side("SELECT %s, %s")
+    assert sql == "SELECT $1, $2"
+    assert keys == [0, 1]
+
+
+def test_registry_loads_queries():
+    from cnxdb.queries import archive_queries
+    assert 'get-module' in archive_queries
+    assert 'get-users-by-ids' in archive_queries
+    # templates and DDL are not registered
+    assert 'get-in-book-search' not in archive_queries
+    assert 'create-db' not in archive_queries
+
+
+def test_execute(db_init_and_wipe, db_engines):
+    from cnxdb.queries import QueryRegistry
+    registry = QueryRegistry()
+    conn = db_engines['common'].raw_connection()
+    cursor = conn.cursor()
+    try:
+        for i in range(2):
+            registry.execute(cursor, 'get-users-by-ids', ('nobody',))
+            assert cursor.fetchall() == []
+            registry.execute(cursor, 'get-module-uuid', {'id': 'm1'})
+            assert cursor.fetchall() == []
+        cursor.execute("SELECT name FROM pg_prepared_statements "
+                       "ORDER BY name")
+        assert cursor.fetchall() == [('cnxdb_get_module_uuid',),
+                                     ('cnxdb_get_users_by_ids',)]
+        assert registry.stats['get-module-uuid']['calls'] == 2
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_books_containing_page(db_init_and_wipe, db_engines):
+    from cnxdb.queries import execute
+    conn = db_engines['super'].raw_connection()
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE modules DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees DISABLE TRIGGER USER;"
+                   "ALTER TABLE trees ENABLE TRIGGER update_page_books")
+
+    def insert_module(portal_type, uuid_, major_version, minor_version,
+                      authors, revised):
+        cursor.execute("""\
+INSERT INTO modules (portal_type, uuid, major_version, minor_version, name,
+                     licenseid, doctype, authors, revised)
+VALUES (%s, %s, %s, %s, 'book', 11, '', %s, %s) RETURNING module_ident""",
+                       (portal_type, uuid_, major_version, minor_version,
+                        authors, revised))
+        return cursor.fetchone()[0]
+
+    def insert_node(parent_id, documentid, title=None):
+        cursor.execute("""\
+INSERT INTO trees (parent_id, documentid, title) VALUES (%s, %s, %s)
+RETURNING nodeid""", (parent_id, documentid, title))
+        return cursor.fetchone()[0]
+
+    page_uuid = '88cd206d-66d2-48f9-86bb-75d5366582ee'
+    book_uuid = 'e79ffde3-7fb4-4af3-9ec8-df648b391597'
+    other_uuid = '3b2fe22f-d2bc-4e81-a3a3-a6b1fd7e8ee1'
+    unknown_uuid = '5a2e5c4e-3e0d-4d3c-9a6c-0f5d3c0b8c11'
+    try:
+        cursor.execute("""\
+INSERT INTO users (username, first_name, last_name, full_name)
+VALUES ('ream', 'Ream', 'E', 'Ream E'), ('rings', 'Rings', 'F', 'Rings F')""")
+        page = insert_module('Module', page_uuid, 1, None, ['ream'],
+                             '2018-01-01')
+        for minor_version, revised in ((1, '2018-02-01'), (2, '2018-03-01')):
+            book = insert_module('Collection', book_uuid, 1, minor_version,
+                                 ['rings', 'ream'], revised)
+            insert_node(insert_node(None, book, title='Book'), page)
+        other = insert_module('Collection', other_uuid, 1, 1, ['ream'],
+                              '2018-02-15')
+        insert_node(insert_node(None, other), page)
+        # Books whose authors are not users are left out
+        unknown = insert_module('Collection', unknown_uuid, 1, 1,
+                                ['unknown'], '2018-04-01')
+        insert_node(insert_node(None, unknown), page)
+
+        execute(cursor, 'get-books-containing-page',
+                {'document_uuid': page_uuid, 'document_version': '1'})
+        results = [(title, ident_hash, [a['username'] for a in authors])
+                   for title, ident_hash, short_id, authors, revised
+                   in cursor.fetchall()]
+        assert results == [
+            ('book', '{}@1.1'.format(other_uuid), ['ream']),
+            ('Book', '{}@1.2'.format(book_uuid), ['rings', 'ream']),
+        ]
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def fileid(db_cursor):
+    content = b''.join(
+        '{:04d}'.format(i).encode('ascii') for i in range(1000))
+    db_cursor.execute("INSERT INTO files (file, media_type) "
+                      "VALUES (%s, 'text/plain') RETURNING fileid",
+                      (memoryview(content),))
+    fileid = db_cursor.fetchone()[0]
+    yield fileid, content
+    db_cursor.connection.rollback()
+
+
+def test_get_resource_info_by_hash(fileid, db_cursor):
+    from cnxdb.resources import get_resource_info_by_hash, ResourceInfo
+    fileid, content = fileid
+    sha1 = hashlib.sha1(content).hexdigest()
+
+    info = get_resource_info_by_hash(db_cursor, sha1)
+
+    assert info == ResourceInfo(fileid, 'text/plain', 4000, sha1)
+    assert get_resource_info_by_hash(db_cursor, 'missing') is None
+
+
+def test_read_resource(fileid, db_cursor):
+    from cnxdb.resources import read_resource
+    fileid, content = fileid
+
+    chunks = list(read_resource(db_cursor, fileid, chunk_size=1024))
+    assert [len(c) for c in chunks] == [1024, 1024, 1024, 928]
+    assert b''.join(chunks) == content
+
+    chunks = list(read_resource(db_cursor, fileid, start=10, end=2058,
+                                chunk_size=1024))
+    assert [len(c) for c in chunks] == [1024, 1024]
+    assert b''.join(chunks) == content[10:2058]
+
+    assert list(read_resource(db_cursor, fileid, start=4000)) == []
+
+
+def test_store_resource(fileid, db_cursor):
+    from cnxdb.resources import store_resource
+    fileid, content = fileid
+
+    assert store_resource(db_cursor, content, 'text/plain') == fileid
+
+    new_fileid = store_resource(db_cursor, b'new content', 'text/plain')
+    assert new_fileid != fileid
+    db_cursor.execute("SELECT size FROM files WHERE fileid = %s",
+                      (new_fileid,))
+    assert db_cursor.fetchone()[0] == 11
+    db_cursor.execute("SELECT get_or_insert_file(%s, 'text/plain')",
+                      (memoryview(b'new content'),))
+    assert db_cursor.fetchone()[0] == new_fileid
+
+
+def test_store_resource_without_media_type(db_cursor):
+    from cnxdb.resources import store_resource
+
+    fileid = store_resource(db_cursor, b'untyped content', None)
+
+    assert fileid is not None
+    db_cursor.execute("SELECT media_type, size FROM files "
+                      "WHERE fileid = %s", (fileid,))
+    assert db_cursor.fetchone() == (None, 15)
+    db_cursor.execute("SELECT get_or_insert_file(%s, NULL)",
+                      (memoryview(b'untyped content'),))
+    assert db_cursor.fetchone()[0] == fileid
+    db_cursor.connection.rollback()
+
+
+def test_get_or_insert_file_without_content(db_cursor):
+    import psycopg2
+
+    with pytest.raises(psycopg2.DataError) as exc_info:
+        db_cursor.execute("SELECT get_or_insert_file(NULL, 'text/plain')")
+    assert 'must not be NULL' in str(exc_info.value)
+    db_cursor.connection.rollback()